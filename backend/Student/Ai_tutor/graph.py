@@ -15,6 +15,7 @@ try:
     from backend.Student.Ai_tutor.rag import rag_node
     from backend.Student.Ai_tutor.websearch import websearch_node
     from backend.Student.Ai_tutor.image import image_node
+    from backend.speculation import speculative_node
 except ImportError:
     from Student.Ai_tutor.graph_type import StudentGraphState
     from Student.Ai_tutor.observality import trace_node
@@ -23,15 +24,16 @@ except ImportError:
     from Student.Ai_tutor.rag import rag_node
     from Student.Ai_tutor.websearch import websearch_node
     from Student.Ai_tutor.image import image_node
+    from speculation import speculative_node
 
 
 def create_student_ai_tutor_graph():
     graph = StateGraph(StudentGraphState)
 
     graph.add_node("orchestrator", trace_node(orchestrator_node, "student_orchestrator"))
-    graph.add_node("simple_llm", trace_node(simple_llm_node, "student_simple_llm"))
-    graph.add_node("rag", trace_node(rag_node, "student_rag"))
-    graph.add_node("websearch", trace_node(websearch_node, "student_websearch"))
+    graph.add_node("simple_llm", trace_node(speculative_node("student", "simple_llm", simple_llm_node), "student_simple_llm"))
+    graph.add_node("rag", trace_node(speculative_node("student", "rag", rag_node), "student_rag"))
+    graph.add_node("websearch", trace_node(speculative_node("student", "websearch", websearch_node), "student_websearch"))
     graph.add_node("image", trace_node(image_node, "student_image"))
 
     graph.set_entry_point("orchestrator")
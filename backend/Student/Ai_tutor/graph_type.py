@@ -39,4 +39,5 @@ class StudentGraphState(TypedDict, total=False):
     edit_img_urls: Optional[List[str]]
     img_urls: Optional[List[str]] 
     next_node: Optional[str]
+    speculation: Optional[Any]
 
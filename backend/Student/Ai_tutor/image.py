@@ -12,11 +12,14 @@ from typing import List, Dict, Any
 import replicate  
 
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_groq import ChatGroq
 
 try:
+    from backend.llm import get_groq_llm
+    from backend.rate_limiter import limiters
     from backend.Student.Ai_tutor.graph_type import StudentGraphState
 except ImportError:
+    from llm import get_groq_llm
+    from rate_limiter import limiters
     from Student.Ai_tutor.graph_type import StudentGraphState
 
 
@@ -199,16 +202,9 @@ Your output must be ONLY the final image generation prompt text - no explanation
     human_prompt = xml_prompt
 
     try:
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        llm_kwargs = {
-            "model": "llama-3.1-8b-instant",
-            "temperature": 0.5
-        }
-        if groq_api_key:
-            llm_kwargs["groq_api_key"] = groq_api_key
-        else:
+        if not os.getenv("GROQ_API_KEY"):
             print("⚠️ GROQ_API_KEY not found, using default")
-        llm = ChatGroq(**llm_kwargs)   
+        llm = get_groq_llm("llama-3.1-8b-instant", 0.5)
         response = await llm.ainvoke(
             [SystemMessage(content=system_prompt), HumanMessage(content=human_prompt)]
         )
@@ -277,16 +273,9 @@ Return ONLY the JSON.
 """
 
     try:
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        llm_kwargs = {
-            "model": "llama-3.1-8b-instant",
-            "temperature": 0.4
-        }
-        if groq_api_key:
-            llm_kwargs["groq_api_key"] = groq_api_key
-        else:
+        if not os.getenv("GROQ_API_KEY"):
             print("⚠️ GROQ_API_KEY not found, using default")
-        llm = ChatGroq(**llm_kwargs)
+        llm = get_groq_llm("llama-3.1-8b-instant", 0.4)
         response = await llm.ainvoke(
             [SystemMessage(content=system_prompt), HumanMessage(content=human_prompt)]
         )
@@ -326,13 +315,14 @@ async def image_node(state: StudentGraphState) -> StudentGraphState:
             print(f"📸 Detected EDIT intent. Modifying image...")
             image_to_edit = previous_images[-1] 
             
-            output = await replicate.async_run(
-                model,
-                input={
-                    "image_input": [image_to_edit],
-                    "prompt": query,
-                }
-            )
+            async with limiters.slot("replicate", model):
+                output = await replicate.async_run(
+                    model,
+                    input={
+                        "image_input": [image_to_edit],
+                        "prompt": query,
+                    }
+                )
         else:
             print(f"✨ Detected NEW image generation intent.")
         
@@ -342,10 +332,11 @@ async def image_node(state: StudentGraphState) -> StudentGraphState:
             print(f"   Original Query: {query}")
             print(f"   Enhanced Prompt: {enhanced_prompt}")
             
-            output = await replicate.async_run(
-                model,
-                input={"prompt": enhanced_prompt}
-            )
+            async with limiters.slot("replicate", model):
+                output = await replicate.async_run(
+                    model,
+                    input={"prompt": enhanced_prompt}
+                )
 
        
         if isinstance(output, list):
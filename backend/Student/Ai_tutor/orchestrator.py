@@ -12,11 +12,17 @@ from typing import Dict, Any, Optional, List
 from langchain_core.messages import SystemMessage, HumanMessage
 
 try:
-    from backend.llm import get_llm
+    from backend.llm import get_llm, get_groq_llm, record_llm_usage
     from backend.Student.Ai_tutor.graph_type import StudentGraphState
+    from backend.fast_router import fast_route, record_fast_route, should_shadow, shadow_compare
+    from backend.intent_router import intent_route, log_routing
+    from backend.speculation import cancel_speculation, resolve_speculation, speculate
 except ImportError:
-    from llm import get_llm
+    from llm import get_llm, get_groq_llm, record_llm_usage
     from Student.Ai_tutor.graph_type import StudentGraphState
+    from fast_router import fast_route, record_fast_route, should_shadow, shadow_compare
+    from intent_router import intent_route, log_routing
+    from speculation import cancel_speculation, resolve_speculation, speculate
 
 
 def load_orchestrator_prompt() -> str:
@@ -33,7 +39,17 @@ Return JSON with execution_order and reasoning.
 </system>"""
 
 
-STATIC_SYS = load_orchestrator_prompt()
+# The routing task is static, so it rides in the system prompt with the XML
+# instructions; only the per-turn <context> goes in the user message. That
+# keeps the whole system prompt a cacheable prefix for the provider.
+ROUTING_TASK = """<task>
+Return JSON with execution_order (list) and reasoning (≤2 sentences).
+Nodes: SimpleLLM, RAG, WebSearch, Image, END.
+Route to Image node when user explicitly requests image generation/editing with action verbs (generate, create, make, edit, modify, etc.).
+Consider the conversation context and uploaded documents when making routing decisions.
+</task>"""
+
+STATIC_SYS = load_orchestrator_prompt() + "\n\n" + ROUTING_TASK
 
 
 def normalize_route(name: str) -> str:
@@ -109,24 +125,12 @@ async def analyze_query(
 <websearch_enabled>{is_websearch}</websearch_enabled>{uploaded_images_text}{doc_context_text}
 </system_state>
 <assignments_available>{has_assignments}</assignments_available>
-</context>
-
-<task>
-Return JSON with execution_order (list) and reasoning (≤2 sentences).
-Nodes: SimpleLLM, RAG, WebSearch, Image, END.
-Route to Image node when user explicitly requests image generation/editing with action verbs (generate, create, make, edit, modify, etc.).
-Consider the conversation context and uploaded documents when making routing decisions.
-</task>"""
-    import os
-    from langchain_groq import ChatGroq
+</context>"""
     messages = [SystemMessage(content=STATIC_SYS), HumanMessage(content=dynamic_context)]
     try:
-        chat = ChatGroq(
-            model="openai/gpt-oss-120b",
-            temperature=0.4,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        chat = get_groq_llm("openai/gpt-oss-120b", 0.4)
         response = await chat.ainvoke(messages)
+        record_llm_usage("student.orchestrator", response)
         content = (response.content or "").strip()
         match = re.search(r"\{[\s\S]*\}", content)
         if match:
@@ -226,50 +230,76 @@ async def orchestrator_node(state: StudentGraphState) -> StudentGraphState:
         conversation_history = _format_history(messages, max_turns=6)
         session_summary = session_ctx.get("summary", "")
 
-        routing = await analyze_query(
-            user_message=user_query,
-            conversation_history=conversation_history,
-            session_summary=session_summary,
-            last_route=last_route,
-            doc_url=doc_url,
-            has_assignments=has_assignments,
-            is_image=is_image,
-            uploaded_images=edit_img_urls,
+        def llm_route():
+            return analyze_query(
+                user_message=user_query,
+                conversation_history=conversation_history,
+                session_summary=session_summary,
+                last_route=last_route,
+                doc_url=doc_url,
+                has_assignments=has_assignments,
+                is_image=is_image,
+                uploaded_images=edit_img_urls,
+                new_uploaded_docs=new_uploaded_docs,
+                is_websearch=True,
+            )
+
+        decision = fast_route(
+            user_query,
             new_uploaded_docs=new_uploaded_docs,
-            is_websearch=True,
+            last_route=last_route,
+            has_history=len(messages) > 1,
         )
-
-        plan = routing.get("execution_order") or ["SimpleLLM"]
-        plan = [normalize_route(step) for step in plan if step]
-        if not plan:
-            plan = ["simple_llm"]
+        has_documents = bool(doc_url or new_uploaded_docs)
+        if decision is None and not is_image and not edit_img_urls:
+            decision = await intent_route(user_query, has_documents=has_documents)
+        record_fast_route("student", decision)
+        speculation = None
+        try:
+            if decision:
+                routing = decision.as_routing()
+                if should_shadow():
+                    shadow_compare("student", decision, llm_route, normalize_route)
+            else:
+                speculation = await speculate("student", state, last_route, normalize_route, has_documents)
+                routing = await llm_route()
+                log_routing("student", user_query, routing, has_documents)
+
+            plan = routing.get("execution_order") or ["SimpleLLM"]
+            plan = [normalize_route(step) for step in plan if step]
+            if not plan:
+                plan = ["simple_llm"]
         
-        has_image_in_plan = any(task.lower() in ["image", "img"] for task in plan)
-        if not has_image_in_plan:
-            print(f"[Student Orchestrator] No image node in plan, clearing img_urls")
-            state["img_urls"] = []
+            has_image_in_plan = any(task.lower() in ["image", "img"] for task in plan)
+            if not has_image_in_plan:
+                print(f"[Student Orchestrator] No image node in plan, clearing img_urls")
+                state["img_urls"] = []
         
-        if len(edit_img_urls) == len(new_uploaded_docs) and plan[0].lower() == "image":
-            state["img_urls"] = edit_img_urls
-            print(f"[Student Orchestrator] Image editing scenario detected")
-        elif uploaded_doc:
-            state["img_urls"] = []
-            print(f"[Student Orchestrator] Document uploaded scenario")
+            if len(edit_img_urls) == len(new_uploaded_docs) and plan[0].lower() == "image":
+                state["img_urls"] = edit_img_urls
+                print(f"[Student Orchestrator] Image editing scenario detected")
+            elif uploaded_doc:
+                state["img_urls"] = []
+                print(f"[Student Orchestrator] Document uploaded scenario")
             
-            if len(plan) == 1 and plan[0].lower() == "rag":
-                pass
-            elif len(plan) == 1 and plan[0].lower() != "rag":
-                plan = ["rag"]
-            elif len(plan) == 0:
-                plan = ["rag"]
+                if len(plan) == 1 and plan[0].lower() == "rag":
+                    pass
+                elif len(plan) == 1 and plan[0].lower() != "rag":
+                    plan = ["rag"]
+                elif len(plan) == 0:
+                    plan = ["rag"]
             
-            print(f"[Student Orchestrator] New doc uploaded → updated plan = {plan}")
-
-        state["tasks"] = plan
-        state["task_index"] = 0
-        state["current_task"] = plan[0]
-        state["route"] = plan[0]
-        state["next_node"] = plan[0]
+                print(f"[Student Orchestrator] New doc uploaded → updated plan = {plan}")
+
+            state["tasks"] = plan
+            state["task_index"] = 0
+            state["current_task"] = plan[0]
+            state["route"] = plan[0]
+            state["next_node"] = plan[0]
+            state["speculation"] = await resolve_speculation(speculation, state["next_node"])
+        except BaseException:
+            cancel_speculation(speculation)
+            raise
         state["resolved_query"] = user_query
 
         session_ctx["last_route"] = plan[0]
@@ -5,7 +5,7 @@ import asyncio
 import os
 import time
 import httpx
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Callable
 import re
 import json
 
@@ -16,11 +16,13 @@ except ImportError:
 
 from qdrant_client import models, QdrantClient
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
 
 try:
     from backend.embedding import embed_chunks_parallel, embed_query
+    from backend.utils.text_chunker import TextChunker
+    from backend.utils.dsa_utils import NearDuplicateFilter
+    from backend.utils.outline_index import OUTLINE_PAYLOAD_INDEXES, outline_payload_for_page, retrieve_by_outline
     from backend.qdrant_service import (
         get_qdrant_client,
         VECTOR_SIZE,
@@ -28,6 +30,9 @@ try:
     )
 except ImportError:
     from embedding import embed_chunks_parallel, embed_query
+    from utils.text_chunker import TextChunker
+    from utils.dsa_utils import NearDuplicateFilter
+    from utils.outline_index import OUTLINE_PAYLOAD_INDEXES, outline_payload_for_page, retrieve_by_outline
     from qdrant_service import (
         get_qdrant_client,
         VECTOR_SIZE,
@@ -76,6 +81,15 @@ async def ensure_collection(collection_name: str):
                     field_name=field,
                     field_schema=models.PayloadSchemaType.KEYWORD
                 )
+
+            # Chapter/section outline fields used for payload-only lookups
+            for field, schema in OUTLINE_PAYLOAD_INDEXES.items():
+                await asyncio.to_thread(
+                    QDRANT_CLIENT.create_payload_index,
+                    collection_name=collection_name,
+                    field_name=field,
+                    field_schema=schema
+                )
             print(f"[Qdrant] ✅ Created collection with indexes: {collection_name}")
     except Exception as e:
         print(f"[Qdrant] ⚠️ Error ensuring collection (might already exist): {e}")
@@ -106,12 +120,12 @@ async def store_student_documents(
 
         await ensure_collection(collection_name)
         
-        text_splitter = RecursiveCharacterTextSplitter(
+        text_splitter = TextChunker(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len,
         )
         
+        near_duplicates = NearDuplicateFilter()
         all_chunks = []
         all_metadatas = []
         current_time = int(time.time())
@@ -121,6 +135,7 @@ async def store_student_documents(
                 continue
                 
             chunks = text_splitter.split_text(doc.page_content)
+            chunks = [chunks[i] for i in near_duplicates.filter(chunks)]
             base_meta = doc.metadata.copy() if doc.metadata else {}
             if metadata:
                 base_meta.update(metadata)
@@ -203,6 +218,95 @@ async def store_documents(
         metadata=metadata
     )
 
+async def store_student_document_stream(
+    student_id: str,
+    session_id: str,
+    chunk_batches: AsyncIterator[List[Tuple[Optional[int], str]]],
+    metadata: Optional[Dict[str, Any]] = None,
+    on_progress: Optional[Callable[[str, int], None]] = None,
+    outline: Optional[List[Dict[str, Any]]] = None,
+) -> int:
+    """
+    Embed and upsert a document batch by batch as its chunks are produced.
+
+    `chunk_batches` yields lists of (page_number, chunk) pairs, e.g. from
+    `doument_processor.aiter_page_chunks`. Each batch is searchable as soon as
+    it is upserted and only one batch is held in memory at a time.
+    `on_progress`, if given, is called with ("embedded", n) and ("indexed", n)
+    after each batch. When the PDF `outline` is given, every chunk is tagged
+    with the chapter/section covering its page for outline lookups.
+
+    Returns:
+        Number of chunks stored.
+    """
+    if not session_id:
+        return 0
+
+    collection_name = get_collection_name(student_id, session_id)
+    await ensure_collection(collection_name)
+
+    base_meta = dict(metadata or {})
+    base_meta["timestamp"] = int(time.time())
+    url_val = (
+        base_meta.get("file_url") or 
+        base_meta.get("source_url") or 
+        base_meta.get("url") or 
+        base_meta.get("source")
+    )
+    if url_val:
+        base_meta["source_url"] = url_val
+        base_meta["url"] = url_val
+        base_meta["source"] = url_val
+        base_meta["file_url"] = url_val
+
+    stored = 0
+    async for batch in chunk_batches:
+        if not batch:
+            continue
+
+        chunks = [chunk for _, chunk in batch]
+        embeddings = await embed_chunks_parallel(
+            chunks,
+            batch_size=500,
+            dimensions=VECTOR_SIZE,
+        )
+
+        if on_progress:
+            on_progress("embedded", len(embeddings))
+
+        points = []
+        for (page_number, chunk), embedding in zip(batch, embeddings):
+            chunk_meta = base_meta.copy()
+            chunk_meta["text"] = chunk
+            chunk_meta["chunk_index"] = stored + len(points)
+            if page_number is not None:
+                chunk_meta["page_number"] = page_number
+                if outline:
+                    chunk_meta.update(outline_payload_for_page(outline, page_number))
+            points.append(
+                models.PointStruct(
+                    id=str(uuid.uuid4()),
+                    vector=embedding,
+                    payload=chunk_meta
+                )
+            )
+
+        upsert_tasks = [
+            asyncio.to_thread(
+                QDRANT_CLIENT.upsert,
+                collection_name=collection_name,
+                points=points[i:i + QDRANT_UPSERT_BATCH_SIZE]
+            )
+            for i in range(0, len(points), QDRANT_UPSERT_BATCH_SIZE)
+        ]
+        await asyncio.gather(*upsert_tasks)
+        stored += len(points)
+        if on_progress:
+            on_progress("indexed", len(points))
+
+    print(f"[Qdrant] ✅ Streamed {stored} chunks into {collection_name}")
+    return stored
+
 async def retrieve_relevant_documents(
     student_id: str,
     session_id: str,
@@ -224,8 +328,6 @@ async def retrieve_relevant_documents(
         except Exception:
             pass
         
-        query_embedding = await embed_query(query, dimensions=VECTOR_SIZE)
-        
         query_filter = None
         if filter_doc_url:
             filter_doc_url = filter_doc_url.strip()
@@ -239,6 +341,20 @@ async def retrieve_relevant_documents(
                 ]
             )
 
+        outline_points = await retrieve_by_outline(
+            QDRANT_CLIENT, collection_name, query, base_filter=query_filter
+        )
+        if outline_points:
+            return [
+                Document(
+                    page_content=(point.payload or {}).get("text", ""),
+                    metadata={**{k: v for k, v in (point.payload or {}).items() if k != "text"}, "score": 1.0},
+                )
+                for point in outline_points
+            ]
+
+        query_embedding = await embed_query(query, dimensions=VECTOR_SIZE)
+
         search_result = []
         try:
             if hasattr(QDRANT_CLIENT, 'search'):
@@ -14,8 +14,10 @@ from typing import List, Dict, Any, Optional
 
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.token_budget import fit_prompt
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from token_budget import fit_prompt
 try:
     from backend.Student.Ai_tutor.graph_type import StudentGraphState
 except ImportError:
@@ -293,6 +295,56 @@ def _escape_xml(text: str) -> str:
     return html.escape(str(text))
 
 
+# No per-request values in here (topic and name go in <response_context>), so
+# it is a stable prefix the provider can cache.
+RAG_SYSTEM_PROMPT = """You are a supportive AI Study Buddy. Your goal is to answer the student's question accurately using ONLY the XML context provided in the user message.
+
+<instructions>
+1. **Analyze the Context**: Look at the <retrieved_context>. The student has uploaded documents. The relevant chunks are provided inside <search_result> tags.
+2. **Prioritize Uploaded Data**: If the <search_result> contains information relevant to the student's question, you MUST base your answer on it. 
+3. **Multi-Document Synthesis**: If chunks come from different filenames (check <metadata>), synthesize the information. E.g., "Document A says X, while Document B says Y."
+4. **Citations**: When you use information from a document, mention the source naturally. Example: "According to your notes..." or "As seen in [filename]...".
+5. **No Hallucination**: If the <retrieved_context> is empty or does not contain the answer, explicitly state that the uploaded documents do not contain that specific information, then offer general knowledge if appropriate.
+6. **Tone**: Be helpful, educational, encouraging, and clear. Speak directly to the student in a friendly, supportive manner.
+   7. **Student Context**: Consider the student's profile, grade level, and learning style when explaining concepts.
+   
+   8. **CRITICAL - Markdown Formatting**: Format ALL responses using proper Markdown syntax:
+      - Use headers (# H1, ## H2) to structure content.
+      - Use **bold** and *italics* for emphasis.
+      - Use lists (- or 1.) for items.
+      - Use `inline code` for terms.
+      - Use blockquotes (>) for tips.
+      - Use Markdown tables for data.
+      - Use triple backticks for code blocks.
+
+    ### Document Analysis Structure:
+    ## [The topic given in <response_context>]
+    
+    Hi [student name from <response_context>]! Based on the documents you uploaded, here is the detailed information you asked for:
+
+    ### Core Concept
+    [Directly define/explain the main concept using the document text]
+
+    ### Detailed Explanation
+    [Provide a VERY DETAILED explanation. Do not summarize briefly. Expand on the mechanisms, processes, or deeper layers found in the text. Aim for a thorough, multi-paragraph explanation that covers all nuances found in the retrieved chunks.]
+    * **Key Aspect 1**: [Detailed Explanation]
+    * **Key Aspect 2**: [Detailed Explanation]
+    * **Key Aspect 3**: [Detailed Explanation]
+
+    ### Key Insights from Your Documents
+    [Synthesize specific points found in the chunks. Be specific.]
+    * From [Document A]: [Insight with context]
+    * From [Document B]: [Insight with context]
+
+    ### Practice/Application
+    [If applicable, list examples or questions found in the text]
+
+    > **Note**: [Relevant study tip from the content]
+
+    ALWAYS use this Markdown formatting to ensure content renders beautifully. Prioritize DEPTH and DETAIL over brevity.
+ </instructions>"""
+
+
 async def rag_node(state: StudentGraphState) -> StudentGraphState:
     messages = state.get("messages", [])
     student_id = state.get("student_id", "")
@@ -406,52 +458,60 @@ async def rag_node(state: StudentGraphState) -> StudentGraphState:
             import traceback
             traceback.print_exc()
     
-    xml_documents = ""
-    if user_docs:
-        doc_entries = []
-        for i, doc in enumerate(user_docs):
-            meta = doc.metadata or {}
-            filename = _escape_xml(meta.get("filename", "Unknown File"))
-            file_type = _escape_xml(meta.get("file_type", "unknown"))
-            page_num = meta.get("page_number") or meta.get("page") or "N/A"
-            content = _escape_xml(doc.page_content)
-            entry = (
-                f'    <search_result index="{i+1}">\n'
-                f'        <metadata>\n'
-                f'            <filename>{filename}</filename>\n'
-                f'            <file_type>{file_type}</file_type>\n'
-                f'            <page_number>{page_num}</page_number>\n'
-                f'        </metadata>\n'
-                f'        <excerpt>\n{content}\n</excerpt>\n'
-                f'    </search_result>'
-            )
-            doc_entries.append(entry)
-        
-        xml_documents = "<retrieved_context>\n" + "\n".join(doc_entries) + "\n</retrieved_context>"
+    doc_entries = []
+    for i, doc in enumerate(user_docs):
+        meta = doc.metadata or {}
+        filename = _escape_xml(meta.get("filename", "Unknown File"))
+        file_type = _escape_xml(meta.get("file_type", "unknown"))
+        page_num = meta.get("page_number") or meta.get("page") or "N/A"
+        content = _escape_xml(doc.page_content)
+        entry = (
+            f'    <search_result index="{i+1}">\n'
+            f'        <metadata>\n'
+            f'            <filename>{filename}</filename>\n'
+            f'            <file_type>{file_type}</file_type>\n'
+            f'            <page_number>{page_num}</page_number>\n'
+            f'        </metadata>\n'
+            f'        <excerpt>\n{content}\n</excerpt>\n'
+            f'    </search_result>'
+        )
+        doc_entries.append(entry)
+
+    hist_entries = []
+    for m in messages[-5:]:
+        role = "student" if isinstance(m, HumanMessage) or (getattr(m, 'type', '') == 'human') else "buddy"
+        content = _escape_xml(m.content if hasattr(m, 'content') else str(m))
+        hist_entries.append(f'    <turn speaker="{role}">\n        {content}\n    </turn>')
+
+    student_data = format_student_profile(student_profile)
+    s_info = _escape_xml(student_data) if student_data else ""
+
+    model_name = state.get("model") if state.get("model") else "x-ai/grok-4.1-fast"
+    fitted = fit_prompt(
+        model_name,
+        fixed=[RAG_SYSTEM_PROMPT, query],
+        history=hist_entries,
+        profile=s_info,
+        chunks=doc_entries,
+        chunk_scores=[(doc.metadata or {}).get("score", 0) for doc in user_docs],
+        route="student.rag",
+    )
+
+    if fitted.chunks:
+        xml_documents = "<retrieved_context>\n" + "\n".join(fitted.chunks) + "\n</retrieved_context>"
     else:
         xml_documents = "<retrieved_context>\n    <status>No relevant document segments found for this specific query.</status>\n</retrieved_context>"
-
     xml_history = ""
-    if messages:
-        hist_entries = []
-        for m in messages[-5:]:
-            role = "student" if isinstance(m, HumanMessage) or (getattr(m, 'type', '') == 'human') else "buddy"
-            content = _escape_xml(m.content if hasattr(m, 'content') else str(m))
-            hist_entries.append(f'    <turn speaker="{role}">\n        {content}\n    </turn>')
-        xml_history = "<conversation_history>\n" + "\n".join(hist_entries) + "\n</conversation_history>"
-    
-    student_data = format_student_profile(student_profile)
+    if fitted.history:
+        xml_history = "<conversation_history>\n" + "\n".join(fitted.history) + "\n</conversation_history>"
     xml_student = ""
-    if student_data:
-        s_info = _escape_xml(student_data)
-        xml_student = f"<student_profile>\n{s_info}\n</student_profile>"
+    if fitted.profile:
+        xml_student = f"<student_profile>\n{fitted.profile}\n</student_profile>"
 
     student_name = student_profile.get("name") or student_profile.get("student_name") or "Student"
     topic_from_query = topic if topic else query
 
-    system_prompt = f"""You are a supportive AI Study Buddy. Your goal is to answer the student's question accurately using ONLY the provided XML context.
-
-<input_data>
+    rag_input = f"""<input_data>
 {xml_student}
 
 {xml_documents}
@@ -459,50 +519,10 @@ async def rag_node(state: StudentGraphState) -> StudentGraphState:
 {xml_history}
 </input_data>
 
-<instructions>
-1. **Analyze the Context**: Look at the <retrieved_context>. The student has uploaded documents. The relevant chunks are provided inside <search_result> tags.
-2. **Prioritize Uploaded Data**: If the <search_result> contains information relevant to the student's question, you MUST base your answer on it. 
-3. **Multi-Document Synthesis**: If chunks come from different filenames (check <metadata>), synthesize the information. E.g., "Document A says X, while Document B says Y."
-4. **Citations**: When you use information from a document, mention the source naturally. Example: "According to your notes..." or "As seen in [filename]...".
-5. **No Hallucination**: If the <retrieved_context> is empty or does not contain the answer, explicitly state that the uploaded documents do not contain that specific information, then offer general knowledge if appropriate.
-6. **Tone**: Be helpful, educational, encouraging, and clear. Speak directly to the student in a friendly, supportive manner.
-   7. **Student Context**: Consider the student's profile, grade level, and learning style when explaining concepts.
-   
-   8. **CRITICAL - Markdown Formatting**: Format ALL responses using proper Markdown syntax:
-      - Use headers (# H1, ## H2) to structure content.
-      - Use **bold** and *italics* for emphasis.
-      - Use lists (- or 1.) for items.
-      - Use `inline code` for terms.
-      - Use blockquotes (>) for tips.
-      - Use Markdown tables for data.
-      - Use triple backticks for code blocks.
-
-    ### Document Analysis Structure:
-    ## {topic_from_query}
-    
-    Hi {student_name}! Based on the documents you uploaded, here is the detailed information you asked for:
-
-    ### Core Concept
-    [Directly define/explain the main concept using the document text]
-
-    ### Detailed Explanation
-    [Provide a VERY DETAILED explanation. Do not summarize briefly. Expand on the mechanisms, processes, or deeper layers found in the text. Aim for a thorough, multi-paragraph explanation that covers all nuances found in the retrieved chunks.]
-    * **Key Aspect 1**: [Detailed Explanation]
-    * **Key Aspect 2**: [Detailed Explanation]
-    * **Key Aspect 3**: [Detailed Explanation]
-
-    ### Key Insights from Your Documents
-    [Synthesize specific points found in the chunks. Be specific.]
-    * From [Document A]: [Insight with context]
-    * From [Document B]: [Insight with context]
-
-    ### Practice/Application
-    [If applicable, list examples or questions found in the text]
-
-    > **Note**: [Relevant study tip from the content]
-
-    ALWAYS use this Markdown formatting to ensure content renders beautifully. Prioritize DEPTH and DETAIL over brevity.
- </instructions>
+<response_context>
+    <topic>{_escape_xml(topic_from_query)}</topic>
+    <student_name>{_escape_xml(student_name)}</student_name>
+</response_context>
 
 <current_student_query>
 {query}
@@ -510,14 +530,12 @@ async def rag_node(state: StudentGraphState) -> StudentGraphState:
 
 Answer the student's query now based on the XML data above."""
     
-    model_name = state.get("model") if state.get("model") else "x-ai/grok-4.1-fast"
     llm = get_llm(model_name, temperature=0.5) 
     
-    llm_messages = [SystemMessage(content=system_prompt)]
-    llm_messages.append(HumanMessage(content=query))
+    llm_messages = [SystemMessage(content=RAG_SYSTEM_PROMPT), HumanMessage(content=rag_input)]
     
     full_response, _ = await stream_with_token_tracking(
-        llm, llm_messages, chunk_callback=chunk_callback, state=state
+        llm, llm_messages, chunk_callback=chunk_callback, state=state, route="student.rag"
     )
     
     state["response"] = full_response
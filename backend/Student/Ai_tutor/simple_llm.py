@@ -10,13 +10,19 @@ from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.token_budget import fit_prompt, message_text
     from backend.Student.Ai_tutor.graph_type import StudentGraphState
     from backend.teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     from backend.utils.dsa_utils import ContentDeduplicator
+    from backend.embedding import embed_query
+    from backend.semantic_cache import SEMANTIC_CACHE_ENABLED, is_generic_query, semantic_answer_cache
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from token_budget import fit_prompt, message_text
     from Student.Ai_tutor.graph_type import StudentGraphState
     from teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
+    from embedding import embed_query
+    from semantic_cache import SEMANTIC_CACHE_ENABLED, is_generic_query, semantic_answer_cache
     try:
         from utils.dsa_utils import ContentDeduplicator
     except ImportError:
@@ -30,6 +36,35 @@ except ImportError:
                 return False
 
 
+EDUCATIONAL_KEYWORDS = [
+    "explain", "teach", "what is", "what are", "help with", "describe", "define",
+    "show me", "learn", "study", "understand", "tell me about", "how does", "why does"
+]
+
+
+def _is_educational_request(text: str) -> bool:
+    return any(keyword in (text or "").lower() for keyword in EDUCATIONAL_KEYWORDS)
+
+
+def _semantic_cache_eligible(state: StudentGraphState, query: str) -> bool:
+    """
+    Only generic curriculum questions answered by the profile-free educational
+    prompt are cached; never anything tied to uploaded docs or the student.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return False
+    if state.get("doc_url") or state.get("new_uploaded_docs") or state.get("uploaded_doc"):
+        return False
+    return _is_educational_request(query) and is_generic_query(query)
+
+
+SYSTEM_PROMPT = (
+    "You are a supportive AI study buddy. Process the following XML request and provide helpful, educational "
+    "responses. When explaining processes, systems, or complex concepts, always include Mermaid.js diagrams in "
+    "markdown code blocks labeled 'mermaid'."
+)
+
+
 def _format_last_turns(messages, k=4):
     if not messages:
         return "(no previous conversation)"
@@ -167,195 +202,23 @@ def format_student_profile(student_profile: Any) -> str:
     return str(student_profile)
 
 
-async def simple_llm_node(state: StudentGraphState) -> StudentGraphState:
-    messages = state.get("messages", [])
-    topic = state.get("user_query", "")
-    subject = state.get("subject", "")
-    student_profile = state.get("student_profile") or {}
-    pending_assignments = state.get("pending_assignments") or student_profile.get("pending_assignments") or []
-    completed_assignments = state.get("completed_assignments") or student_profile.get("completed_assignments") or []
-    achievements = state.get("achievements") or student_profile.get("achievements") or []
-    language = state.get("language", "English")
-    chunk_callback = state.get("chunk_callback")
-    
-    student_name = student_profile.get("name") or student_profile.get("student_name") or "Student"
-    grade = student_profile.get("grade", "")
-    learning_style = student_profile.get("learning_style", "Balanced")
-    
-    student_context = format_student_profile(student_profile)
-    if not grade and isinstance(student_profile, dict):
-        grade = student_profile.get("grade", "")
-    
-    kb_retrieved_contexts = []
-    print(f"[STUDENT SIMPLE_LLM] 📊 Extracted grade: '{grade}', subject: '{subject}', language: '{language}'")
-    if grade and subject and language:
-        subject_normalized = subject.lower().replace(" ", "_")
-        lang_code = LANGUAGES.get(language, language).lower()
-        collection_name = f"kb_grad_{grade}_sub_{subject_normalized}_lang_{lang_code}"
-        user_query = ""
-        if messages:
-            for msg in reversed(messages):
-                if hasattr(msg, 'content') and msg.content:
-                    msg_type = getattr(msg, 'type', None) or getattr(msg, 'role', None)
-                    if msg_type and msg_type.lower() in ('human', 'user'):
-                        user_query = msg.content
-                        break
-        if not user_query:
-            user_query = state.get("resolved_query") or state.get("user_query", "")
-        if user_query:
-            try:
-                print(f"[Student SimpleLLM KB] 🔍 Searching collection '{collection_name}' for query: {user_query[:120]}...")
-                kb_retrieved_contexts = await retrieve_kb_context(collection_name, user_query, top_k=5)
-                
-                # Optimization: Content Deduplication
-                if kb_retrieved_contexts:
-                    deduplicator = ContentDeduplicator()
-                    unique_contexts = []
-                    for text in kb_retrieved_contexts:
-                        if text and not deduplicator.is_duplicate(text):
-                            unique_contexts.append(text)
-                    kb_retrieved_contexts = unique_contexts
-
-                if kb_retrieved_contexts:
-                    print(f"[Student SimpleLLM KB] ✅ Retrieved {len(kb_retrieved_contexts)} unique context chunk(s) from knowledge base")
-                else:
-                    print(f"[Student SimpleLLM KB] ⚠️ No knowledge base context found for collection '{collection_name}'")
-            except asyncio.CancelledError:
-                print(f"[Student SimpleLLM KB] ⚠️ KB search was cancelled")
-                kb_retrieved_contexts = []
-                raise
-            except Exception as e:
-                print(f"[Student SimpleLLM KB] ❌ Error retrieving KB context: {e}")
-                import traceback
-                traceback.print_exc()
-                kb_retrieved_contexts = []
-        else:
-            missing = []
-            if not grade:
-                missing.append("grade")
-            if not subject:
-                missing.append("subject")
-            if not language:
-                missing.append("language")
-            print(f"[Student SimpleLLM KB] ⚠️ Skipping KB search - missing: {', '.join(missing)}")
-    
-    formatted_kb_context = ""
-    has_kb_context = False
-    if kb_retrieved_contexts:
-        formatted_kb_context = "\n\n".join(kb_retrieved_contexts[:5])
-        has_kb_context = True
-        print(f"[STUDENT SIMPLE_LLM] 📚 KB Context retrieved: {len(kb_retrieved_contexts)} chunks, total length: {len(formatted_kb_context)} chars")
-    
-    assignments_text = _format_assignments(pending_assignments)
-    completed_assignments_text = _format_completed_assignments(completed_assignments)
-    achievements_text = _format_achievements(achievements)
-    
-    low_score_assessments = _get_low_score_assessments(completed_assignments, threshold=60)
-    low_score_context = ""
-    if low_score_assessments:
-        topics_list = [assess["topic"] for assess in low_score_assessments]
-        topics_text = ", ".join(topics_list)
-        scores_text = ", ".join([f"{assess['topic']} ({assess['score']}%)" for assess in low_score_assessments])
-        low_score_context = f"""
-        <low_performance_alert>
-            <status>ACTIVE</status>
-            <message>The student has recently completed assessments with scores below 60%:</message>
-            <assessments>
-                {scores_text}
-            </assessments>
-            <action_required>
-                When the student greets you or asks a general question, proactively and supportively ask which topic from these assessments they would like to review and study: {topics_text}
-                Be encouraging and supportive - frame it as an opportunity to improve understanding.
-            </action_required>
-        </low_performance_alert>"""
-    else:
-        low_score_context = """
-        <low_performance_alert>
-            <status>INACTIVE</status>
-            <message>No low-scoring assessments detected.</message>
-        </low_performance_alert>"""
-    
-    conversation_history = _format_last_turns(messages, k=4)
-    print(f"[STUDENT SIMPLE_LLM] 📜 Total messages in state: {len(messages)}")
-    print(f"[STUDENT SIMPLE_LLM] 📝 Conversation history:\n{conversation_history}")
-    print(f"[STUDENT SIMPLE_LLM] 📝 Current user query: '{topic}'")
-
-    is_educational_request = any(keyword in topic.lower() for keyword in [
-        "explain", "teach", "what is", "what are", "help with", "describe", "define", 
-        "show me", "learn", "study", "understand", "tell me about", "how does", "why does"
-    ])
-    print(f"[STUDENT SIMPLE_LLM] 🎓 Is educational request: {is_educational_request}")
-
-    last_user_text = topic
-    if messages:
-        for m in reversed(messages):
-            role = (getattr(m, "type", None) or getattr(m, "role", None) or "").lower()
-            if role in ("human", "user") and getattr(m, "content", None):
-                last_user_text = m.content
-                break
-
-    is_first_turn = len(messages) <= 1
-    if _is_greeting(last_user_text) and is_first_turn and not is_educational_request:
-        greeting_prompt = f"""
-You are a supportive AI study buddy.
-
-Student profile (for context, do not restate everything verbatim):
-{student_context if student_context != "No student profile provided." else "No student profile available."}
-
-Pending assignments:
-{assignments_text}
-
-Completed assignments:
-{completed_assignments_text}
-
-Recent achievements:
-{achievements_text}
-
-Low-score assessments (if any):
-{", ".join([f"{assess['topic']} ({assess['score']}%)" for assess in low_score_assessments]) if low_score_assessments else "None"}
-
-The student just said: "{last_user_text}".
-
-Respond with a short, friendly greeting to {student_name} in {language}, then:
-- Briefly summarize pending and completed assignments only at a high level (no long lists).
-- If there are low-scoring assessments, gently ask which topic they'd like to review.
-- End with: "How can I help you today?".
-Use concise Markdown with at most two headings and a few bullet points.
-"""
-        model_name = state.get("model") if state.get("model") else "x-ai/grok-4.1-fast"
-        llm = get_llm(model_name, temperature=0.55)
-        llm_messages = [
-            SystemMessage(content="You are a supportive AI study buddy. Keep responses concise and student-friendly."),
-            HumanMessage(content=greeting_prompt),
-        ]
-        try:
-            full_response, token_usage = await stream_with_token_tracking(
-                llm,
-                llm_messages,
-                chunk_callback=chunk_callback,
-                state=state,
-            )
-            state["simple_llm_response"] = full_response
-            state["response"] = full_response
-            if token_usage:
-                current_usage = state.get("token_usage", {})
-                if isinstance(current_usage, dict):
-                    for key, value in token_usage.items():
-                        current_usage[key] = current_usage.get(key, 0) + value
-                    state["token_usage"] = current_usage
-                else:
-                    state["token_usage"] = token_usage
-        except asyncio.CancelledError:
-            print(f"[Student SimpleLLM] ⚠️ LLM streaming was cancelled (greeting path)")
-            raise
-        except Exception as e:
-            print(f"[Student SimpleLLM] ❌ Error during LLM streaming (greeting path): {e}")
-            import traceback
-            traceback.print_exc()
-            state["simple_llm_response"] = f"Error: {str(e)}"
-            state["response"] = f"Error: {str(e)}"
-        return state
-
+def _build_prompt(
+    is_educational_request,
+    has_kb_context,
+    student_name,
+    grade,
+    language,
+    subject,
+    topic,
+    conversation_history,
+    formatted_kb_context,
+    student_context,
+    assignments_text,
+    completed_assignments_text,
+    achievements_text,
+    low_score_assessments,
+):
+    """The tutor prompt for educational requests, otherwise the study-buddy prompt."""
     if is_educational_request:
         if has_kb_context:
             kb_section = f"""
@@ -382,7 +245,7 @@ You may use your general knowledge, but ensure it's appropriate for Grade {grade
 </curriculum_knowledge_base>
 """
         
-        xml_prompt = f"""You are a supportive AI tutor for {student_name} (Grade {grade}, {language}).
+        return f"""You are a supportive AI tutor for {student_name} (Grade {grade}, {language}).
 
 <recent_conversation>
 {conversation_history}
@@ -505,7 +368,7 @@ No curriculum content was found in the knowledge base for this query.
             low_scores_list = [f"{a['topic']} ({a['score']}%)" for a in low_score_assessments[:3]]
             low_scores_text = f"- Low scores: {', '.join(low_scores_list)}"
         
-        xml_prompt = f"""You are a supportive AI study buddy for {student_name} (Grade {grade}, {language}).
+        return f"""You are a supportive AI study buddy for {student_name} (Grade {grade}, {language}).
 
 <recent_conversation>
 {conversation_history}
@@ -607,12 +470,250 @@ As you can see, the cycle repeats continuously...
 </diagram_requirements>
 </response_rules>
 """
+
+
+async def simple_llm_node(state: StudentGraphState) -> StudentGraphState:
+    messages = state.get("messages", [])
+    topic = state.get("user_query", "")
+    subject = state.get("subject", "")
+    student_profile = state.get("student_profile") or {}
+    pending_assignments = state.get("pending_assignments") or student_profile.get("pending_assignments") or []
+    completed_assignments = state.get("completed_assignments") or student_profile.get("completed_assignments") or []
+    achievements = state.get("achievements") or student_profile.get("achievements") or []
+    language = state.get("language", "English")
+    chunk_callback = state.get("chunk_callback")
+    
+    student_name = student_profile.get("name") or student_profile.get("student_name") or "Student"
+    grade = student_profile.get("grade", "")
+    learning_style = student_profile.get("learning_style", "Balanced")
+    
+    student_context = format_student_profile(student_profile)
+    if not grade and isinstance(student_profile, dict):
+        grade = student_profile.get("grade", "")
+    
+    kb_retrieved_contexts = []
+    cache_scope = None
+    query_vector = None
+    print(f"[STUDENT SIMPLE_LLM] 📊 Extracted grade: '{grade}', subject: '{subject}', language: '{language}'")
+    if grade and subject and language:
+        subject_normalized = subject.lower().replace(" ", "_")
+        lang_code = LANGUAGES.get(language, language).lower()
+        collection_name = f"kb_grad_{grade}_sub_{subject_normalized}_lang_{lang_code}"
+        user_query = ""
+        if messages:
+            for msg in reversed(messages):
+                if hasattr(msg, 'content') and msg.content:
+                    msg_type = getattr(msg, 'type', None) or getattr(msg, 'role', None)
+                    if msg_type and msg_type.lower() in ('human', 'user'):
+                        user_query = msg.content
+                        break
+        if not user_query:
+            user_query = state.get("resolved_query") or state.get("user_query", "")
+        if user_query and _semantic_cache_eligible(state, user_query):
+            try:
+                # embed_query is LRU-cached, so retrieval below reuses this vector
+                query_vector = await embed_query(user_query)
+                cache_scope = semantic_answer_cache.scope(collection_name, language, grade)
+                cached = semantic_answer_cache.lookup(cache_scope, query_vector)
+            except Exception as e:
+                print(f"[Student SimpleLLM Cache] ⚠️ Semantic cache lookup failed: {e}")
+                cache_scope, cached = None, None
+            if cached:
+                answer, similarity, cached_query = cached
+                print(f"[Student SimpleLLM Cache] ⚡ Serving cached answer (similarity {similarity:.3f} to '{cached_query[:80]}')")
+                if chunk_callback:
+                    await chunk_callback(answer)
+                state["simple_llm_response"] = answer
+                state["response"] = answer
+                return state
+        if user_query:
+            try:
+                print(f"[Student SimpleLLM KB] 🔍 Searching collection '{collection_name}' for query: {user_query[:120]}...")
+                kb_retrieved_contexts = await retrieve_kb_context(collection_name, user_query, top_k=5)
+                
+                # Optimization: Content Deduplication
+                if kb_retrieved_contexts:
+                    deduplicator = ContentDeduplicator()
+                    unique_contexts = []
+                    for text in kb_retrieved_contexts:
+                        if text and not deduplicator.is_duplicate(text):
+                            unique_contexts.append(text)
+                    kb_retrieved_contexts = unique_contexts
+
+                if kb_retrieved_contexts:
+                    print(f"[Student SimpleLLM KB] ✅ Retrieved {len(kb_retrieved_contexts)} unique context chunk(s) from knowledge base")
+                else:
+                    print(f"[Student SimpleLLM KB] ⚠️ No knowledge base context found for collection '{collection_name}'")
+            except asyncio.CancelledError:
+                print(f"[Student SimpleLLM KB] ⚠️ KB search was cancelled")
+                kb_retrieved_contexts = []
+                raise
+            except Exception as e:
+                print(f"[Student SimpleLLM KB] ❌ Error retrieving KB context: {e}")
+                import traceback
+                traceback.print_exc()
+                kb_retrieved_contexts = []
+        else:
+            missing = []
+            if not grade:
+                missing.append("grade")
+            if not subject:
+                missing.append("subject")
+            if not language:
+                missing.append("language")
+            print(f"[Student SimpleLLM KB] ⚠️ Skipping KB search - missing: {', '.join(missing)}")
+    
+    assignments_text = _format_assignments(pending_assignments)
+    completed_assignments_text = _format_completed_assignments(completed_assignments)
+
+    achievements_text = _format_achievements(achievements)
+    
+    low_score_assessments = _get_low_score_assessments(completed_assignments, threshold=60)
+    low_score_context = ""
+    if low_score_assessments:
+        topics_list = [assess["topic"] for assess in low_score_assessments]
+        topics_text = ", ".join(topics_list)
+        scores_text = ", ".join([f"{assess['topic']} ({assess['score']}%)" for assess in low_score_assessments])
+        low_score_context = f"""
+        <low_performance_alert>
+            <status>ACTIVE</status>
+            <message>The student has recently completed assessments with scores below 60%:</message>
+            <assessments>
+                {scores_text}
+            </assessments>
+            <action_required>
+                When the student greets you or asks a general question, proactively and supportively ask which topic from these assessments they would like to review and study: {topics_text}
+                Be encouraging and supportive - frame it as an opportunity to improve understanding.
+            </action_required>
+        </low_performance_alert>"""
+    else:
+        low_score_context = """
+        <low_performance_alert>
+            <status>INACTIVE</status>
+            <message>No low-scoring assessments detected.</message>
+        </low_performance_alert>"""
+    
+    is_educational_request = _is_educational_request(topic)
+    print(f"[STUDENT SIMPLE_LLM] 🎓 Is educational request: {is_educational_request}")
+
+    prompt_args = dict(
+        is_educational_request=is_educational_request,
+        has_kb_context=bool(kb_retrieved_contexts),
+        student_name=student_name,
+        grade=grade,
+        language=language,
+        subject=subject,
+        topic=topic,
+        assignments_text=assignments_text,
+        completed_assignments_text=completed_assignments_text,
+        achievements_text=achievements_text,
+        low_score_assessments=low_score_assessments,
+    )
+    # The template is counted as rendered, with the budgeted sections left out
+    template = _build_prompt(conversation_history="", formatted_kb_context="", student_context="", **prompt_args)
+    fitted = fit_prompt(
+        state.get("model") or "x-ai/grok-4.1-fast",
+        fixed=[SYSTEM_PROMPT, template],
+        history=[message_text(m) for m in messages],
+        profile=student_context,
+        chunks=kb_retrieved_contexts[:5],
+        route="student.simple_llm",
+    )
+    recent_messages = messages[len(messages) - len(fitted.history):]
+    student_context = fitted.profile
+
+    formatted_kb_context = ""
+    if fitted.chunks:
+        formatted_kb_context = "\n\n".join(fitted.chunks)
+        print(f"[STUDENT SIMPLE_LLM] 📚 KB Context retrieved: {len(fitted.chunks)} chunks, total length: {len(formatted_kb_context)} chars")
+    conversation_history = _format_last_turns(recent_messages, k=len(recent_messages))
+    print(f"[STUDENT SIMPLE_LLM] 📜 Total messages in state: {len(messages)}")
+    print(f"[STUDENT SIMPLE_LLM] 📝 Conversation history:\n{conversation_history}")
+    print(f"[STUDENT SIMPLE_LLM] 📝 Current user query: '{topic}'")
+
+    last_user_text = topic
+    if messages:
+        for m in reversed(messages):
+            role = (getattr(m, "type", None) or getattr(m, "role", None) or "").lower()
+            if role in ("human", "user") and getattr(m, "content", None):
+                last_user_text = m.content
+                break
+
+    is_first_turn = len(messages) <= 1
+    if _is_greeting(last_user_text) and is_first_turn and not is_educational_request:
+        greeting_prompt = f"""
+You are a supportive AI study buddy.
+
+Student profile (for context, do not restate everything verbatim):
+{student_context if student_context != "No student profile provided." else "No student profile available."}
+
+Pending assignments:
+{assignments_text}
+
+Completed assignments:
+{completed_assignments_text}
+
+Recent achievements:
+{achievements_text}
+
+Low-score assessments (if any):
+{", ".join([f"{assess['topic']} ({assess['score']}%)" for assess in low_score_assessments]) if low_score_assessments else "None"}
+
+The student just said: "{last_user_text}".
+
+Respond with a short, friendly greeting to {student_name} in {language}, then:
+- Briefly summarize pending and completed assignments only at a high level (no long lists).
+- If there are low-scoring assessments, gently ask which topic they'd like to review.
+- End with: "How can I help you today?".
+Use concise Markdown with at most two headings and a few bullet points.
+"""
+        model_name = state.get("model") if state.get("model") else "x-ai/grok-4.1-fast"
+        llm = get_llm(model_name, temperature=0.55)
+        llm_messages = [
+            SystemMessage(content="You are a supportive AI study buddy. Keep responses concise and student-friendly."),
+            HumanMessage(content=greeting_prompt),
+        ]
+        try:
+            full_response, token_usage = await stream_with_token_tracking(
+                llm,
+                llm_messages,
+                chunk_callback=chunk_callback,
+                state=state,
+                route="student.greeting",
+            )
+            state["simple_llm_response"] = full_response
+            state["response"] = full_response
+            if token_usage:
+                current_usage = state.get("token_usage", {})
+                if isinstance(current_usage, dict):
+                    for key, value in token_usage.items():
+                        current_usage[key] = current_usage.get(key, 0) + value
+                    state["token_usage"] = current_usage
+                else:
+                    state["token_usage"] = token_usage
+        except asyncio.CancelledError:
+            print(f"[Student SimpleLLM] ⚠️ LLM streaming was cancelled (greeting path)")
+            raise
+        except Exception as e:
+            print(f"[Student SimpleLLM] ❌ Error during LLM streaming (greeting path): {e}")
+            import traceback
+            traceback.print_exc()
+            state["simple_llm_response"] = f"Error: {str(e)}"
+            state["response"] = f"Error: {str(e)}"
+        return state
+
+    xml_prompt = _build_prompt(
+        conversation_history=conversation_history,
+        formatted_kb_context=formatted_kb_context,
+        student_context=student_context,
+        **prompt_args,
+    )
     
     model_name = state.get("model") if state.get("model") else "x-ai/grok-4.1-fast"
     llm = get_llm(model_name, temperature=0.55)
     
     llm_messages = [
-        SystemMessage(content="You are a supportive AI study buddy. Process the following XML request and provide helpful, educational responses. When explaining processes, systems, or complex concepts, always include Mermaid.js diagrams in markdown code blocks labeled 'mermaid'.")
+        SystemMessage(content=SYSTEM_PROMPT)
     ]
     
     llm_messages.append(HumanMessage(content=xml_prompt))
@@ -622,7 +723,8 @@ As you can see, the cycle repeats continuously...
             llm,
             llm_messages,
             chunk_callback=chunk_callback,
-            state=state
+            state=state,
+            route="student.simple_llm"
         )
         
         state["simple_llm_response"] = full_response
@@ -637,6 +739,10 @@ As you can see, the cycle repeats continuously...
             else:
                 state["token_usage"] = token_usage
         
+        # Don't share answers that address this student by name
+        if cache_scope and is_educational_request and full_response and student_name.lower() not in full_response.lower():
+            semantic_answer_cache.store(cache_scope, query_vector, user_query, full_response)
+        
     except asyncio.CancelledError:
         print(f"[Student SimpleLLM] ⚠️ LLM streaming was cancelled")
         raise
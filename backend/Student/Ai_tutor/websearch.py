@@ -13,11 +13,13 @@ from langchain_tavily import TavilySearch
 
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.rate_limiter import limiters
     from backend.Student.Ai_tutor.graph_type import StudentGraphState
     from backend.teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     from backend.utils.dsa_utils import ContentDeduplicator
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from rate_limiter import limiters
     from Student.Ai_tutor.graph_type import StudentGraphState
     from teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     try:
@@ -47,7 +49,8 @@ async def _web_search(topic: str, subject: str, grade: str, language: str) -> st
         )
 
         query = f"{topic} {subject} grade {grade} {language}"
-        results = await tavily_tool.ainvoke(query)
+        async with limiters.slot("tavily"):
+            results = await tavily_tool.ainvoke(query)
         if isinstance(results, list):
             formatted = []
             for result in results[:5]:
@@ -347,6 +350,7 @@ result = calculation()
         llm_messages,
         chunk_callback=chunk_callback,
         state=state,
+        route="student.websearch",
     )
 
     state["websearch_results"] = full_response
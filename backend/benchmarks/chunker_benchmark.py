@@ -0,0 +1,102 @@
+"""
+Benchmark: utils.text_chunker.TextChunker vs LangChain's RecursiveCharacterTextSplitter.
+
+Generates a synthetic textbook-like corpus (chapters, headings, paragraphs,
+numbered exercises, occasional long unbroken tokens) and times both splitters
+with the configurations used on the ingestion paths. Output parity is checked
+on every run.
+
+Usage (from backend/):
+    python benchmarks/chunker_benchmark.py --mb 8 --repeat 3
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+backend_path = Path(__file__).resolve().parents[1]
+if str(backend_path) not in sys.path:
+    sys.path.insert(0, str(backend_path))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.text_chunker import TextChunker
+
+VOCABULARY = (
+    "the cell membrane controls movement of substances in and out of the cell "
+    "photosynthesis converts light energy into chemical energy stored in glucose "
+    "equation velocity acceleration force mass energy momentum friction gravity "
+    "students should observe record and explain the results of each experiment"
+).split()
+
+
+def build_corpus(target_bytes: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    chapter = 0
+    while size < target_bytes:
+        chapter += 1
+        block = [f"Chapter {chapter}: {' '.join(rng.choices(VOCABULARY, k=4)).title()}\n\n"]
+        for section in range(1, rng.randint(3, 7)):
+            block.append(f"{chapter}.{section} {' '.join(rng.choices(VOCABULARY, k=3)).title()}\n")
+            for _ in range(rng.randint(2, 6)):
+                sentences = [
+                    " ".join(rng.choices(VOCABULARY, k=rng.randint(6, 20))).capitalize() + "."
+                    for _ in range(rng.randint(2, 8))
+                ]
+                block.append(" ".join(sentences) + "\n\n")
+            for exercise in range(1, rng.randint(2, 5)):
+                block.append(f"Q{exercise}. {' '.join(rng.choices(VOCABULARY, k=12))}?\n")
+            if rng.random() < 0.1:
+                block.append("x" * rng.randint(1200, 3000) + "\n")
+            block.append("\n")
+        text = "".join(block)
+        parts.append(text)
+        size += len(text)
+    return "".join(parts)
+
+
+def time_splitter(split, text: str, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = split(text)
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=8.0, help="Corpus size in megabytes")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = build_corpus(int(args.mb * 1024 * 1024))
+    print(f"Corpus: {len(text) / 1024 / 1024:.1f} MB, {text.count(chr(10)):,} lines\n")
+
+    configs = [
+        ("AI tutor / ingestion", 1000, 200),
+        ("Knowledge base", 1300, 200),
+    ]
+    for label, chunk_size, chunk_overlap in configs:
+        langchain = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
+        )
+        chunker = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+        expected, lc_times = time_splitter(langchain.split_text, text, args.repeat)
+        actual, tc_times = time_splitter(chunker.split_text, text, args.repeat)
+
+        lc_best, tc_best = min(lc_times), min(tc_times)
+        print(f"[{label}] chunk_size={chunk_size} overlap={chunk_overlap}")
+        print(f"  RecursiveCharacterTextSplitter: best {lc_best:.3f}s  median {statistics.median(lc_times):.3f}s")
+        print(f"  TextChunker:                    best {tc_best:.3f}s  median {statistics.median(tc_times):.3f}s")
+        print(f"  Speedup: {lc_best / tc_best:.2f}x   chunks: {len(actual):,}   identical: {expected == actual}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Offline evaluation: embedding intent router vs the Groq analyze_query router.
+
+Reads routing decisions logged by the orchestrators (ROUTER_LOG_PATH, one JSON
+object per line with "message", "has_documents" and the LLM's
+"execution_order"), embeds every message in one batch, and reports for a
+range of thresholds how many turns the intent router would decide (coverage)
+and how often its route matches the LLM's first step (accuracy on covered
+turns), plus a confusion matrix at the configured threshold.
+
+Needs OPENAI_API_KEY for the embeddings.
+
+Usage (from backend/):
+    python benchmarks/intent_router_eval.py routing_log.jsonl
+    python benchmarks/intent_router_eval.py routing_log.jsonl --exemplars intent_exemplars.json --margin 0.03
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+backend_path = Path(__file__).resolve().parents[1]
+if str(backend_path) not in sys.path:
+    sys.path.insert(0, str(backend_path))
+
+import intent_router
+from embedding import embed_chunks_parallel
+from intent_router import IntentRouter, load_exemplars, normalized_route
+from qdrant_service import VECTOR_SIZE
+
+
+def read_log(path: str):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("message"):
+                records.append(record)
+    return records
+
+
+def evaluate(router: IntentRouter, scores: np.ndarray, records, labels):
+    decisions = []
+    for row, record in zip(scores, records):
+        decision = router.decide(row, bool(record.get("has_documents")))
+        decisions.append(decision.plan[0] if decision else None)
+    covered = [(d, y) for d, y in zip(decisions, labels) if d is not None]
+    correct = sum(1 for d, y in covered if d == y)
+    return decisions, len(covered), correct
+
+
+async def main_async(args):
+    records = read_log(args.log)
+    if not records:
+        print(f"No routing records in {args.log}")
+        return
+    labels = [normalized_route((r.get("execution_order") or ["SimpleLLM"])[0]) for r in records]
+
+    exemplars = load_exemplars(args.exemplars)
+    router = IntentRouter(exemplars, top_k=args.top_k)
+    await router.build()
+    queries = np.asarray(
+        await embed_chunks_parallel([r["message"] for r in records], dimensions=VECTOR_SIZE), dtype=np.float32
+    )
+    scores = router.scores(queries)
+
+    print(f"Exemplar set v{router.version}: {sum(map(len, router.texts.values()))} exemplars, top_k={args.top_k}")
+    print(f"Logged turns: {len(records)}   LLM routes: {dict(Counter(labels))}\n")
+    print(f"{'threshold':>9}  {'coverage':>8}  {'accuracy':>8}  {'LLM calls saved':>15}")
+
+    intent_router.INTENT_ROUTER_MARGIN = args.margin
+    for threshold in args.thresholds:
+        intent_router.INTENT_ROUTER_THRESHOLD = threshold
+        _, covered, correct = evaluate(router, scores, records, labels)
+        accuracy = f"{correct / covered:.1%}" if covered else "-"
+        print(f"{threshold:>9.2f}  {covered / len(records):>8.1%}  {accuracy:>8}  {covered:>15}")
+
+    intent_router.INTENT_ROUTER_THRESHOLD = args.threshold
+    decisions, covered, correct = evaluate(router, scores, records, labels)
+    routes = router.routes
+    print(f"\nConfusion at threshold {args.threshold:.2f} (rows: LLM, columns: intent router, '-' = deferred)")
+    print(f"{'':>10}" + "".join(f"{r:>11}" for r in routes) + f"{'-':>11}")
+    for truth in routes:
+        counts = Counter(d for d, y in zip(decisions, labels) if y == truth)
+        print(f"{truth:>10}" + "".join(f"{counts.get(r, 0):>11}" for r in routes) + f"{counts.get(None, 0):>11}")
+
+    if args.show_errors:
+        print("\nDisagreements:")
+        for decision, label, record in zip(decisions, labels, records):
+            if decision is not None and decision != label:
+                print(f"  intent={decision:<10} llm={label:<10} {record['message'][:100]!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="Routing log written via ROUTER_LOG_PATH")
+    parser.add_argument("--exemplars", default=intent_router.INTENT_ROUTER_EXEMPLARS)
+    parser.add_argument("--top-k", type=int, default=intent_router.INTENT_ROUTER_TOP_K)
+    parser.add_argument("--threshold", type=float, default=intent_router.INTENT_ROUTER_THRESHOLD)
+    parser.add_argument("--margin", type=float, default=intent_router.INTENT_ROUTER_MARGIN)
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7]
+    )
+    parser.add_argument("--show-errors", action="store_true", help="List messages where the routers disagree")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark: per-token overhead of llm.stream_with_token_tracking.
+
+Compares the `astream_events` path with the direct `astream` fast path on a
+local fake chat model that streams N chunks with no network or sleep, so the
+timings are pure framework overhead. Usage is attached to the final chunk the
+way OpenRouter/OpenAI-compatible providers do with include_usage. Output and
+token-usage parity between both paths is checked on every run.
+
+Usage (from backend/):
+    python benchmarks/stream_tracking_benchmark.py --tokens 2000 --repeat 5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+import warnings
+from pathlib import Path
+from typing import Any, AsyncIterator, List, Optional
+
+backend_path = Path(__file__).resolve().parents[1]
+if str(backend_path) not in sys.path:
+    sys.path.insert(0, str(backend_path))
+
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core._api import LangChainDeprecationWarning
+
+import llm as llm_module
+
+# astream_events(version="v1") warns on every call
+warnings.filterwarnings("ignore", category=LangChainDeprecationWarning)
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Streams `tokens` single-word chunks; usage rides on the last chunk."""
+
+    tokens: int = 1000
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = "".join(f"tok{i} " for i in range(self.tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for i in range(self.tokens):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=f"tok{i} "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="",
+                usage_metadata={"input_tokens": 12, "output_tokens": self.tokens, "total_tokens": 12 + self.tokens},
+            )
+        )
+
+
+async def run_path(fast_path: bool, model: FakeStreamingChatModel, repeat: int):
+    llm_module.LLM_STREAM_FAST_PATH = fast_path
+    received = []
+
+    async def on_chunk(chunk: str):
+        received.append(chunk)
+
+    timings = []
+    result = None
+    for _ in range(repeat):
+        received.clear()
+        start = time.perf_counter()
+        # The function logs token usage on every call; keep the output clean
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await llm_module.stream_with_token_tracking(model, [HumanMessage(content="hi")], on_chunk)
+        timings.append(time.perf_counter() - start)
+    return result, "".join(received), timings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=2000, help="Chunks streamed per call")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model = FakeStreamingChatModel(tokens=args.tokens)
+    # Warm up imports and tracer setup for both paths
+    await run_path(False, FakeStreamingChatModel(tokens=10), 1)
+    await run_path(True, FakeStreamingChatModel(tokens=10), 1)
+
+    (events_text, events_usage), events_chunks, events_times = await run_path(False, model, args.repeat)
+    (direct_text, direct_usage), direct_chunks, direct_times = await run_path(True, model, args.repeat)
+
+    events_best, direct_best = min(events_times), min(direct_times)
+    print(f"Chunks per call: {args.tokens:,}   repeats: {args.repeat}\n")
+    print(f"  astream_events: best {events_best * 1000:.1f} ms  median {statistics.median(events_times) * 1000:.1f} ms"
+          f"  ({events_best / args.tokens * 1e6:.1f} µs/token)")
+    print(f"  astream (fast): best {direct_best * 1000:.1f} ms  median {statistics.median(direct_times) * 1000:.1f} ms"
+          f"  ({direct_best / args.tokens * 1e6:.1f} µs/token)")
+    print(f"  Speedup: {events_best / direct_best:.2f}x")
+    print(f"  identical text: {events_text == direct_text and events_chunks == direct_chunks}"
+          f"   identical usage: {events_usage == direct_usage} {direct_usage}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
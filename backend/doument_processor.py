@@ -1,27 +1,31 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple, Union
 import pypdf
 import docx
 import json
+import os
+import asyncio
+import tempfile
+import mmap
+from contextlib import contextmanager, asynccontextmanager
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 import uuid
 from fastapi import UploadFile
 try:
     from backend.models import DocumentInfo
-    from backend.utils.dsa_utils import ContentDeduplicator
+    from backend.utils.dsa_utils import BoilerplateDetector, NearDuplicateFilter
 except ImportError:
     from models import DocumentInfo
-    # Fallback if utils not in path or running as script
-    try:
-        from utils.dsa_utils import ContentDeduplicator
-    except ImportError:
-        # Simple fallback class if import fails
-        class ContentDeduplicator:
-            def __init__(self): self.seen_hashes = set()
-            def is_duplicate(self, t): 
-                h = hash(t)
-                if h in self.seen_hashes: return True
-                self.seen_hashes.add(h)
-                return False
+    from utils.dsa_utils import BoilerplateDetector, NearDuplicateFilter
+
+try:
+    from backend.utils.text_chunker import TextChunker
+    from backend.utils.outline_index import build_outline
+except ImportError:
+    from utils.text_chunker import TextChunker
+    from utils.outline_index import build_outline
 
 # Try to import fitz (PyMuPDF), fallback to pypdf if not available
 try:
@@ -30,62 +34,170 @@ try:
 except ImportError:
     HAS_FITZ = False
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file using PyMuPDF (fitz) or pypdf as fallback"""
-    # Try PyMuPDF first (fitz) - better quality extraction
-    if HAS_FITZ:
+# WordprocessingML tags used to approximate page boundaries in DOCX files
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCX_BREAK_TAG = f"{_W_NS}br"
+DOCX_BREAK_TYPE_ATTR = f"{_W_NS}type"
+DOCX_RENDERED_BREAK_TAG = f"{_W_NS}lastRenderedPageBreak"
+
+# Extractors accept raw bytes, a memoryview over an upload/download buffer, or
+# a path to a file on disk, so callers never have to copy a file into `bytes`.
+DocumentSource = Union[bytes, memoryview, str]
+
+
+def _open_pdf(file_content: DocumentSource):
+    if isinstance(file_content, str):
+        return fitz.open(file_content)
+    return fitz.open(stream=file_content, filetype="pdf")
+
+
+def _binary_stream(file_content: DocumentSource):
+    if isinstance(file_content, str):
+        return open(file_content, "rb")
+    return BytesIO(file_content)
+
+
+def _decode_utf8(file_content: DocumentSource) -> str:
+    if isinstance(file_content, str):
+        with open(file_content, "rb") as f:
+            return f.read().decode('utf-8')
+    return str(file_content, 'utf-8')
+
+
+def source_size(file_content: DocumentSource) -> int:
+    if isinstance(file_content, str):
+        return os.path.getsize(file_content)
+    return len(file_content)
+
+
+@contextmanager
+def file_buffer(file) -> Iterator[memoryview]:
+    """
+    Zero-copy, read-only view of a (spooled) temp file.
+
+    For a SpooledTemporaryFile still held in memory this is a view of its
+    BytesIO buffer; once it has rolled over to disk (or for any real file) the
+    file is mmapped instead.
+    """
+    inner = getattr(file, "_file", file)
+    if isinstance(inner, BytesIO):
+        view = inner.getbuffer()
         try:
-            doc = fitz.open(stream=file_content, filetype="pdf")
-            text = ""
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                page_text = page.get_text()
-                if page_text.strip():  
-                    text += page_text + "\n"
-            
-            doc.close()
-            return text.strip()
-        except Exception as e:
-            print(f"Error reading PDF with PyMuPDF: {e}, trying pypdf fallback...")
-    
-    # Fallback to pypdf
+            yield view
+        finally:
+            view.release()
+        return
+
+    inner.flush()
+    if os.fstat(inner.fileno()).st_size == 0:
+        yield memoryview(b"")
+        return
+    mapped = mmap.mmap(inner.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+
+@asynccontextmanager
+async def upload_source(upload) -> AsyncIterator[DocumentSource]:
+    """
+    Yield an extractor source for an UploadFile without reading it into bytes.
+    Objects that only implement `read()` (e.g. the Streamlit wrapper) are read
+    as before.
+    """
+    spooled = getattr(upload, "file", None)
+    if spooled is None:
+        yield await upload.read()
+        return
+    with file_buffer(spooled) as view:
+        yield view
+
+
+# Page-parallel extraction settings. Small PDFs are cheaper to read in a single
+# thread than to hand off to worker processes, so sharding only kicks in above
+# PDF_PARALLEL_MIN_PAGES.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+PDF_PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "16"))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Pages buffered before header/footer statistics are trusted for streaming ingestion
+BOILERPLATE_SAMPLE_PAGES = int(os.getenv("BOILERPLATE_SAMPLE_PAGES", "8"))
+
+_pdf_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool used for page-parallel PDF extraction."""
+    global _pdf_process_pool
+    if _pdf_process_pool is None:
+        _pdf_process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+        print(f"[DocProcessor] ✅ Started PDF extraction pool ({PDF_EXTRACT_WORKERS} workers)")
+    return _pdf_process_pool
+
+
+def _reset_pdf_process_pool() -> None:
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _pdf_process_pool
+    if _pdf_process_pool is not None:
+        _pdf_process_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_process_pool = None
+
+
+def _extract_pdf_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    Worker entry point: open the shared temp file and extract pages [start, end)
+    as (1-based page number, text) pairs. Every worker maps the same file from
+    the OS page cache, so the PDF bytes are never pickled across the process
+    boundary.
+    """
+    doc = fitz.open(pdf_path)
     try:
-        pdf_reader = pypdf.PdfReader(BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
+        pages = []
+        for page_num in range(start, end):
+            page_text = doc[page_num].get_text()
             if page_text.strip():
-                text += page_text + "\n"
-        return text.strip()
-    except Exception as e:
-        print(f"Error reading PDF with pypdf: {e}")
-        return ""
+                pages.append((page_num + 1, page_text))
+        return pages
+    finally:
+        doc.close()
+
 
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extract text from DOCX file"""
+def _pdf_page_count(file_content: DocumentSource) -> int:
+    doc = _open_pdf(file_content)
     try:
-        doc = docx.Document(BytesIO(file_content))
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        print(f"Error reading DOCX: {e}")
-        return ""
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def _write_temp_pdf(file_content: Union[bytes, memoryview]) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+        temp_file.write(file_content)
+        return temp_file.name
+
+
+def _pdf_path_for_workers(file_content: DocumentSource) -> Tuple[str, bool]:
+    """Path the pool workers can open, and whether it is a temp copy we own."""
+    if isinstance(file_content, str):
+        return file_content, False
+    return _write_temp_pdf(file_content), True
 
-def extract_text_from_txt(file_content: bytes) -> str:
+
+def extract_text_from_txt(file_content: DocumentSource) -> str:
     """Extract text from TXT file"""
     try:
-        return file_content.decode('utf-8')
+        return _decode_utf8(file_content)
     except Exception as e:
         print(f"Error reading TXT: {e}")
         return ""
 
-def extract_text_from_json(file_content: bytes) -> str:
+def extract_text_from_json(file_content: DocumentSource) -> str:
     """Extract text from JSON file"""
     try:
-        data = json.loads(file_content.decode('utf-8'))
+        data = json.loads(_decode_utf8(file_content))
         # Convert JSON to readable text format
         if isinstance(data, dict):
             text = ""
@@ -103,64 +215,280 @@ def extract_text_from_json(file_content: bytes) -> str:
         print(f"Error reading JSON: {e}")
         return ""
 
-def cleanup_text(text: str) -> str:
-    """Clean up text by removing duplicate lines (e.g. headers/footers) using hashing"""
-    deduplicator = ContentDeduplicator()
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        stripped = line.strip()
-        # Allow empty lines to preserve some structure, but deduplicate non-empty lines
-        # We also skip very short lines to avoid aggressive filtering of common words
-        if not stripped or len(stripped) < 4:
-            cleaned_lines.append(line)
-            continue
-            
-        if not deduplicator.is_duplicate(stripped):
-            cleaned_lines.append(line)
-            
-    return '\n'.join(cleaned_lines)
+# ---------------------------------------------------------------------------
+# Streaming, page-aware extraction
+# ---------------------------------------------------------------------------
+# The functions below never materialise the whole document as one string: pages
+# are yielded one at a time, deduplicated against what has been seen so far and
+# split into chunks that carry the page they came from.
+
+def iter_pdf_pages(file_content: DocumentSource, first_page: int = 1) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) for every non-empty PDF page from `first_page` on, 1-based."""
+    if HAS_FITZ:
+        try:
+            doc = _open_pdf(file_content)
+        except Exception as e:
+            print(f"Error reading PDF with PyMuPDF: {e}, trying pypdf fallback...")
+        else:
+            try:
+                for page_num in range(max(first_page, 1) - 1, len(doc)):
+                    page_text = doc[page_num].get_text()
+                    if page_text.strip():
+                        yield page_num + 1, page_text
+            finally:
+                doc.close()
+            return
+
+    try:
+        with _binary_stream(file_content) as stream:
+            pdf_reader = pypdf.PdfReader(stream)
+            for page_num, page in enumerate(pdf_reader.pages, start=1):
+                if page_num < first_page:
+                    continue
+                page_text = page.extract_text()
+                if page_text.strip():
+                    yield page_num, page_text
+    except Exception as e:
+        print(f"Error reading PDF with pypdf: {e}")
+
+
+def extract_pdf_outline(file_content: DocumentSource) -> List[Dict[str, Any]]:
+    """
+    Read the PDF outline (bookmarks) and return entries with page ranges and
+    parsed chapter/section numbers. Returns [] when the PDF has no outline.
+    """
+    if not HAS_FITZ:
+        return []
+    try:
+        doc = _open_pdf(file_content)
+    except Exception as e:
+        print(f"[DocProcessor] Could not read PDF outline: {e}")
+        return []
+    try:
+        return build_outline(doc.get_toc(simple=True), len(doc))
+    finally:
+        doc.close()
+
+
+def _page_break_position(paragraph) -> Optional[str]:
+    """
+    Return "before" if Word last rendered a page break inside this paragraph,
+    "after" if it carries an explicit page break, otherwise None.
+    """
+    for element in paragraph._p.iter(DOCX_BREAK_TAG, DOCX_RENDERED_BREAK_TAG):
+        if element.tag == DOCX_RENDERED_BREAK_TAG:
+            return "before"
+        if element.get(DOCX_BREAK_TYPE_ATTR) == "page":
+            return "after"
+    return None
+
+
+def iter_docx_pages(file_content: DocumentSource) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) for a DOCX file. DOCX has no fixed layout, so pages
+    are approximated from explicit page breaks and the renderer's last known
+    page breaks stored in the document.
+    """
+    try:
+        with _binary_stream(file_content) as stream:
+            doc = docx.Document(stream)
+    except Exception as e:
+        print(f"Error reading DOCX: {e}")
+        return
+
+    page_number = 1
+    lines: List[str] = []
+    for paragraph in doc.paragraphs:
+        position = _page_break_position(paragraph)
+        if position == "before" and lines:
+            page_text = "\n".join(lines)
+            if page_text.strip():
+                yield page_number, page_text
+            page_number += 1
+            lines = []
+
+        lines.append(paragraph.text)
+
+        if position == "after":
+            page_text = "\n".join(lines)
+            if page_text.strip():
+                yield page_number, page_text
+            page_number += 1
+            lines = []
+
+    page_text = "\n".join(lines)
+    if page_text.strip():
+        yield page_number, page_text
+
+
+def iter_document_pages(file_content: DocumentSource, file_extension: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Yield (page_number, text) pairs for any supported file type. Formats
+    without pages (txt, json) yield a single entry with page_number None.
+    """
+    if file_extension == 'pdf':
+        yield from iter_pdf_pages(file_content)
+    elif file_extension == 'docx':
+        yield from iter_docx_pages(file_content)
+    else:
+        text = extract_text_from_json(file_content) if file_extension == 'json' else extract_text_from_txt(file_content)
+        if text.strip():
+            yield None, text
+
+
+async def aiter_document_pages(
+    file_content: DocumentSource,
+    file_extension: str,
+    pages_per_hop: int = 8,
+) -> AsyncIterator[Tuple[Optional[int], str]]:
+    """
+    Async version of iter_document_pages that keeps parsing off the event loop.
+
+    Large PDFs are read shard by shard from the process pool with at most
+    PDF_EXTRACT_WORKERS shards in flight; everything else is pulled from the
+    synchronous generator a few pages per worker-thread hop. If the pool or a
+    shard fails, the pool is reset and the rest of the PDF is read serially,
+    starting after the last page already yielded.
+    """
+    page_iter = None
+    if file_extension == 'pdf' and HAS_FITZ and PDF_EXTRACT_WORKERS > 1:
+        try:
+            page_count = await asyncio.to_thread(_pdf_page_count, file_content)
+        except Exception:
+            page_count = 0
+
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            temp_path, owns_temp = await asyncio.to_thread(_pdf_path_for_workers, file_content)
+            loop = asyncio.get_running_loop()
+            pending = deque()
+            pages_done = 0
+            try:
+                pool = get_pdf_process_pool()
+                shard_starts = iter(range(0, page_count, PDF_PAGES_PER_SHARD))
+                for start in islice(shard_starts, PDF_EXTRACT_WORKERS):
+                    end = min(start + PDF_PAGES_PER_SHARD, page_count)
+                    pending.append(loop.run_in_executor(pool, _extract_pdf_page_range, temp_path, start, end))
+
+                while pending:
+                    shard = await pending.popleft()
+                    start = next(shard_starts, None)
+                    if start is not None:
+                        end = min(start + PDF_PAGES_PER_SHARD, page_count)
+                        pending.append(loop.run_in_executor(pool, _extract_pdf_page_range, temp_path, start, end))
+                    for page in shard:
+                        yield page
+                    pages_done = min(pages_done + PDF_PAGES_PER_SHARD, page_count)
+                return
+            except Exception as e:
+                print(f"[DocProcessor] ⚠️ Parallel PDF extraction failed after {pages_done} pages: {e}, "
+                      f"continuing serially")
+                _reset_pdf_process_pool()
+                page_iter = iter_pdf_pages(file_content, first_page=pages_done + 1)
+            finally:
+                for future in pending:
+                    future.cancel()
+                if owns_temp:
+                    try:
+                        os.remove(temp_path)
+                    except OSError:
+                        pass
+
+    if page_iter is None:
+        page_iter = iter_document_pages(file_content, file_extension)
+    while True:
+        pages = await asyncio.to_thread(lambda: list(islice(page_iter, pages_per_hop)))
+        if not pages:
+            break
+        for page in pages:
+            yield page
+
+
+async def aiter_page_chunks(
+    file_content: DocumentSource,
+    file_extension: str,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    batch_size: int = 64,
+) -> AsyncIterator[List[Tuple[Optional[int], str]]]:
+    """
+    Extract, clean and chunk a document incrementally.
+
+    Yields batches of (page_number, chunk) so callers can embed and index the
+    first pages while later ones are still being parsed. The first
+    BOILERPLATE_SAMPLE_PAGES pages are buffered to learn recurring
+    headers/footers; after that each page is stripped as it arrives using the
+    statistics gathered so far. Near-duplicate chunks are dropped before they
+    reach the embedding API.
+    """
+    detector = BoilerplateDetector()
+    near_duplicates = NearDuplicateFilter()
+    text_splitter = TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    pending: deque = deque()
+    ready: List[Tuple[Optional[int], str]] = []
+    dropped = 0
+
+    def drain_pending() -> None:
+        nonlocal dropped
+        while pending:
+            page_number, page_text = pending.popleft()
+            for chunk in text_splitter.split_text(detector.strip(page_text)):
+                if near_duplicates.is_duplicate(chunk):
+                    dropped += 1
+                else:
+                    ready.append((page_number, chunk))
+
+    async for page_number, page_text in aiter_document_pages(file_content, file_extension):
+        detector.observe(page_text)
+        pending.append((page_number, page_text))
+        if detector.page_count >= BOILERPLATE_SAMPLE_PAGES:
+            await asyncio.to_thread(drain_pending)
+        while len(ready) >= batch_size:
+            yield ready[:batch_size]
+            del ready[:batch_size]
+
+    await asyncio.to_thread(drain_pending)
+    while ready:
+        yield ready[:batch_size]
+        del ready[:batch_size]
+
+    if dropped:
+        print(f"[DocProcessor] 🧹 Dropped {dropped} near-duplicate chunk(s)")
+
+
+def cleanup_pages(pages: List[str]) -> str:
+    """
+    Join extracted pages after stripping header/footer lines that recur on a
+    large share of them.
+    """
+    detector = BoilerplateDetector().fit(pages)
+    return "\n".join(detector.strip(page_text) for page_text in pages).strip()
 
 
 
 async def process_uploaded_files_api(uploaded_files: List[UploadFile]) -> List[DocumentInfo]:
     """Process uploaded files and extract text content for API"""
     processed_docs = []
-    import asyncio
     
     for file in uploaded_files:
         if file is not None:
             try:
-                # Read file content
-                file_content = await file.read()
                 file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'txt'
                 file_id = str(uuid.uuid4())
-                
-                
-                text = ""
-                if file_extension == 'pdf':
-                    text = await asyncio.to_thread(extract_text_from_pdf, file_content)
-                elif file_extension == 'docx':
-                    text = await asyncio.to_thread(extract_text_from_docx, file_content)
-                elif file_extension == 'txt':
-                    text = extract_text_from_txt(file_content)  
-                elif file_extension == 'json':
-                    text = extract_text_from_json(file_content) 
-                else:
-                    text = extract_text_from_txt(file_content)  
+                # Extract straight from the upload's spooled buffer, no bytes copy
+                async with upload_source(file) as file_content:
+                    file_size = source_size(file_content)
+                    pages = [page_text async for _, page_text in aiter_document_pages(file_content, file_extension)]
+                text = cleanup_pages(pages)
                 
                 if text.strip():
-                    # Apply DSA optimization: Deduplicate content
-                    text = cleanup_text(text)
-                   
                     doc_info = DocumentInfo(
                         id=file_id,
                         filename=file.filename,
                         content=text,
                         file_type=file_extension,
                         file_url=f"uploaded/{file.filename}",  
-                        size=len(file_content)
+                        size=file_size
                     )
                     processed_docs.append(doc_info)
                 else:
@@ -175,26 +503,17 @@ async def process_uploaded_files_api(uploaded_files: List[UploadFile]) -> List[D
 async def process_knowledge_base_files(uploaded_files: List[UploadFile]) -> List[DocumentInfo]:
     """Process knowledge base files and extract text content"""
     processed_docs = []
-    import asyncio
     
     for file in uploaded_files:
         if file is not None:
             try:
-                # Read file content
-                file_content = await file.read()
                 file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else 'txt'
                 file_id = str(uuid.uuid4())
-                text = ""
-                if file_extension == 'pdf':
-                    text = await asyncio.to_thread(extract_text_from_pdf, file_content)
-                elif file_extension == 'docx':
-                    text = await asyncio.to_thread(extract_text_from_docx, file_content)
-                elif file_extension == 'txt':
-                    text = extract_text_from_txt(file_content)  
-                elif file_extension == 'json':
-                    text = extract_text_from_json(file_content) 
-                else:
-                    text = extract_text_from_txt(file_content) 
+                # Extract straight from the upload's spooled buffer, no bytes copy
+                async with upload_source(file) as file_content:
+                    file_size = source_size(file_content)
+                    pages = [page_text async for _, page_text in aiter_document_pages(file_content, file_extension)]
+                text = cleanup_pages(pages)
                 
                 if text.strip():
                     doc_info = DocumentInfo(
@@ -203,7 +522,7 @@ async def process_knowledge_base_files(uploaded_files: List[UploadFile]) -> List
                         content=text,
                         file_type=file_extension,
                         file_url=f"kb/{file.filename}",  
-                        size=len(file_content)
+                        size=file_size
                     )
                     processed_docs.append(doc_info)
                 else:
@@ -0,0 +1,259 @@
+"""
+Shared streaming downloader for document URLs.
+
+One pooled httpx.AsyncClient is reused for every document download so TLS
+sessions and keep-alive connections are shared, and a per-host semaphore keeps
+a single origin from monopolising the pool. Bodies are streamed to a spooled
+temp file with a hard size cap instead of being buffered with
+`response.content`. Responses that carry an ETag or Last-Modified validator are
+kept on disk in a small LRU cache so an unchanged URL is answered with a
+conditional request (304) instead of a full re-download.
+
+Cached files are reference-counted: a file that is evicted or replaced by a
+newer download while a DownloadedFile still points at it (extractors and
+pool workers open it by path) is only unlinked when the last one closes.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+from typing import Any, Callable, Dict, Optional, Set
+
+import httpx
+
+try:
+    from backend.utils.dsa_utils import LRUCache
+except ImportError:
+    from utils.dsa_utils import LRUCache
+
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+DOWNLOAD_SPOOL_MAX_MEMORY = int(os.getenv("DOWNLOAD_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "20"))
+DOWNLOAD_PER_HOST_LIMIT = int(os.getenv("DOWNLOAD_PER_HOST_LIMIT", "4"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_CACHE_ENTRIES = int(os.getenv("DOWNLOAD_CACHE_ENTRIES", "64"))
+DOWNLOAD_CACHE_DIR = os.getenv(
+    "DOWNLOAD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "edtech_download_cache")
+)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLargeError(Exception):
+    """Raised when a response body exceeds the configured size cap."""
+
+
+class DownloadedFile:
+    """
+    A downloaded body backed by a (spooled) temp file or a cached file on disk.
+    Use as a context manager, or call `close()` when done.
+    """
+
+    def __init__(
+        self,
+        file,
+        size: int,
+        content_type: Optional[str] = None,
+        path: Optional[str] = None,
+        from_cache: bool = False,
+        on_close: Optional[Callable[[], None]] = None,
+    ):
+        self.file = file
+        self.size = size
+        self.content_type = content_type
+        # Set when the body lives in a named file on disk (validator cache)
+        self.path = path
+        self.from_cache = from_cache
+        self._on_close = on_close
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+    def __enter__(self) -> "DownloadedFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_download_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+# Open DownloadedFiles per cached path, and cached paths no longer in the
+# cache that are waiting for their last reader to close
+_path_refs: Dict[str, int] = {}
+_orphaned_paths: Set[str] = set()
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_cached_file(url: str, entry: Dict[str, Any]) -> None:
+    path = entry["path"]
+    if _path_refs.get(path):
+        _orphaned_paths.add(path)
+    else:
+        _unlink(path)
+
+
+def _acquire_path(path: str) -> Callable[[], None]:
+    """Count a reader of a cached file; returns the matching release callback."""
+    _path_refs[path] = _path_refs.get(path, 0) + 1
+
+    def release() -> None:
+        remaining = _path_refs.get(path, 1) - 1
+        if remaining > 0:
+            _path_refs[path] = remaining
+            return
+        _path_refs.pop(path, None)
+        if path in _orphaned_paths:
+            _orphaned_paths.discard(path)
+            _unlink(path)
+
+    return release
+
+
+_validator_cache = LRUCache(capacity=DOWNLOAD_CACHE_ENTRIES, on_evict=_remove_cached_file)
+
+
+def get_download_client() -> httpx.AsyncClient:
+    """Return the shared, pooled client used for document downloads."""
+    global _download_client
+    if _download_client is None or _download_client.is_closed:
+        _download_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=DOWNLOAD_MAX_CONNECTIONS,
+                max_keepalive_connections=DOWNLOAD_MAX_CONNECTIONS,
+                keepalive_expiry=30.0,
+            ),
+            follow_redirects=True,
+            headers={"User-Agent": "EdTech-DocFetcher/1.0"},
+        )
+    return _download_client
+
+
+async def close_download_client() -> None:
+    global _download_client
+    if _download_client is not None:
+        await _download_client.aclose()
+        _download_client = None
+
+
+def _host_semaphore(host: str) -> asyncio.Semaphore:
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(DOWNLOAD_PER_HOST_LIMIT)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _new_cache_file(url: str):
+    os.makedirs(DOWNLOAD_CACHE_DIR, exist_ok=True)
+    prefix = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16] + "-"
+    return tempfile.NamedTemporaryFile(dir=DOWNLOAD_CACHE_DIR, prefix=prefix, delete=False)
+
+
+async def download_document(url: str, max_bytes: int = DOWNLOAD_MAX_BYTES) -> DownloadedFile:
+    """
+    Stream `url` into a temp file, reusing the cached copy when the server
+    answers a conditional request with 304 Not Modified.
+
+    Raises:
+        DownloadTooLargeError: if the body is larger than `max_bytes`.
+        httpx.HTTPStatusError: for non-success responses.
+    """
+    client = get_download_client()
+    host = httpx.URL(url).host
+
+    cached = _validator_cache.get(url)
+    if cached and not os.path.exists(cached["path"]):
+        cached = None
+
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    async with _host_semaphore(host):
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached:
+                if cached["size"] > max_bytes:
+                    raise DownloadTooLargeError(
+                        f"{url} is {cached['size']} bytes, limit is {max_bytes}"
+                    )
+                print(f"[Downloader] ♻️ Not modified, reusing cached copy of {url}")
+                return DownloadedFile(
+                    open(cached["path"], "rb"),
+                    size=cached["size"],
+                    content_type=cached.get("content_type"),
+                    path=cached["path"],
+                    from_cache=True,
+                    on_close=_acquire_path(cached["path"]),
+                )
+
+            response.raise_for_status()
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise DownloadTooLargeError(
+                    f"{url} is {content_length} bytes, limit is {max_bytes}"
+                )
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            content_type = response.headers.get("Content-Type")
+            cacheable = bool(etag or last_modified)
+
+            # Responses we can revalidate go straight to a named file so the
+            # cache can hand it out later; everything else stays in memory up
+            # to DOWNLOAD_SPOOL_MAX_MEMORY before spilling to disk.
+            if cacheable:
+                file = _new_cache_file(url)
+            else:
+                file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_MAX_MEMORY)
+
+            size = 0
+            try:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise DownloadTooLargeError(f"{url} exceeded the {max_bytes} byte limit")
+                    file.write(chunk)
+            except BaseException:
+                file.close()
+                if cacheable:
+                    _unlink(file.name)
+                raise
+
+    file.flush()
+    file.seek(0)
+
+    if not cacheable:
+        return DownloadedFile(file, size=size, content_type=content_type)
+
+    if cached and cached["path"] != file.name:
+        _remove_cached_file(url, cached)
+    _validator_cache.put(url, {
+        "path": file.name,
+        "size": size,
+        "etag": etag,
+        "last_modified": last_modified,
+        "content_type": content_type,
+    })
+    return DownloadedFile(
+        file, size=size, content_type=content_type, path=file.name, on_close=_acquire_path(file.name)
+    )
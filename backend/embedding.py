@@ -5,6 +5,15 @@ from typing import List, Dict
 import httpx
 import asyncio
 
+try:
+    from backend.rate_limiter import limited_async_client
+    from backend.utils.dsa_utils import LRUCache
+except ImportError:
+    from rate_limiter import limited_async_client
+    from utils.dsa_utils import LRUCache
+
+EMBED_QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "2048"))
+
 _persistent_http_client = httpx.Client(
     http2=True,
     timeout=httpx.Timeout(60.0),  
@@ -14,8 +23,22 @@ _persistent_http_client = httpx.Client(
     },
 )
 
+# aembed_* calls go through the per-provider/model limiters (rate_limiter.py)
+_persistent_async_http_client = limited_async_client(
+    http2=True,
+    timeout=httpx.Timeout(60.0),
+    headers={
+        "Connection": "keep-alive",
+        "User-Agent": "DruidX-Embedding-Service/1.0"
+    },
+)
+
 _cached_embedding_models: Dict[str, OpenAIEmbeddings] = {}
 
+# Query embeddings by (model, dimensions, query); the semantic answer cache
+# and KB retrieval embed the same user query back to back.
+_query_embedding_cache = LRUCache(EMBED_QUERY_CACHE_SIZE)
+
 
 def get_embedding_model(model: str = "text-embedding-3-small", dimensions: int = None) -> OpenAIEmbeddings:
     """
@@ -30,6 +53,7 @@ def get_embedding_model(model: str = "text-embedding-3-small", dimensions: int =
         embedding_kwargs = {
             "model": model,
             "http_client": _persistent_http_client,
+            "http_async_client": _persistent_async_http_client,
             "show_progress_bar": False
         }
         # Add dimensions parameter if specified (for text-embedding-3 models)
@@ -130,5 +154,11 @@ async def embed_query(
     Returns:
         Embedding vector as list of floats
     """
+    cache_key = f"{model}:{dimensions}:{query}"
+    cached = _query_embedding_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
     embedding_model = get_embedding_model(model, dimensions=dimensions)
-    return await embedding_model.aembed_query(query)
+    vector = await embedding_model.aembed_query(query)
+    _query_embedding_cache.put(cache_key, tuple(vector))
+    return vector
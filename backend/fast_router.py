@@ -0,0 +1,183 @@
+"""
+Rule-based pre-router for the teacher and student orchestrators.
+
+Turns whose route is obvious from the message and the request state are
+routed without the analyze_query LLM call:
+
+- a generation/editing verb acting directly on an image noun ("draw a
+  picture"), or an edit phrased against an attached image → Image
+- a fresh (non-image) upload plus a reference to it → RAG
+- an explicit search phrase ("search the web", "look it up", "latest news")
+  → WebSearch
+- a bare greeting or acknowledgement → SimpleLLM
+- a short follow-up ("explain more", "give an example") → the last text route
+
+Anything else returns None and goes to the LLM router. A sample of fast-routed
+turns (FAST_ROUTER_SHADOW_RATE) is also sent to the LLM router in the
+background at batch priority, and agreement is counted per rule in
+fast_router_shadow_total / fast_router_shadow_agree_total.
+"""
+import asyncio
+import os
+import random
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+try:
+    from backend.metrics import metrics
+    from backend.rate_limiter import set_request_priority
+except ImportError:
+    from metrics import metrics
+    from rate_limiter import set_request_priority
+
+FAST_ROUTER_ENABLED = os.getenv("FAST_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+FAST_ROUTER_SHADOW_RATE = float(os.getenv("FAST_ROUTER_SHADOW_RATE", "0.1"))
+
+# Boundaries that also treat hyphens as part of the word ("photo-electric" is not "photo")
+_B, _E = r"(?<![\w-])", r"(?![\w-])"
+_IMAGE_NOUNS = r"(?:image|picture|photo|illustration|drawing|poster|artwork|logo|wallpaper)s?"
+# The generation verb must act directly on the image noun: "create a picture of ..."
+# and the noun must be the object, not a modifier ("generate the image captions")
+_IMAGE_REQUEST_RE = re.compile(
+    _B + r"(?:generate|create|draw|make|design|paint|render|edit|modify)\s+(?:me\s+)?"
+    r"(?:(?:an?|the|this|that|my|one|some|another)\s+)?" + _IMAGE_NOUNS + _E +
+    r"(?=\s*(?:[.,;:!?]|$)|\s+(?:of|showing|depicting|illustrating|with|for|about|in|that|to|where|like|please)\b)",
+    re.I,
+)
+# Edits phrased against an attached image ("make it brighter", "remove the background")
+_IMAGE_EDIT_RE = re.compile(
+    _B + r"(?:(?:edit|modify|recolou?r|crop|brighten|darken)\s+(?:it|this)|make it (?:brighter|darker|a cartoon)|"
+    r"(?:remove|change|replace)\s+the\s+(?:background|colou?rs?))" + _E,
+    re.I,
+)
+_DOC_REFERENCE_RE = re.compile(
+    r"\b(?:this|these|attached|uploaded|document|documents|doc|docs|file|files|pdf|notes|chapter|slides?|"
+    r"summari[sz]e|summary|key points|according to)\b",
+    re.I,
+)
+_SEARCH_RE = re.compile(
+    _B + r"(?:search (?:the )?(?:web|internet|online)|web search|google (?:it|this|that|for)|look (?:it|this|that) up|"
+    r"look up online|browse the (?:web|internet)|latest news|news headlines|today'?s (?:news|headlines))" + _E,
+    re.I,
+)
+_GREETING_RE = re.compile(
+    r"^(?:hi|hello|hey|hiya|namaste|good (?:morning|afternoon|evening))(?: there| buddy| tutor)?[\s!.,]*$", re.I
+)
+_ACK_RE = re.compile(
+    r"^(?:thanks?(?: you)?(?: so much)?|thank you|ok(?:ay)?|cool|great|got it|nice|bye|goodbye|see you)[\s!.,]*$",
+    re.I,
+)
+_FOLLOW_UP_RE = re.compile(
+    r"^(?:(?:can you |please )?(?:explain|tell me|say) (?:it |that |this )?(?:more|again|further|in more detail|simpler|"
+    r"more simply)|(?:give|show) (?:me )?(?:an?|another|more) examples?|continue|go on|elaborate|simplify(?: it| that)?|"
+    r"make it (?:shorter|longer|simpler)|(?:in|translate (?:it |that )?(?:in|to)) (?:hindi|english))[\s?!.]*$",
+    re.I,
+)
+_TEXT_ROUTES = {"simple_llm": "SimpleLLM", "rag": "RAG", "websearch": "WebSearch"}
+
+_shadow_tasks: set = set()
+
+
+class RouteDecision:
+    """A confident routing decision and the rule that produced it."""
+
+    __slots__ = ("plan", "rule", "reasoning")
+
+    def __init__(self, plan: List[str], rule: str, reasoning: str):
+        self.plan = plan
+        self.rule = rule
+        self.reasoning = reasoning
+
+    def as_routing(self) -> Dict[str, Any]:
+        """Same shape as analyze_query's result."""
+        return {"execution_order": list(self.plan), "reasoning": self.reasoning}
+
+
+def _split_uploads(new_uploaded_docs: Optional[Sequence[Any]]):
+    images, documents = 0, 0
+    for doc in new_uploaded_docs or []:
+        if isinstance(doc, dict) and doc.get("file_type") == "image":
+            images += 1
+        else:
+            documents += 1
+    return images, documents
+
+
+def fast_route(
+    user_message: str,
+    new_uploaded_docs: Optional[Sequence[Any]] = None,
+    last_route: Optional[str] = None,
+    has_history: bool = False,
+) -> Optional[RouteDecision]:
+    """The route for `user_message` if a rule decides it confidently, else None."""
+    if not FAST_ROUTER_ENABLED:
+        return None
+    text = (user_message or "").strip()
+    if not text:
+        return None
+    images, documents = _split_uploads(new_uploaded_docs)
+
+    if _IMAGE_REQUEST_RE.search(text) or (images and not documents and _IMAGE_EDIT_RE.search(text)):
+        return RouteDecision(["Image"], "image_verb", "Explicit image generation/editing request")
+
+    if documents:
+        if _DOC_REFERENCE_RE.search(text):
+            return RouteDecision(["RAG"], "new_upload", "Question about newly uploaded documents")
+        return None
+
+    if _SEARCH_RE.search(text) and not _DOC_REFERENCE_RE.search(text):
+        return RouteDecision(["WebSearch"], "search_cue", "Explicit web search request")
+
+    if _GREETING_RE.match(text) or _ACK_RE.match(text):
+        return RouteDecision(["SimpleLLM"], "greeting", "Greeting or acknowledgement")
+
+    if has_history and last_route in _TEXT_ROUTES and _FOLLOW_UP_RE.match(text):
+        return RouteDecision([_TEXT_ROUTES[last_route]], "follow_up", f"Follow-up to the previous {last_route} answer")
+
+    return None
+
+
+def should_shadow() -> bool:
+    return FAST_ROUTER_SHADOW_RATE > 0 and random.random() < FAST_ROUTER_SHADOW_RATE
+
+
+async def _compare(audience: str, decision: RouteDecision, llm_route: Callable[[], Awaitable[Dict[str, Any]]],
+                   normalize: Callable[[str], str]) -> None:
+    set_request_priority("batch")
+    try:
+        routing = await llm_route()
+    except Exception as e:
+        print(f"[FastRouter] ⚠️ Shadow LLM routing failed: {e}")
+        return
+    llm_plan = [normalize(step) for step in (routing or {}).get("execution_order") or ["SimpleLLM"] if step]
+    fast_plan = [normalize(step) for step in decision.plan]
+    agree = bool(llm_plan) and llm_plan[0] == fast_plan[0]
+
+    metrics.inc("fast_router_shadow_total", audience=audience, rule=decision.rule)
+    if agree:
+        metrics.inc("fast_router_shadow_agree_total", audience=audience, rule=decision.rule)
+    total = metrics.counter("fast_router_shadow_total", audience=audience, rule=decision.rule)
+    agreed = metrics.counter("fast_router_shadow_agree_total", audience=audience, rule=decision.rule)
+    print(
+        f"[FastRouter] 📊 {audience}/{decision.rule}: fast={fast_plan} llm={llm_plan} "
+        f"{'agree' if agree else 'DISAGREE'} (agreement {agreed / total:.0%} over {int(total)})"
+    )
+
+
+def shadow_compare(
+    audience: str,
+    decision: RouteDecision,
+    llm_route: Callable[[], Awaitable[Dict[str, Any]]],
+    normalize: Callable[[str], str],
+) -> None:
+    """Run the LLM router for a fast-routed turn in the background and count agreement."""
+    task = asyncio.create_task(_compare(audience, decision, llm_route, normalize))
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+
+def record_fast_route(audience: str, decision: Optional[RouteDecision]) -> None:
+    rule = decision.rule if decision else "llm"
+    metrics.inc("fast_router_decisions_total", audience=audience, rule=rule)
+    if decision:
+        print(f"[FastRouter] ⚡ {audience}: {decision.plan} via '{decision.rule}' (skipped analyze_query)")
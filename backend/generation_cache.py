@@ -0,0 +1,119 @@
+"""
+Exact-match result cache for the teacher content generators.
+
+Entries are keyed by the content type, the normalized request payload
+(string fields trimmed, whitespace collapsed and case-folded) and the version
+of the knowledge-base collection the generators retrieve from. The version is
+the collection's point count, so ingesting documents into a KB invalidates
+every cached result built on it. Entries expire after a TTL and the cache is
+LRU-bounded.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from backend.metrics import metrics
+    from backend.qdrant_service import get_qdrant_client
+    from backend.utils.dsa_utils import LRUCache
+    from backend.teacher.Content_generation.worksheet import LANGUAGES
+except ImportError:
+    from metrics import metrics
+    from qdrant_service import get_qdrant_client
+    from utils.dsa_utils import LRUCache
+    from teacher.Content_generation.worksheet import LANGUAGES
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", "3600"))
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+
+
+def normalize_payload(value: Any) -> Any:
+    """Canonical form of a request payload for cache keys."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {k: normalize_payload(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_payload(v) for v in value]
+    return value
+
+
+def kb_collection_name(payload: Dict[str, Any]) -> str:
+    """The KB collection the content generators retrieve from for this request."""
+    grade = payload.get("grade", "Unknown Grade")
+    subject_normalized = payload.get("subject", "Unknown Subject").lower().replace(" ", "_")
+    language = payload.get("language", "English")
+    lang_code = LANGUAGES.get(language, language).lower()
+    return f"kb_grad_{grade}_sub_{subject_normalized}_lang_{lang_code}"
+
+
+async def kb_collection_version(collection_name: str) -> Optional[int]:
+    """
+    Point count of a KB collection (0 if it doesn't exist), or None if Qdrant
+    could not be asked, in which case the result must not be cached.
+    """
+    client = get_qdrant_client()
+    try:
+        exists = await asyncio.to_thread(client.collection_exists, collection_name)
+        if not exists:
+            return 0
+        info = await asyncio.to_thread(client.get_collection, collection_name)
+        return info.points_count or 0
+    except Exception as e:
+        print(f"[GenCache] ⚠️ Could not read version of '{collection_name}': {e}")
+        return None
+
+
+class GenerationCache:
+    """TTL + LRU cache of generated content by request key."""
+
+    def __init__(self, capacity: int = GENERATION_CACHE_SIZE, ttl_seconds: int = GENERATION_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = LRUCache(capacity)
+
+    @staticmethod
+    def key(content_type: str, payload: Dict[str, Any], kb_version: int) -> str:
+        canonical = json.dumps(
+            [content_type, normalize_payload(payload), kb_version],
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, content_type: str = "") -> Optional[Any]:
+        entry: Optional[Tuple[float, Any]] = self._entries.get(key)
+        if entry is not None and entry[0] < time.time():
+            self._entries.cache.pop(key, None)
+            entry = None
+        metrics.inc("generation_cache_hits_total" if entry else "generation_cache_misses_total", type=content_type)
+        return entry[1] if entry else None
+
+    def put(self, key: str, value: Any) -> None:
+        if not value:
+            return
+        self._entries.put(key, (time.time() + self.ttl_seconds, value))
+        metrics.set_gauge("generation_cache_entries", len(self._entries.cache))
+
+    def clear(self) -> int:
+        count = len(self._entries.cache)
+        self._entries.cache.clear()
+        metrics.set_gauge("generation_cache_entries", 0)
+        return count
+
+
+generation_cache = GenerationCache()
+
+
+async def generation_cache_key(content_type: str, payload: Dict[str, Any]) -> Optional[str]:
+    """Cache key for a generator request, or None if caching is off or the KB version is unknown."""
+    if not GENERATION_CACHE_ENABLED:
+        return None
+    kb_version = await kb_collection_version(kb_collection_name(payload))
+    if kb_version is None:
+        return None
+    return GenerationCache.key(content_type, payload, kb_version)
@@ -0,0 +1,234 @@
+"""
+Background ingestion jobs for the add-documents endpoints.
+
+Documents are downloaded, extracted, embedded and upserted by a background
+task while the HTTP request returns a job id immediately. A single semaphore
+bounds how many documents are processed at once across all jobs, and every
+progress update is pushed to SSE subscribers as a full job snapshot.
+"""
+import asyncio
+import copy
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from uuid import uuid4
+
+INGESTION_MAX_CONCURRENT_DOCS = int(os.getenv("INGESTION_MAX_CONCURRENT_DOCS", "4"))
+INGESTION_JOB_TTL_SECONDS = int(os.getenv("INGESTION_JOB_TTL_SECONDS", "3600"))
+INGESTION_SUBSCRIBER_QUEUE_SIZE = 32
+
+PROGRESS_COUNTERS = ("downloaded", "extracted", "embedded", "indexed", "failed")
+TERMINAL_STATUSES = {"completed", "partial", "failed"}
+
+
+class IngestionProgress:
+    """Progress handle handed to the per-document worker."""
+
+    def __init__(self, manager: "IngestionJobManager", job_id: str, doc_id: str):
+        self._manager = manager
+        self.job_id = job_id
+        self.doc_id = doc_id
+
+    def add(self, counter: str, amount: int = 1) -> None:
+        """Increment a job counter (downloaded/extracted/embedded/indexed)."""
+        self._manager._increment(self.job_id, self.doc_id, counter, amount)
+
+    async def track_batches(self, batches: AsyncIterator[List[Any]]) -> AsyncIterator[List[Any]]:
+        """Pass chunk batches through while counting them as extracted."""
+        async for batch in batches:
+            self.add("extracted", len(batch))
+            yield batch
+
+
+DocumentWorker = Callable[[Dict[str, Any], IngestionProgress], Awaitable[bool]]
+FailureCallback = Callable[[Dict[str, Any], Optional[str]], Awaitable[None]]
+
+
+class IngestionJobManager:
+    """
+    Tracks ingestion jobs in memory and runs their documents with bounded
+    concurrency.
+    """
+
+    def __init__(self, max_concurrent_docs: int = INGESTION_MAX_CONCURRENT_DOCS):
+        self._semaphore = asyncio.Semaphore(max_concurrent_docs)
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(
+        self,
+        owner_id: str,
+        session_id: str,
+        documents: List[Dict[str, Any]],
+        worker: DocumentWorker,
+        on_document_failed: Optional[FailureCallback] = None,
+    ) -> Dict[str, Any]:
+        """
+        Register a job and start it in the background.
+
+        Args:
+            owner_id: Teacher or student id the job belongs to.
+            session_id: Session the documents are added to.
+            documents: Document dicts; each must carry an "id".
+            worker: Coroutine that ingests one document and returns True on success.
+            on_document_failed: Optional coroutine called with (doc, error) when a
+                document fails, e.g. to unregister it from the session.
+
+        Returns:
+            Snapshot of the newly created job.
+        """
+        self._prune()
+
+        job_id = str(uuid4())
+        now = time.time()
+        self.jobs[job_id] = {
+            "job_id": job_id,
+            "owner_id": owner_id,
+            "session_id": session_id,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "completed_at": None,
+            "counters": {"documents_total": len(documents), **{name: 0 for name in PROGRESS_COUNTERS}},
+            "documents": {
+                doc["id"]: {"filename": doc.get("filename", ""), "status": "queued", "error": None}
+                for doc in documents
+            },
+        }
+        self._tasks[job_id] = asyncio.create_task(
+            self._run(job_id, documents, worker, on_document_failed)
+        )
+        print(f"[Ingestion] 📥 Queued job {job_id} with {len(documents)} document(s)")
+        return self.snapshot(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    def snapshot(self, job_id: str) -> Dict[str, Any]:
+        return copy.deepcopy(self.jobs[job_id])
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield the current job snapshot, then one snapshot per progress update
+        until the job reaches a terminal status.
+        """
+        if job_id not in self.jobs:
+            return
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=INGESTION_SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            snapshot = self.snapshot(job_id)
+            yield snapshot
+            while snapshot["status"] not in TERMINAL_STATUSES:
+                snapshot = await queue.get()
+                yield snapshot
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+    async def _run(
+        self,
+        job_id: str,
+        documents: List[Dict[str, Any]],
+        worker: DocumentWorker,
+        on_document_failed: Optional[FailureCallback],
+    ) -> None:
+        self._set_status(job_id, "running")
+        try:
+            await asyncio.gather(*[
+                self._run_document(job_id, doc, worker, on_document_failed)
+                for doc in documents
+            ])
+        finally:
+            job = self.jobs[job_id]
+            failed = job["counters"]["failed"]
+            if failed == 0:
+                status = "completed"
+            elif failed < job["counters"]["documents_total"]:
+                status = "partial"
+            else:
+                status = "failed"
+            job["completed_at"] = time.time()
+            self._set_status(job_id, status)
+            self._tasks.pop(job_id, None)
+            print(f"[Ingestion] ✅ Job {job_id} finished with status '{status}'")
+
+    async def _run_document(
+        self,
+        job_id: str,
+        doc: Dict[str, Any],
+        worker: DocumentWorker,
+        on_document_failed: Optional[FailureCallback],
+    ) -> None:
+        doc_id = doc["id"]
+        error: Optional[str] = None
+        async with self._semaphore:
+            self._set_document_status(job_id, doc_id, "processing")
+            try:
+                ok = await worker(doc, IngestionProgress(self, job_id, doc_id))
+            except Exception as e:
+                print(f"[Ingestion] ❌ {doc.get('filename', doc_id)} failed: {e}")
+                ok, error = False, str(e)
+
+        if ok:
+            self._set_document_status(job_id, doc_id, "indexed")
+            return
+
+        self._set_document_status(job_id, doc_id, "failed", error or "No text content extracted")
+        self._increment(job_id, doc_id, "failed", 1)
+        if on_document_failed is not None:
+            try:
+                await on_document_failed(doc, error)
+            except Exception as e:
+                print(f"[Ingestion] ⚠️ Failure callback error for {doc_id}: {e}")
+
+    def _increment(self, job_id: str, doc_id: str, counter: str, amount: int) -> None:
+        job = self.jobs.get(job_id)
+        if job is None or not amount:
+            return
+        job["counters"][counter] = job["counters"].get(counter, 0) + amount
+        self._touch(job_id)
+
+    def _set_status(self, job_id: str, status: str) -> None:
+        self.jobs[job_id]["status"] = status
+        self._touch(job_id)
+
+    def _set_document_status(self, job_id: str, doc_id: str, status: str, error: Optional[str] = None) -> None:
+        doc_state = self.jobs[job_id]["documents"][doc_id]
+        doc_state["status"] = status
+        doc_state["error"] = error
+        self._touch(job_id)
+
+    def _touch(self, job_id: str) -> None:
+        self.jobs[job_id]["updated_at"] = time.time()
+        self._publish(job_id)
+
+    def _publish(self, job_id: str) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if not subscribers:
+            return
+        snapshot = self.snapshot(job_id)
+        for queue in subscribers:
+            # Every event is a full snapshot, so a slow subscriber can safely
+            # skip intermediate states.
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(snapshot)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - INGESTION_JOB_TTL_SECONDS
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in TERMINAL_STATUSES and (job["completed_at"] or 0) < cutoff
+        ]
+        for job_id in expired:
+            self.jobs.pop(job_id, None)
+            self._subscribers.pop(job_id, None)
@@ -0,0 +1,221 @@
+"""
+Embedding-based intent router for the orchestrators.
+
+The user message is embedded with `embed_query` at VECTOR_SIZE dimensions,
+the same cache key document retrieval uses, so a turn that goes on to RAG
+reuses this vector instead of embedding the query again; other turns pay one
+embedding request, much cheaper than the analyze_query call. The vector is
+scored against the exemplar messages of each route in intent_exemplars.json,
+also embedded at VECTOR_SIZE. A route's score
+is the mean cosine similarity of its INTENT_ROUTER_TOP_K nearest exemplars,
+computed for every route at once on a padded (routes x exemplars x dim)
+matrix. The top route is used when it scores at least
+INTENT_ROUTER_THRESHOLD and beats the runner-up by INTENT_ROUTER_MARGIN;
+otherwise the turn goes to the LLM router.
+
+RAG is only a candidate when documents are available, and an Image result is
+always left to the LLM router, since generation is expensive to get wrong.
+
+The router is off by default (INTENT_ROUTER_ENABLED). Turn it on only after
+benchmarks/intent_router_eval.py has checked its threshold against logged
+traffic. With ROUTER_LOG_PATH set, every LLM-routed turn is appended there as
+JSON. Collect the log while the router is still off; otherwise only the turns
+it was unsure about reach the LLM.
+"""
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    from backend.embedding import embed_chunks_parallel, embed_query
+    from backend.fast_router import RouteDecision
+    from backend.metrics import metrics
+    from backend.qdrant_service import VECTOR_SIZE
+except ImportError:
+    from embedding import embed_chunks_parallel, embed_query
+    from fast_router import RouteDecision
+    from metrics import metrics
+    from qdrant_service import VECTOR_SIZE
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "false").lower() in ("1", "true", "yes")
+INTENT_ROUTER_EXEMPLARS = os.getenv(
+    "INTENT_ROUTER_EXEMPLARS", str(Path(__file__).parent / "intent_exemplars.json")
+)
+INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.5"))
+INTENT_ROUTER_MARGIN = float(os.getenv("INTENT_ROUTER_MARGIN", "0.05"))
+INTENT_ROUTER_TOP_K = int(os.getenv("INTENT_ROUTER_TOP_K", "3"))
+INTENT_ROUTER_RETRY_SECONDS = int(os.getenv("INTENT_ROUTER_RETRY_SECONDS", "300"))
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", "")
+
+# Routes the intent router may pick; others are scored but deferred to the LLM
+_DECIDABLE_ROUTES = {"SimpleLLM", "RAG", "WebSearch"}
+
+
+def load_exemplars(path: str = INTENT_ROUTER_EXEMPLARS) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data.get("routes"), dict) or not data["routes"]:
+        raise ValueError(f"No routes in exemplar file {path}")
+    return data
+
+
+class IntentRouter:
+    """Top-k exemplar similarity per route over unit-normalized embeddings."""
+
+    def __init__(self, exemplars: Dict[str, Any], top_k: int = INTENT_ROUTER_TOP_K):
+        self.version = exemplars.get("version")
+        self.routes: List[str] = list(exemplars["routes"])
+        self.texts: Dict[str, List[str]] = {route: list(texts) for route, texts in exemplars["routes"].items()}
+        self.top_k = top_k
+        self._matrix: Optional[np.ndarray] = None  # (routes, max_exemplars, dim)
+        self._mask: Optional[np.ndarray] = None  # (routes, max_exemplars) True where padded
+
+    @property
+    def dimensions(self) -> int:
+        return self._matrix.shape[2] if self._matrix is not None else 0
+
+    async def build(self) -> None:
+        """Embed every exemplar in one batch."""
+        flat = [text for route in self.routes for text in self.texts[route]]
+        vectors = np.asarray(await embed_chunks_parallel(flat, dimensions=VECTOR_SIZE), dtype=np.float32)
+        self.set_vectors(vectors)
+
+    def set_vectors(self, vectors: np.ndarray) -> None:
+        """Install exemplar embeddings given in route order (as `build` embeds them)."""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        width = max(len(self.texts[route]) for route in self.routes)
+        matrix = np.zeros((len(self.routes), width, vectors.shape[1]), dtype=np.float32)
+        mask = np.ones((len(self.routes), width), dtype=bool)
+        offset = 0
+        for i, route in enumerate(self.routes):
+            count = len(self.texts[route])
+            matrix[i, :count] = vectors[offset: offset + count]
+            mask[i, :count] = False
+            offset += count
+        self._matrix, self._mask = matrix, mask
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """(n_queries, routes) route scores for a (n_queries, dim) batch of query embeddings."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        sims = np.einsum("red,qd->qre", self._matrix, queries)
+        sims = np.where(self._mask[np.newaxis], -np.inf, sims)
+        k = min(self.top_k, sims.shape[2])
+        top = np.sort(sims, axis=2)[:, :, -k:]
+        # Routes with fewer than k exemplars average over what they have
+        top = np.where(np.isinf(top), np.nan, top)
+        return np.nanmean(top, axis=2)
+
+    def decide(self, route_scores: np.ndarray, has_documents: bool) -> Optional[RouteDecision]:
+        """Decision for one row of `scores`, or None when not confident."""
+        route_scores = np.array(route_scores, dtype=np.float32)
+        if not has_documents and "RAG" in self.routes:
+            route_scores[self.routes.index("RAG")] = -np.inf
+        order = np.argsort(route_scores)[::-1]
+        best = float(route_scores[order[0]])
+        runner_up = float(route_scores[order[1]]) if len(order) > 1 else -1.0
+        route = self.routes[order[0]]
+        if best < INTENT_ROUTER_THRESHOLD or best - runner_up < INTENT_ROUTER_MARGIN:
+            return None
+        if route not in _DECIDABLE_ROUTES:
+            return None
+        return RouteDecision([route], "intent", f"Embedding match for {route} (score {best:.2f}, margin {best - runner_up:.2f})")
+
+
+_router: Optional[IntentRouter] = None
+_router_retry_at = 0.0
+_router_lock = asyncio.Lock()
+
+
+async def _get_router() -> Optional[IntentRouter]:
+    global _router, _router_retry_at
+    if _router is not None or time.time() < _router_retry_at:
+        return _router
+    async with _router_lock:
+        if _router is None and time.time() >= _router_retry_at:
+            try:
+                router = IntentRouter(load_exemplars())
+                await router.build()
+                _router = router
+                print(f"[IntentRouter] ✅ Loaded exemplar set v{router.version} ({sum(map(len, router.texts.values()))} exemplars)")
+            except Exception as e:
+                _router_retry_at = time.time() + INTENT_ROUTER_RETRY_SECONDS
+                print(f"[IntentRouter] ❌ Could not build exemplar index, retrying in {INTENT_ROUTER_RETRY_SECONDS}s: {e}")
+    return _router
+
+
+async def _route_scores(user_message: str):
+    """(router, route scores) for `user_message`, or (None, None) if unavailable."""
+    if not INTENT_ROUTER_ENABLED or not (user_message or "").strip():
+        return None, None
+    router = await _get_router()
+    if router is None:
+        return None, None
+    try:
+        vector = await embed_query(user_message, dimensions=VECTOR_SIZE)
+    except Exception as e:
+        print(f"[IntentRouter] ⚠️ Could not embed message: {e}")
+        return None, None
+    if len(vector) != router.dimensions:
+        return None, None
+    return router, router.scores(np.asarray(vector))[0]
+
+
+async def intent_route(user_message: str, has_documents: bool = False) -> Optional[RouteDecision]:
+    """Route `user_message` by embedding similarity, or None to defer to the LLM router."""
+    start = time.perf_counter()
+    router, route_scores = await _route_scores(user_message)
+    if router is None:
+        return None
+    decision = router.decide(route_scores, has_documents)
+    metrics.observe("intent_router_seconds", time.perf_counter() - start)
+    return decision
+
+
+async def intent_guess(user_message: str, has_documents: bool = False) -> Optional[str]:
+    """
+    The best-scoring decidable route regardless of threshold and margin, as a
+    prediction for speculative execution. The query embedding is cached, so
+    calling this after `intent_route` costs no extra request.
+    """
+    router, route_scores = await _route_scores(user_message)
+    if router is None:
+        return None
+    candidates = [
+        (score, route) for route, score in zip(router.routes, route_scores)
+        if route in _DECIDABLE_ROUTES and (has_documents or route != "RAG")
+    ]
+    return max(candidates)[1] if candidates else None
+
+
+def log_routing(audience: str, user_message: str, routing: Dict[str, Any], has_documents: bool) -> None:
+    """Append an LLM routing decision to ROUTER_LOG_PATH for offline evaluation."""
+    if not ROUTER_LOG_PATH:
+        return
+    record = {
+        "ts": time.time(),
+        "audience": audience,
+        "message": user_message,
+        "has_documents": has_documents,
+        "execution_order": (routing or {}).get("execution_order") or [],
+        "exemplar_version": _router.version if _router else None,
+    }
+    try:
+        with open(ROUTER_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[IntentRouter] ⚠️ Could not write routing log: {e}")
+
+
+def normalized_route(step: str) -> str:
+    """Exemplar-file route name for an execution_order step."""
+    key = (step or "").lower().replace("_", "").strip()
+    return {"simplellm": "SimpleLLM", "llm": "SimpleLLM", "rag": "RAG", "websearch": "WebSearch",
+            "search": "WebSearch", "image": "Image", "img": "Image"}.get(key, "SimpleLLM")
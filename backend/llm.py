@@ -1,9 +1,54 @@
 # llm.py
 import os
+import json
+import time
+import asyncio
+from types import SimpleNamespace
+from langchain_core.messages.ai import add_usage
 from langchain_openai import ChatOpenAI
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
 
+try:
+    from backend.metrics import metrics
+    from backend.rate_limiter import limited_async_client
+    from backend.utils.dsa_utils import LRUCache
+except ImportError:
+    from metrics import metrics
+    from rate_limiter import limited_async_client
+    from utils.dsa_utils import LRUCache
+
+LLM_REGISTRY_SIZE = int(os.getenv("LLM_REGISTRY_SIZE", "32"))
+LLM_STREAM_FAST_PATH = os.getenv("LLM_STREAM_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# Hedged streaming: if the first token hasn't arrived after the model's p95
+# time-to-first-token (times LLM_HEDGE_P95_MULTIPLIER, clamped to the min/max
+# delay), the next model in the route's fallback chain is started as well and
+# whichever streams first wins; the other request is cancelled. An attempt
+# that fails before its first token fails over to the next model immediately.
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_P95_MULTIPLIER = float(os.getenv("LLM_HEDGE_P95_MULTIPLIER", "1.0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "4.0"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10.0"))
+LLM_HEDGE_MAX_ATTEMPTS = int(os.getenv("LLM_HEDGE_MAX_ATTEMPTS", "2"))
+
+# Fallback chains by route (the `route` passed to stream_with_token_tracking)
+# or by primary model id. Entries are OpenRouter model ids, or "provider:model"
+# for the other registry providers. LLM_HEDGE_CHAINS (JSON object) overrides.
+DEFAULT_FALLBACK_CHAINS: Dict[str, List[str]] = {
+    "x-ai/grok-4.1-fast": ["google/gemini-2.5-flash-lite"],
+    "google/gemini-2.5-flash-lite": ["openai/gpt-oss-120b"],
+    "openai/gpt-oss-120b": ["google/gemini-2.5-flash-lite"],
+}
+FALLBACK_CHAINS: Dict[str, List[str]] = {
+    **DEFAULT_FALLBACK_CHAINS,
+    **json.loads(os.getenv("LLM_HEDGE_CHAINS", "{}")),
+}
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
 _persistent_http_client = httpx.Client(
     http2=True,
     timeout=httpx.Timeout(30.0),
@@ -12,28 +57,63 @@ _persistent_http_client = httpx.Client(
         "User-Agent": "DruidX-LLM-Agent/1.0"
     },
 )
-_cached_llms = {}
+# Async counterpart shared by every OpenRouter/Groq client, so ainvoke/astream
+# reuse warm keep-alive connections instead of each client opening its own pool.
+# Every request passes through the per-provider/model limiters (rate_limiter.py).
+_persistent_async_http_client = limited_async_client(
+    http2=True,
+    timeout=httpx.Timeout(60.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=60.0),
+    headers={
+        "Connection": "keep-alive",
+        "User-Agent": "DruidX-LLM-Agent/1.0"
+    },
+)
+
+# (provider, model, temperature, options) -> chat model instance
+_llm_registry = LRUCache(capacity=LLM_REGISTRY_SIZE)
+
+def _cached_input_tokens(*sources) -> int:
+    """Prompt tokens served from the provider's prompt cache, in any of the shapes providers report."""
+    for source in sources:
+        if not source:
+            continue
+        details = source.get("input_token_details") or {}
+        if details.get("cache_read"):
+            return details["cache_read"]
+        details = source.get("prompt_tokens_details") or {}
+        if details.get("cached_tokens"):
+            return details["cached_tokens"]
+        if source.get("cached_content_token_count"):
+            return source["cached_content_token_count"]
+    return 0
+
 
 def _extract_usage(ai_message):
     """
-    Returns a dict: {"input_tokens": int, "output_tokens": int, "total_tokens": int}
+    Returns a dict: {"input_tokens": int, "output_tokens": int, "total_tokens": int,
+    "cached_input_tokens": int}
     Compatible with both non-streaming and streaming (with include_usage).
+    `cached_input_tokens` is the part of input_tokens read from the provider's
+    prompt cache (0 when the provider doesn't report it).
     """
     usage = getattr(ai_message, "usage_metadata", None)
+    rm = getattr(ai_message, "response_metadata", {}) or {}
+    tu = rm.get("token_usage", {}) or {}
     if usage:
         return {
             "input_tokens": usage.get("input_tokens") or usage.get("prompt_tokens", 0),
             "output_tokens": usage.get("output_tokens") or usage.get("completion_tokens", 0),
-            "total_tokens": usage.get("total_tokens", 0)
+            "total_tokens": usage.get("total_tokens", 0),
+            "cached_input_tokens": _cached_input_tokens(usage, tu),
         }
 
-    rm = getattr(ai_message, "response_metadata", {}) or {}
-    tu = rm.get("token_usage", {}) or {}
     if tu:
         return {
             "input_tokens": tu.get("prompt_tokens", tu.get("input_tokens", 0)),
             "output_tokens": tu.get("completion_tokens", tu.get("output_tokens", 0)),
             "total_tokens": tu.get("total_tokens", 0),
+            "cached_input_tokens": _cached_input_tokens(tu),
         }
 
     if "usage" in rm:
@@ -41,81 +121,250 @@ def _extract_usage(ai_message):
         return {
             "input_tokens": usage.get("prompt_tokens", 0),
             "output_tokens": usage.get("candidates_token_count", 0),
-            "total_tokens": usage.get("total_token_count", 0)
+            "total_tokens": usage.get("total_token_count", 0),
+            "cached_input_tokens": _cached_input_tokens(usage),
         }
     
-    return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cached_input_tokens": 0}
 
-def get_reasoning_llm(model_name: str):
-    """
-    Returns a ChatOpenAI instance configured to use DeepSeek via OpenRouter.
-    """
+
+def _record_route_usage(route: str, token_usage: Dict[str, int]) -> None:
+    metrics.inc("llm_requests_total", route=route)
+    metrics.inc("llm_input_tokens_total", token_usage.get("input_tokens", 0), route=route)
+    metrics.inc("llm_cached_input_tokens_total", token_usage.get("cached_input_tokens", 0), route=route)
+    metrics.inc("llm_output_tokens_total", token_usage.get("output_tokens", 0), route=route)
+
+
+def record_llm_usage(route: str, ai_message) -> Dict[str, int]:
+    """Token usage of a non-streamed response, aggregated under `route` like streamed calls."""
+    token_usage = _extract_usage(ai_message)
+    _record_route_usage(route, token_usage)
+    return token_usage
+
+
+def _openrouter_headers() -> Dict[str, str]:
+    return {
+        "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
+        "X-Title": os.getenv("APP_NAME", "My LangGraph App"),
+        "Connection": "keep-alive"
+    }
+
+
+def _build_openrouter_llm(model_name: str, temperature: float, **options):
     return ChatOpenAI(
-        model=model_name,   
-        openai_api_base="https://openrouter.ai/api/v1",
+        model=model_name,
+        openai_api_base=OPENROUTER_BASE_URL,
         openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        temperature=0.9,
-        default_headers={
-            "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
-            "X-Title": os.getenv("APP_NAME", "My LangGraph App")
-        },
+        temperature=temperature,
+        http_client=_persistent_http_client,
+        http_async_client=_persistent_async_http_client,
+        default_headers=_openrouter_headers(),
         model_kwargs={
             "stream_options": {"include_usage": True}
         },
+        **options,
+    )
+
+
+def _build_groq_llm(model_name: str, temperature: float, **options):
+    from langchain_groq import ChatGroq
+
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if groq_api_key:
+        options.setdefault("groq_api_key", groq_api_key)
+    return ChatGroq(
+        model=model_name,
+        temperature=temperature,
+        http_client=_persistent_http_client,
+        http_async_client=_persistent_async_http_client,
+        **options,
     )
 
+
+def _build_gemini_llm(model_name: str, temperature: float, **options):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        options.setdefault("google_api_key", api_key)
+    # google-genai manages its own httpx transport; caching the instance keeps
+    # that client (and its connection pool) alive across requests.
+    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, **options)
+
+
+_LLM_BUILDERS = {
+    "openrouter": _build_openrouter_llm,
+    "groq": _build_groq_llm,
+    "gemini": _build_gemini_llm,
+}
+
+
+def _registry_key(provider: str, model_name: str, temperature: float, options: Dict[str, Any]) -> Tuple:
+    return (
+        provider,
+        model_name,
+        float(temperature),
+        json.dumps(options, sort_keys=True, default=str),
+    )
+
+
+def get_chat_model(provider: str, model_name: str, temperature: float = 0.3, **options):
+    """
+    Return a chat model from the shared registry.
+
+    Instances are keyed by (provider, model, temperature, options), so callers
+    asking for a different temperature or option set get their own client,
+    while repeated calls with the same configuration reuse it. The registry is
+    bounded by LLM_REGISTRY_SIZE with LRU eviction. OpenRouter and Groq clients
+    all share the persistent sync/async HTTP transports.
+
+    Args:
+        provider: "openrouter", "groq" or "gemini".
+        model_name: Provider model id.
+        temperature: Sampling temperature.
+        **options: Extra constructor arguments (e.g. max_tokens).
+    """
+    builder = _LLM_BUILDERS.get(provider)
+    if builder is None:
+        raise ValueError(f"Unknown LLM provider '{provider}'. Expected one of: {', '.join(_LLM_BUILDERS)}")
+
+    key = _registry_key(provider, model_name, temperature, options)
+    llm = _llm_registry.get(key)
+    if llm is None:
+        llm = builder(model_name, temperature, **options)
+        _llm_registry.put(key, llm)
+    return llm
+
+
+def get_reasoning_llm(model_name: str):
+    """
+    Returns a ChatOpenAI instance configured to use DeepSeek via OpenRouter.
+    """
+    return get_chat_model("openrouter", model_name, temperature=0.9)
+
+
 def get_llm(model_name: str, temperature: float = 0.3):
     """
     Optimized ChatOpenAI constructor for OpenRouter.
     ⚙️ Features:
-    - Persistent HTTP/2 keep-alive connection
-    - Cached model clients (no re-authentication each call)
+    - Persistent HTTP/2 keep-alive connection (sync and async)
+    - Cached model clients keyed by model and temperature (no re-authentication each call)
     - Reduced TLS handshake latency
     - Works seamlessly with LangGraph & async streaming
     - Includes stream_options to get token usage
     """
-    global _cached_llms
-    if model_name in _cached_llms:
-        return _cached_llms[model_name]
-    llm = ChatOpenAI(
-        model=model_name,
-        openai_api_base="https://openrouter.ai/api/v1",
-        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        temperature=temperature,
-        http_client=_persistent_http_client,
-        default_headers={
-            "HTTP-Referer": os.getenv("APP_URL", "http://localhost"),
-            "X-Title": os.getenv("APP_NAME", "My LangGraph App"),
-            "Connection": "keep-alive"
-        },
-        model_kwargs={
-            "stream_options": {"include_usage": True}
-        },
-    )
+    return get_chat_model("openrouter", model_name, temperature)
 
-    _cached_llms[model_name] = llm
-    return llm
+
+def get_groq_llm(model_name: str, temperature: float = 0.3, **options):
+    """Registry-backed ChatGroq client sharing the persistent HTTP transports."""
+    return get_chat_model("groq", model_name, temperature, **options)
+
+
+def _model_id(llm) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or "unknown"
 
 
-async def stream_with_token_tracking(llm, messages, chunk_callback=None, state: Optional[Dict[str, Any]] = None):
+def fallback_chain(model_name: str, route: Optional[str] = None) -> List[str]:
+    """Alternate models for a request: the route's chain if configured, else the model's."""
+    chain = FALLBACK_CHAINS.get(route) if route else None
+    if chain is None:
+        chain = FALLBACK_CHAINS.get(model_name, [])
+    return [entry for entry in chain if entry != model_name]
+
+
+def _fallback_llm(entry: str, temperature: float):
+    provider, _, model_name = entry.partition(":")
+    if provider in _LLM_BUILDERS and model_name:
+        return get_chat_model(provider, model_name, temperature)
+    return get_chat_model("openrouter", entry, temperature)
+
+
+def hedge_delay(model_name: str) -> float:
+    """Seconds to wait for a first token before hedging, from the model's p95 TTFT."""
+    summary = metrics.summary("llm_ttft_seconds", model=model_name)
+    if not summary or summary["count"] < LLM_HEDGE_MIN_SAMPLES:
+        return LLM_HEDGE_DEFAULT_DELAY
+    delay = summary["p95"] * LLM_HEDGE_P95_MULTIPLIER
+    return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, delay))
+
+
+async def _hedged_stream(streamer, attempts, messages, chunk_callback, route: str):
     """
-    Stream LLM response while tracking token usage.
-    
-    Uses the more reliable `astream_events` method to capture usage metadata 
-    from the 'end' event of the stream, which is more robust across different LLM providers.
-    
-    Args:
-        llm: LangChain LLM instance
-        messages: List of messages to send to LLM
-        chunk_callback: Optional callback function for streaming chunks
-        state: Optional GraphState dictionary to accumulate token usage
-    
-    Returns:
-        Tuple of (full_response: str, token_usage: Dict[str, int])
+    Race `attempts` ([(model, llm), ...]) in order, starting the next one when
+    the running ones haven't produced a first token within `hedge_delay` or
+    have all failed. Only the winner's chunks reach `chunk_callback`.
     """
+    start = time.perf_counter()
+    first_token = asyncio.Event()
+    tasks: List[asyncio.Task] = []
+    winner: Optional[int] = None
+
+    def gate(index: int, model_name: str, started: float):
+        async def on_chunk(content):
+            nonlocal winner
+            if winner is None:
+                winner = index
+                first_token.set()
+                metrics.observe("llm_ttft_seconds", time.perf_counter() - started, model=model_name)
+                if index > 0:
+                    metrics.inc("llm_hedges_won_total", route=route, model=model_name)
+                    print(f"[Hedge] 🏁 {model_name} won after {time.perf_counter() - start:.2f}s ({route})")
+            if winner == index and chunk_callback:
+                await chunk_callback(content)
+        return on_chunk
+
+    def launch() -> None:
+        index = len(tasks)
+        model_name, llm = attempts[index]
+        callback = gate(index, model_name, time.perf_counter())
+        tasks.append(asyncio.create_task(streamer(llm, messages, callback)))
+
+    launch()
+    try:
+        while winner is None:
+            running = [t for t in tasks if not t.done()]
+            can_hedge = len(tasks) < len(attempts)
+            if not running:
+                if not any(t.exception() is not None for t in tasks if t.done()) or not can_hedge:
+                    break
+                metrics.inc("llm_failovers_total", route=route, model=attempts[len(tasks)][0])
+                print(f"[Hedge] ⚠️ {attempts[len(tasks) - 1][0]} failed before first token, failing over ({route})")
+                launch()
+                continue
+
+            token_wait = asyncio.ensure_future(first_token.wait())
+            timeout = hedge_delay(attempts[len(tasks) - 1][0]) if can_hedge else None
+            await asyncio.wait([token_wait, *running], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            token_wait.cancel()
+            if winner is None and can_hedge and all(not t.done() for t in running):
+                metrics.inc("llm_hedges_fired_total", route=route, model=attempts[len(tasks)][0])
+                print(f"[Hedge] 🔀 No first token after {timeout:.2f}s, hedging with {attempts[len(tasks)][0]} ({route})")
+                launch()
+
+        if winner is not None:
+            for index, task in enumerate(tasks):
+                if index != winner:
+                    task.cancel()
+            return await tasks[winner]
+
+        # Every attempt finished without streaming a token: return the first
+        # clean (empty) result, else surface the primary's error.
+        for task in tasks:
+            if task.exception() is None:
+                return task.result()
+        raise tasks[0].exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def _stream_via_events(llm, messages, chunk_callback=None):
+    """Stream through `astream_events` (full LangChain callback/event machinery)."""
     full_response = ""
-    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
-    
+    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cached_input_tokens": 0}
+
     async for event in llm.astream_events(messages, version="v1"):
         kind = event["event"]
         
@@ -132,6 +381,100 @@ async def stream_with_token_tracking(llm, messages, chunk_callback=None, state:
             if final_message:
                 token_usage = _extract_usage(final_message)
 
+    return full_response, token_usage
+
+
+async def _stream_direct(llm, messages, chunk_callback=None):
+    """
+    Stream straight from `llm.astream`, collecting chunks in a list.
+
+    Usage arrives on the final chunk (stream_options.include_usage); providers
+    that report per-chunk deltas are summed, matching the aggregated message
+    `astream_events` reports at the end of the run.
+    """
+    parts = []
+    usage_metadata = None
+    last_chunk = None
+
+    async for chunk in llm.astream(messages):
+        chunk_content = chunk.content
+        if chunk_content:
+            if not isinstance(chunk_content, str):
+                chunk_content = chunk.text
+            parts.append(chunk_content)
+            if chunk_callback:
+                await chunk_callback(chunk_content)
+        if chunk.usage_metadata:
+            usage_metadata = add_usage(usage_metadata, chunk.usage_metadata)
+        last_chunk = chunk
+
+    if usage_metadata:
+        token_usage = _extract_usage(SimpleNamespace(usage_metadata=usage_metadata))
+    elif last_chunk is not None:
+        token_usage = _extract_usage(last_chunk)
+    else:
+        token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cached_input_tokens": 0}
+    return "".join(parts), token_usage
+
+
+async def stream_with_token_tracking(
+    llm,
+    messages,
+    chunk_callback=None,
+    state: Optional[Dict[str, Any]] = None,
+    route: Optional[str] = None,
+):
+    """
+    Stream LLM response while tracking token usage.
+    
+    By default streams directly from `llm.astream` and reads usage from the
+    final chunk. Set LLM_STREAM_FAST_PATH=false to go through `astream_events`
+    instead, which runs the full callback/event machinery for every token.
+    
+    With LLM_HEDGING_ENABLED, a request whose first token is late (or that
+    fails before it) is raced against the next model of its fallback chain;
+    see `_hedged_stream`.
+    
+    Args:
+        llm: LangChain LLM instance
+        messages: List of messages to send to LLM
+        chunk_callback: Optional callback function for streaming chunks
+        state: Optional GraphState dictionary to accumulate token usage
+        route: Optional call-site name used to pick the fallback chain and to
+            aggregate token usage (llm_*_tokens_total{route}); defaults to the model
+    
+    Returns:
+        Tuple of (full_response: str, token_usage: Dict[str, int])
+    """
+    streamer = _stream_direct if LLM_STREAM_FAST_PATH else _stream_via_events
+    model_name = _model_id(llm)
+    chain = fallback_chain(model_name, route) if LLM_HEDGING_ENABLED else []
+
+    if chain:
+        temperature = getattr(llm, "temperature", None)
+        temperature = 0.3 if temperature is None else temperature
+        attempts = [(model_name, llm)] + [
+            (entry, _fallback_llm(entry, temperature)) for entry in chain[: LLM_HEDGE_MAX_ATTEMPTS - 1]
+        ]
+        full_response, token_usage = await _hedged_stream(
+            streamer, attempts, messages, chunk_callback, route or model_name
+        )
+    else:
+        started = time.perf_counter()
+        first_token_seen = False
+
+        async def timed_callback(content):
+            nonlocal first_token_seen
+            if not first_token_seen:
+                first_token_seen = True
+                metrics.observe("llm_ttft_seconds", time.perf_counter() - started, model=model_name)
+            if chunk_callback:
+                await chunk_callback(content)
+
+        full_response, token_usage = await streamer(llm, messages, timed_callback)
+
+    _record_route_usage(route or model_name, token_usage)
+
     if token_usage["total_tokens"] > 0:
         print(f"[TokenTracking] ✅ Captured tokens from stream: {token_usage}")
     else:
@@ -144,6 +487,9 @@ async def stream_with_token_tracking(llm, messages, chunk_callback=None, state:
         state["token_usage"]["input_tokens"] += token_usage["input_tokens"]
         state["token_usage"]["output_tokens"] += token_usage["output_tokens"]
         state["token_usage"]["total_tokens"] += token_usage["total_tokens"]
+        state["token_usage"]["cached_input_tokens"] = (
+            state["token_usage"].get("cached_input_tokens", 0) + token_usage["cached_input_tokens"]
+        )
         
         print(f"[TokenTracking] Accumulated token usage in state: {state['token_usage']}")
     
@@ -6,6 +6,8 @@ import inspect
 import json
 import os
 import logging
+import shutil
+import tempfile
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
@@ -16,7 +18,7 @@ from dotenv import load_dotenv
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, status, Path as PathParam, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.concurrency import run_in_threadpool
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from models import (
     InstructionDepth,
     LessonPlanRequest,
@@ -53,15 +55,36 @@ from teacher.Assessment.exam_assessment import generate_exam_assessment
 from teacher.Ai_Tutor.graph import create_ai_tutor_graph
 from teacher.Ai_Tutor.graph_type import GraphState
 from langchain_core.messages import HumanMessage, AIMessage
-from doument_processor import extract_text_from_pdf, extract_text_from_docx, extract_text_from_txt, extract_text_from_json
-from teacher.Ai_Tutor.qdrant_utils import store_documents
+from doument_processor import aiter_page_chunks, extract_pdf_outline, file_buffer
+from downloader import download_document, close_download_client
+from generation_cache import generation_cache, generation_cache_key
+from metrics import metrics
+from token_budget import CHAT_HISTORY_MAX_MESSAGES, warm_token_encoding
+from rate_limiter import ProviderOverloaded, limiters, set_request_priority
+from semantic_cache import semantic_answer_cache
+from streaming import (
+    ChunkCoalescer,
+    DisconnectWatcher,
+    SSE_HEADERS,
+    STREAM_SINGLEFLIGHT,
+    StreamEncoder,
+    estimate_tokens,
+    negotiate_stream_protocol,
+    parse_last_event_id,
+    shared_sse_frames,
+    singleflight_key,
+    sse_event,
+    sse_frames,
+    stream_registry,
+)
+from ingestion_queue import IngestionJobManager, IngestionProgress, TERMINAL_STATUSES as INGESTION_TERMINAL_STATUSES
+from teacher.Ai_Tutor.qdrant_utils import store_document_stream
 from teacher.Ai_Tutor.cleanup_scheduler import start_cleanup_scheduler
 from Student.Ai_tutor.cleanup_scheduler import start_cleanup_scheduler as start_student_cleanup_scheduler
-import httpx
 from teacher.voice_agent.voice_agent_webrtc import VoiceAgentBridge
 from Student.Ai_tutor.graph import create_student_ai_tutor_graph
 from Student.Ai_tutor.graph_type import StudentGraphState
-from Student.Ai_tutor.qdrant_utils import store_student_documents
+from Student.Ai_tutor.qdrant_utils import store_student_document_stream
 from teacher.Ai_Tutor.qdrant_utils import delete_teacher_session_collection
 from Student.student_voice_agent.student_voice_agent import StudyBuddyBridge
 
@@ -86,6 +109,7 @@ GENERATOR_MAP: Dict[str, Callable[..., Awaitable[str]]] = {
 }
 
 video_generation_tasks: Dict[str, Dict[str, Any]] = {}
+ingestion_jobs = IngestionJobManager()
 cloudinary_storage_manager: Optional[CloudinaryStorage] = None
 
 try:
@@ -103,7 +127,7 @@ student_voice_sessions: Dict[str, StudyBuddyBridge] = {}
 
 
 import time
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, nullcontext
 from teacher.Ai_Tutor.qdrant_utils import delete_teacher_session_collection
 class SessionManager:
     @staticmethod
@@ -178,13 +202,72 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Stream-Protocol"],
 )
 
+@app.exception_handler(ProviderOverloaded)
+async def provider_overloaded_handler(request: Request, exc: ProviderOverloaded) -> JSONResponse:
+    """Upstream capacity is exhausted; tell the client to back off instead of failing with a 500."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
 @app.get("/healthz", tags=["System"])
 async def health_check() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/api/metrics", tags=["System"])
+async def get_metrics() -> Dict[str, Any]:
+    """In-process counters and latency summaries (streams, cancellations, LLM calls)."""
+    return metrics.snapshot()
+
+
+@app.delete("/api/cache/generation", tags=["System"])
+async def purge_generation_cache() -> Dict[str, Any]:
+    """Drop every cached content-generator result."""
+    return {"purged": generation_cache.clear()}
+
+
+@app.get("/api/limits", tags=["System"])
+async def get_provider_limits() -> Dict[str, Any]:
+    """Current AIMD limit, in-flight calls and queue depth per provider/model."""
+    return limiters.snapshot()
+
+
+@app.get("/api/cache/semantic", tags=["System"])
+async def semantic_cache_stats() -> Dict[str, Any]:
+    """Size and hit rate of the student tutor's semantic answer cache."""
+    return semantic_answer_cache.stats()
+
+
+@app.delete("/api/cache/semantic", tags=["System"])
+async def purge_semantic_cache(collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Drop cached student tutor answers, for one KB collection or all of them."""
+    return {"purged": semantic_answer_cache.purge(collection_name)}
+
+
+@app.get("/api/streams/{stream_id}", tags=["Streaming"])
+async def resume_stream(stream_id: str, owner_id: str, session_id: str, request: Request) -> StreamingResponse:
+    """
+    Reattach to a chat or generation stream (id from the X-Stream-Id header).
+
+    `owner_id` (teacher_id or student_id) and `session_id` must match the
+    request that started the stream. Replays every event after the
+    Last-Event-ID header (or `last_event_id` query param), then continues
+    live until the stream finishes.
+    """
+    stream = stream_registry.get(stream_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired.")
+    if not stream.is_owned_by(owner_id, session_id):
+        raise HTTPException(status_code=403, detail="Unauthorized access to this stream.")
+    return StreamingResponse(
+        sse_frames(stream, parse_last_event_id(request)),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, **stream.headers},
+    )
+
+
 @app.post("/api/teacher/{teacher_id}/sessions", tags=["Session"])
 async def create_teacher_session(
     teacher_id: str,
@@ -236,6 +319,22 @@ async def startup_event():
     
     logger.info("🚀 Document cleanup schedulers started (24-hour TTL)")
 
+    # Prompt token counting estimates until the tiktoken encoding is loaded
+    asyncio.create_task(warm_token_encoding())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections held by shared clients."""
+    await close_download_client()
+
+def _copy_upload_to_temp_file(file, suffix: str) -> str:
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        shutil.copyfileobj(file, temp_file, 1024 * 1024)
+        return temp_file.name
+
+
 @app.post("/api/teacher/{teacher_id}/session/{session_id}/video_generation/generate")
 async def generate_video_presentation(
     teacher_id: str,
@@ -250,6 +349,7 @@ async def generate_video_presentation(
     Uploads a PPTX file and starts the video generation process asynchronously.
     Returns a task_id to poll for status.
     """
+    set_request_priority("batch")
     # Ensure session exists
     await SessionManager.create_session(teacher_id, session_id)
 
@@ -268,7 +368,9 @@ async def generate_video_presentation(
     try:
         task_id = str(uuid4())
         logger.info(f"Received video request. Task ID: {task_id}, File: {pptx_file.filename}")
-        content = await pptx_file.read()
+        # Stream the upload's spooled file to disk once instead of reading it
+        # into memory; the background task uploads from and removes this path.
+        pptx_path = await run_in_threadpool(_copy_upload_to_temp_file, pptx_file.file, ".pptx")
 
         video_generation_tasks[task_id] = {
             "session_id": session_id,
@@ -282,12 +384,14 @@ async def generate_video_presentation(
 
         asyncio.create_task(generate_video_background(
             task_id=task_id,
-            pptx_bytes=content,
+            pptx_path=pptx_path,
             original_filename=pptx_file.filename,
             voice_id=voice_id,
             avatar_id=talking_photo_id,
             title=title,
-            language=language
+            language=language,
+            video_generation_tasks=video_generation_tasks,
+            storage_manager=cloudinary_storage_manager
         ))
 
         return {
@@ -477,13 +581,101 @@ async def disconnect_student_voice_agent(
     else:
         return {"status": "not_found", "message": "No active study buddy session found."}
 
+def _generation_stream_response(
+    run_generator: Callable[[Callable[[str], Awaitable[None]]], Awaitable[Any]],
+    content_type: str,
+    session_id: str,
+    teacher_id: str,
+    endpoint: str,
+    request: Request,
+    flight_payload: Optional[Dict[str, Any]] = None,
+) -> StreamingResponse:
+    """
+    Run a teacher content generator in the background and stream its output as
+    SSE: coalesced content frames (or deltas), then the complete response and
+    metadata. The stream is resumable via /api/streams/{stream_id}; the
+    generator is cancelled if no client is attached after a disconnect.
+
+    When `flight_payload` is given, a request identical to one still in
+    flight (same endpoint, type, protocol and payload) subscribes to that
+    generation instead of starting its own.
+    """
+    protocol = negotiate_stream_protocol(request)
+    headers = {
+        **SSE_HEADERS,
+        "X-Session-Id": session_id,
+        "X-Teacher-Id": teacher_id,
+        "X-Content-Type": content_type,
+    }
+
+    flight_key = None
+    if flight_payload is not None and STREAM_SINGLEFLIGHT:
+        flight_key = singleflight_key(f"{endpoint}/{content_type}/v{protocol}", flight_payload)
+        shared = stream_registry.join(flight_key)
+        if shared is not None:
+            metrics.inc("singleflight_joins_total", endpoint=endpoint)
+            shared.add_owner({"teacher_id": teacher_id, "session_id": session_id})
+            print(f"[Singleflight] 🔗 Joining in-flight {content_type} stream {shared.stream_id} ({shared.subscribers} subscriber(s))")
+            return StreamingResponse(
+                shared_sse_frames(shared, {"session_id": session_id, "teacher_id": teacher_id}),
+                media_type="text/event-stream",
+                headers={**headers, **shared.headers},
+            )
+        metrics.inc("singleflight_leaders_total", endpoint=endpoint)
+
+    stream = stream_registry.create(
+        {"teacher_id": teacher_id, "session_id": session_id, "type": content_type},
+        flight_key=flight_key,
+    )
+    encoder = StreamEncoder(stream, protocol)
+    stream.headers.update(encoder.headers)
+    coalescer = ChunkCoalescer.for_endpoint(endpoint, encoder.on_flush)
+    watcher = DisconnectWatcher(request, endpoint, stream, produced_text=lambda: coalescer.text)
+
+    async def run_and_store():
+        try:
+            raw_output = await run_generator(coalescer)
+            coalescer.close()
+            watcher.record_completion(estimate_tokens(coalescer.text))
+            metadata = {
+                "session_id": session_id,
+                "teacher_id": teacher_id,
+                "type": content_type,
+                "content": raw_output,
+            }
+            await stream.put(encoder.complete(raw_output, coalescer.text, chunk=""))
+            await stream.put({"type": "metadata", "data": metadata})
+        except Exception as exc:
+            coalescer.close()
+            await stream.put({"type": "error", "data": {"message": str(exc)}})
+        finally:
+            stream.close()
+
+    watcher.watch(asyncio.create_task(run_and_store()))
+
+    async def stream_output():
+        try:
+            async for frame in sse_frames(stream):
+                yield frame
+        finally:
+            watcher.close()
+
+    return StreamingResponse(
+        stream_output(),
+        media_type="text/event-stream",
+        headers={**headers, **stream.headers},
+    )
+
+
 @app.post("/api/teacher/{teacher_id}/session/{session_id}/content_generator/{type}")
 async def generate_content(
     teacher_id: str,
     type: Literal["lesson_plan", "presentation", "quizz", "worksheet"],
     payload: ContentGenerationRequest,
+    request: Request,
     session_id: Optional[str] = None,
     stream: bool = False,
+    force_regenerate: bool = False,
 ) -> Dict[str, Any]:
     current_session_id = await SessionManager.create_session(teacher_id, session_id)
 
@@ -500,10 +692,22 @@ async def generate_content(
     accepts_chunk_callback = "chunk_callback" in generator_signature.parameters
 
     async def invoke_generator(chunk_callback: Optional[Callable[[str], Awaitable[None]]] = None):
+        cache_key = await generation_cache_key(type, request_payload)
+        if cache_key and not force_regenerate:
+            cached = generation_cache.get(cache_key, type)
+            if cached is not None:
+                print(f"[GenCache] ⚡ Serving cached {type} for topic '{payload.topic}'")
+                if chunk_callback and accepts_chunk_callback:
+                    # Replay through the normal streaming path as one chunk
+                    await chunk_callback(cached)
+                return cached
+
         kwargs = {"chunk_callback": chunk_callback} if chunk_callback and accepts_chunk_callback else {}
         result = generator_func(request_payload, **kwargs)
         if inspect.isawaitable(result):
-            return await result
+            result = await result
+        if cache_key:
+            generation_cache.put(cache_key, result)
         return result
 
     if stream:
@@ -513,79 +717,14 @@ async def generate_content(
                 detail=f"Streaming is not supported for generator '{type}'",
             )
 
-        queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-        full_response = ""
-
-        async def chunk_callback(chunk: str):
-            nonlocal full_response
-            full_response += chunk
-            await queue.put(
-                {
-                    "type": "content",
-                    "data": {
-                        "chunk": chunk,
-                        "full_response": full_response,
-                        "is_complete": False,
-                    },
-                }
-            )
-
-        async def run_and_store():
-            try:
-                raw_output = await invoke_generator(chunk_callback=chunk_callback)
-                metadata = {
-                    "session_id": current_session_id,
-                    "teacher_id": teacher_id,
-                    "type": type,
-                    "content": raw_output,
-                }
-                await queue.put(
-                    {
-                        "type": "content",
-                        "data": {
-                            "chunk": "",
-                            "full_response": raw_output,
-                            "is_complete": True,
-                        },
-                    }
-                )
-                await queue.put(
-                    {
-                        "type": "metadata",
-                        "data": metadata,
-                    }
-                )
-            except Exception as exc:
-                await queue.put(
-                    {
-                        "type": "error",
-                        "data": {"message": str(exc)},
-                    }
-                )
-            finally:
-                await queue.put(None)
-
-        asyncio.create_task(run_and_store())
-
-        async def stream_output():
-            while True:
-                chunk = await queue.get()
-                if chunk is None:
-                    break
-                yield f"data: {json.dumps(chunk)}\n\n"
-
-        headers = {
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "X-Session-Id": current_session_id,
-            "X-Teacher-Id": teacher_id,
-            "X-Content-Type": type,
-        }
-        return StreamingResponse(
-            stream_output(),
-            media_type="text/event-stream",
-            headers=headers,
+        return _generation_stream_response(
+            invoke_generator,
+            content_type=type,
+            session_id=current_session_id,
+            teacher_id=teacher_id,
+            endpoint="content",
+            request=request,
+            flight_payload=request_payload,
         )
 
     try:
@@ -608,6 +747,7 @@ async def generate_content(
 async def web_search_schema(
     teacher_id: str,
     payload: WebSearchSchemaRequest,
+    request: Request,
     session_id: Optional[str] = None,
 ) -> StreamingResponse:
     """
@@ -616,69 +756,24 @@ async def web_search_schema(
     """
     current_session_id = await SessionManager.create_session(teacher_id, session_id)
 
-    queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-    full_response = ""
-
-    async def chunk_callback(chunk: str):
-        nonlocal full_response
-        full_response += chunk
-        await queue.put(
-            {
-                "type": "content",
-                "data": {"chunk": chunk, "full_response": full_response, "is_complete": False},
-            }
+    async def run_search(chunk_callback: Callable[[str], Awaitable[None]]):
+        return await run_search_agent(
+            topic=payload.topic,
+            grade_level=payload.grade_level,
+            subject=payload.subject,
+            content_type=payload.content_type,
+            language=payload.language,
+            comprehension=payload.comprehension,
+            chunk_callback=chunk_callback,
         )
 
-    async def run_and_store():
-        try:
-            raw_output = await run_search_agent(
-                topic=payload.topic,
-                grade_level=payload.grade_level,
-                subject=payload.subject,
-                content_type=payload.content_type,
-                language=payload.language,
-                comprehension=payload.comprehension,
-                chunk_callback=chunk_callback,
-            )
-            metadata = {
-                "session_id": current_session_id,
-                "teacher_id": teacher_id,
-                "type": "web_search_schema",
-                "content": raw_output,
-            }
-            await queue.put(
-                {
-                    "type": "content",
-                    "data": {"chunk": "", "full_response": raw_output, "is_complete": True},
-                }
-            )
-            await queue.put({"type": "metadata", "data": metadata})
-        except Exception as exc:
-            await queue.put({"type": "error", "data": {"message": str(exc)}})
-        finally:
-            await queue.put(None)
-
-    asyncio.create_task(run_and_store())
-
-    async def stream_output():
-        while True:
-            chunk = await queue.get()
-            if chunk is None:
-                break
-            yield f"data: {json.dumps(chunk)}\n\n"
-
-    headers = {
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "X-Accel-Buffering": "no",
-        "X-Session-Id": current_session_id,
-        "X-Teacher-Id": teacher_id,
-        "X-Content-Type": "web_search_schema",
-    }
-    return StreamingResponse(
-        stream_output(),
-        media_type="text/event-stream",
-        headers=headers,
+    return _generation_stream_response(
+        run_search,
+        content_type="web_search_schema",
+        session_id=current_session_id,
+        teacher_id=teacher_id,
+        endpoint="web_search",
+        request=request,
     )
 
 
@@ -687,6 +782,7 @@ async def create_assessment(
     session_id: str,
     teacher_id: str,
     payload: AssessmentRequest,
+    request: Request,
     stream: bool = False,
 ) -> Dict[str, Any]:
     """
@@ -706,71 +802,14 @@ async def create_assessment(
         return result
 
     if stream:
-        queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-        full_response = ""
-
-        async def chunk_callback(chunk: str):
-            nonlocal full_response
-            full_response += chunk
-            await queue.put(
-                {
-                    "type": "content",
-                    "data": {
-                        "chunk": chunk,
-                        "full_response": full_response,
-                        "is_complete": False,
-                    },
-                }
-            )
-
-        async def run_and_store():
-            try:
-                raw_output = await invoke_generator(chunk_callback=chunk_callback)
-                metadata = {
-                    "session_id": current_session_id,
-                    "teacher_id": teacher_id,
-                    "type": "assessment",
-                    "content": raw_output,
-                }
-                await queue.put(
-                    {
-                        "type": "content",
-                        "data": {
-                            "chunk": "",
-                            "full_response": raw_output,
-                            "is_complete": True,
-                        },
-                    }
-                )
-                await queue.put({"type": "metadata", "data": metadata})
-            except Exception as exc:
-                await queue.put(
-                    {"type": "error", "data": {"message": str(exc)}}
-                )
-            finally:
-                await queue.put(None)
-
-        asyncio.create_task(run_and_store())
-
-        async def stream_output():
-            while True:
-                chunk = await queue.get()
-                if chunk is None:
-                    break
-                yield f"data: {json.dumps(chunk)}\n\n"
-
-        headers = {
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "X-Session-Id": current_session_id,
-            "X-Teacher-Id": teacher_id,
-            "X-Content-Type": "assessment",
-        }
-        return StreamingResponse(
-            stream_output(),
-            media_type="text/event-stream",
-            headers=headers,
+        return _generation_stream_response(
+            invoke_generator,
+            content_type="assessment",
+            session_id=current_session_id,
+            teacher_id=teacher_id,
+            endpoint="assessment",
+            request=request,
+            flight_payload=request_payload,
         )
 
     try:
@@ -793,6 +832,7 @@ async def create_exam_assessment(
     teacher_id: str,
     session_id: str,
     payload: ExamAssessmentRequest,
+    request: Request,
     stream: bool = False,
 ) -> Dict[str, Any]:
     """
@@ -801,6 +841,7 @@ async def create_exam_assessment(
     Only generates questions without overview, learning objectives, or teacher notes.
     """
     print("Received exam assessment request:", payload)
+    set_request_priority("batch")
     current_session_id = await SessionManager.create_session(teacher_id, session_id)
     request_payload = payload.model_dump(mode="json")
 
@@ -813,71 +854,14 @@ async def create_exam_assessment(
         return result
 
     if stream:
-        queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-        full_response = ""
-
-        async def chunk_callback(chunk: str):
-            nonlocal full_response
-            full_response += chunk
-            await queue.put(
-                {
-                    "type": "content",
-                    "data": {
-                        "chunk": chunk,
-                        "full_response": full_response,
-                        "is_complete": False,
-                    },
-                }
-            )
-
-        async def run_and_store():
-            try:
-                raw_output = await invoke_generator(chunk_callback=chunk_callback)
-                metadata = {
-                    "session_id": current_session_id,
-                    "teacher_id": teacher_id,
-                    "type": "exam_assessment",
-                    "content": raw_output,
-                }
-                await queue.put(
-                    {
-                        "type": "content",
-                        "data": {
-                            "chunk": "",
-                            "full_response": raw_output,
-                            "is_complete": True,
-                        },
-                    }
-                )
-                await queue.put({"type": "metadata", "data": metadata})
-            except Exception as exc:
-                await queue.put(
-                    {"type": "error", "data": {"message": str(exc)}}
-                )
-            finally:
-                await queue.put(None)
-
-        asyncio.create_task(run_and_store())
-
-        async def stream_output():
-            while True:
-                chunk = await queue.get()
-                if chunk is None:
-                    break
-                yield f"data: {json.dumps(chunk)}\n\n"
-
-        headers = {
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "X-Session-Id": current_session_id,
-            "X-Teacher-Id": teacher_id,
-            "X-Content-Type": "exam_assessment",
-        }
-        return StreamingResponse(
-            stream_output(),
-            media_type="text/event-stream",
-            headers=headers,
+        return _generation_stream_response(
+            invoke_generator,
+            content_type="exam_assessment",
+            session_id=current_session_id,
+            teacher_id=teacher_id,
+            endpoint="assessment",
+            request=request,
+            flight_payload=request_payload,
         )
 
     try:
@@ -1156,6 +1140,95 @@ async def comics_stream_endpoint(
 async def get_session_details(session_id: str) -> Dict[str, Any]:
     return await SessionManager.get_session(session_id)
 
+def _registered_doc_entry(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Session entry for an uploaded document (no content, keeps session JSON small)."""
+    filename = doc.get("filename", "")
+    file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
+    return {
+        "id": doc.get("id") or str(uuid4()),
+        "filename": filename,
+        "file_url": doc.get("file_url"),
+        "file_type": file_extension or "txt",
+        "size": doc.get("size") or 0,
+    }
+
+
+def _unregister_session_doc(session: Dict[str, Any], doc_id: str) -> None:
+    for key in ("uploaded_docs", "newly_uploaded_docs"):
+        if key in session:
+            session[key] = [d for d in session[key] if d.get("id") != doc_id]
+
+
+async def _ingest_document_by_url(
+    doc: Dict[str, Any],
+    progress: IngestionProgress,
+    store_stream: Callable[..., Awaitable[int]],
+    owner_kwargs: Dict[str, str],
+    session_id: str,
+    log_tag: str,
+) -> bool:
+    """
+    Ingestion worker: Fetch -> Extract -> Embed (Store), reporting progress.
+    """
+    file_url = doc.get("file_url")
+    filename = doc.get("filename", "")
+    doc_id = doc["id"]
+    file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
+
+    with await download_document(file_url) as downloaded:
+        progress.add("downloaded")
+
+        # Extract from the downloaded file in place: cached bodies by path (pool
+        # workers open it directly), spooled ones through a zero-copy buffer.
+        with (nullcontext(downloaded.path) if downloaded.path else file_buffer(downloaded.file)) as file_content:
+            outline = None
+            if file_extension == 'pdf':
+                outline = await asyncio.to_thread(extract_pdf_outline, file_content)
+
+            stored_chunks = await store_stream(
+                **owner_kwargs,
+                session_id=session_id,
+                chunk_batches=progress.track_batches(aiter_page_chunks(file_content, file_extension)),
+                metadata={
+                    "source_url": file_url,
+                    "file_type": file_extension,
+                    "doc_id": doc_id,
+                    "filename": filename
+                },
+                on_progress=progress.add,
+                outline=outline,
+            )
+
+    if not stored_chunks:
+        print(f"{log_tag} ⚠️ Warning: Empty content for {filename}")
+        return False
+
+    doc["size"] = downloaded.size
+    return True
+
+
+def _ingestion_job_or_404(job_id: str, owner_id: str, session_id: str) -> Dict[str, Any]:
+    job = ingestion_jobs.get_job(job_id)
+    if job is None or job["session_id"] != session_id:
+        raise HTTPException(status_code=404, detail="Ingestion job not found.")
+    if job["owner_id"] != owner_id:
+        raise HTTPException(status_code=403, detail="Unauthorized access to this job.")
+    return job
+
+
+def _ingestion_event_response(job_id: str) -> StreamingResponse:
+    async def event_stream():
+        async for snapshot in ingestion_jobs.events(job_id):
+            event_type = "done" if snapshot["status"] in INGESTION_TERMINAL_STATUSES else "progress"
+            yield sse_event({"type": event_type, "data": snapshot})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @app.post("/api/teacher/{teacher_id}/session/{session_id}/add-documents")
 async def add_documents_by_url(
     teacher_id: str,
@@ -1163,13 +1236,17 @@ async def add_documents_by_url(
     request: AddDocumentsRequest,
 ) -> Dict[str, Any]:
     """
-    Add documents by URL, extract content, and store in Qdrant (Session Scoped).
+    Queue documents for background ingestion into Qdrant (Session Scoped).
+
+    Returns immediately with a job id; progress is streamed from
+    `/add-documents/{job_id}/events`. Documents are registered in the session
+    right away so chat can use chunks as soon as they are indexed, and are
+    unregistered again if their ingestion fails.
     """
-    # Use the centralized session creator
     print("add_documents_by_url called with:", teacher_id, session_id)
+    set_request_priority("batch")
     session = await SessionManager.get_session(session_id)
-    # print(f"session_id: {current_session_id}, session: {session}")
-    current_session_id=session_id
+    current_session_id = session_id
     payload = request.model_dump(mode='json')
     documents = payload.get("documents", [])
     
@@ -1178,116 +1255,73 @@ async def add_documents_by_url(
         
     print(f"[DOC EMBEDDING] Received {len(documents)} docs for session {current_session_id}")
 
-    processed_docs = []
-    
-    async def process_single_document(doc: dict, index: int) -> Optional[dict]:
-        """
-        Process a single document: Fetch -> Extract -> Embed (Store).
-        """
-        try:
-            file_url = doc.get("file_url")
-            filename = doc.get("filename", "")
-            doc_id = doc.get("id", str(uuid4()))
-            file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(file_url, timeout=30.0)
-                response.raise_for_status()
-                file_content = response.content
-            
-            content = ""
-            if file_extension == 'pdf':
-                content = await asyncio.to_thread(extract_text_from_pdf, file_content)
-            elif file_extension == 'docx':
-                content = await asyncio.to_thread(extract_text_from_docx, file_content)
-            elif file_extension == 'txt':
-                content = extract_text_from_txt(file_content)
-            elif file_extension == 'json':
-                content = extract_text_from_json(file_content)
-            else:
-                content = extract_text_from_txt(file_content)
-
-            if not content.strip():
-                print(f"[DOC EMBEDDING] ⚠️ Warning: Empty content for {filename}")
-                return None
-            
-            # Create Document object for local processing
-            # In reference project: We store non-image docs in "processed_docs" then embed them
-            
-            return {
-                "id": doc_id,
-                "filename": filename,
-                "file_url": file_url,
-                "file_type": file_extension or "txt",
-                "size": len(file_content),
-                "content": content,
-                "metadata": {
-                    "source_url": file_url,
-                    "file_type": file_extension,
-                    "doc_id": doc_id,
-                    "filename": filename
-                }
-            }
-                
-        except Exception as e:
-            logger.error(f"Error processing {doc.get('filename', 'unknown')}: {e}", exc_info=True)
-            return None
-    
-    # Run processing
-    doc_tasks = [process_single_document(doc, i) for i, doc in enumerate(documents)]
-    results = await asyncio.gather(*doc_tasks, return_exceptions=True)
-    
-    for res in results:
-        if isinstance(res, dict):
-            processed_docs.append(res)
-        elif isinstance(res, Exception):
-            logger.error(f"Document processing error: {res}")
-            
-    # Batch Embed
-    if processed_docs:
-        from langchain_core.documents import Document
-        lc_docs = [
-            Document(page_content=d["content"], metadata=d["metadata"]) 
-            for d in processed_docs
-        ]
-        
-        await store_documents(
-            teacher_id=teacher_id,
-            session_id=current_session_id,
-            documents=lc_docs
-        )
+    clean_docs = [_registered_doc_entry(doc) for doc in documents]
+    for doc, entry in zip(documents, clean_docs):
+        doc["id"] = entry["id"]
 
-    if "uploaded_docs" not in session:
-        session["uploaded_docs"] = []
-    
-    # Store clean version (no giant content string) in session history if preferred, 
-    # OR store full content as per reference project. Reference project stores content.
-    # We will exclude full content from metadata only if it's too large, but for now specific to RAG:
-    # Ed-Tech stores full objects usually.
-    
-    clean_docs = []
-    for doc in processed_docs:
-        clean_docs.append({
-            "id": doc["id"],
-            "filename": doc["filename"],
-            "file_url": doc["file_url"],
-            "file_type": doc["file_type"],
-            "size": doc["size"]
-            # Exclude 'content' to keep session JSON small in Redis/Memory
-        })
-        
-    session["uploaded_docs"].extend(clean_docs)
+    session.setdefault("uploaded_docs", []).extend(clean_docs)
     session.setdefault("newly_uploaded_docs", []).extend(clean_docs)
-    
     await SessionManager.update_session(current_session_id, session)
+
+    async def ingest(doc: Dict[str, Any], progress: IngestionProgress) -> bool:
+        ok = await _ingest_document_by_url(
+            doc,
+            progress,
+            store_stream=store_document_stream,
+            owner_kwargs={"teacher_id": teacher_id},
+            session_id=current_session_id,
+            log_tag="[DOC EMBEDDING]",
+        )
+        if ok:
+            for entry in clean_docs:
+                if entry["id"] == doc["id"]:
+                    entry["size"] = doc["size"]
+        return ok
+
+    async def on_failed(doc: Dict[str, Any], error: Optional[str]) -> None:
+        current = sessions.get(current_session_id)
+        if current is not None:
+            _unregister_session_doc(current, doc["id"])
+
+    job = ingestion_jobs.submit(
+        owner_id=teacher_id,
+        session_id=current_session_id,
+        documents=documents,
+        worker=ingest,
+        on_document_failed=on_failed,
+    )
     
     return {
-        "message": f"Added {len(processed_docs)} documents",
+        "message": f"Queued {len(clean_docs)} documents for ingestion",
+        "job_id": job["job_id"],
+        "status": job["status"],
         "documents": clean_docs,
         "session_id": current_session_id
     }
 
 
+@app.get("/api/teacher/{teacher_id}/session/{session_id}/add-documents/{job_id}")
+async def get_document_ingestion_job(
+    teacher_id: str,
+    session_id: str,
+    job_id: str,
+) -> Dict[str, Any]:
+    """Return the current progress snapshot of an ingestion job."""
+    _ingestion_job_or_404(job_id, teacher_id, session_id)
+    return ingestion_jobs.snapshot(job_id)
+
+
+@app.get("/api/teacher/{teacher_id}/session/{session_id}/add-documents/{job_id}/events")
+async def stream_document_ingestion_job(
+    teacher_id: str,
+    session_id: str,
+    job_id: str,
+):
+    """Stream ingestion progress (downloaded/extracted/embedded/indexed) as SSE."""
+    _ingestion_job_or_404(job_id, teacher_id, session_id)
+    return _ingestion_event_response(job_id)
+
+
 @app.get("/api/teacher/{teacher_id}/session/{session_id}/documents")
 async def get_documents(
     teacher_id: str,
@@ -1309,9 +1343,10 @@ async def add_student_documents_by_url(
     request: AddDocumentsRequest,
 ) -> Dict[str, Any]:
     """
-    Add documents by URL for students, extract content, and store in Qdrant (Session Scoped).
+    Queue student documents for background ingestion into Qdrant (Session Scoped).
     """
     print("add_student_documents_by_url called with:", student_id, session_id)
+    set_request_priority("batch")
     session = await StudentSessionManager.get_session(session_id)
     current_session_id = session_id
     payload = request.model_dump(mode='json')
@@ -1322,107 +1357,73 @@ async def add_student_documents_by_url(
         
     print(f"[STUDENT DOC EMBEDDING] Received {len(documents)} docs for session {current_session_id}")
 
-    processed_docs = []
-    
-    async def process_single_document(doc: dict, index: int) -> Optional[dict]:
-        """
-        Process a single document: Fetch -> Extract -> Embed (Store).
-        """
-        try:
-            file_url = doc.get("file_url")
-            filename = doc.get("filename", "")
-            doc_id = doc.get("id", str(uuid4()))
-            file_extension = filename.split('.')[-1].lower() if '.' in filename else ''
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(file_url, timeout=30.0)
-                response.raise_for_status()
-                file_content = response.content
-            
-            content = ""
-            if file_extension == 'pdf':
-                content = await asyncio.to_thread(extract_text_from_pdf, file_content)
-            elif file_extension == 'docx':
-                content = await asyncio.to_thread(extract_text_from_docx, file_content)
-            elif file_extension == 'txt':
-                content = extract_text_from_txt(file_content)
-            elif file_extension == 'json':
-                content = extract_text_from_json(file_content)
-            else:
-                content = extract_text_from_txt(file_content)
-
-            if not content.strip():
-                print(f"[STUDENT DOC EMBEDDING] ⚠️ Warning: Empty content for {filename}")
-                return None
-            
-            return {
-                "id": doc_id,
-                "filename": filename,
-                "file_url": file_url,
-                "file_type": file_extension or "txt",
-                "size": len(file_content),
-                "content": content,
-                "metadata": {
-                    "source_url": file_url,
-                    "file_type": file_extension,
-                    "doc_id": doc_id,
-                    "filename": filename
-                }
-            }
-                
-        except Exception as e:
-            logger.error(f"Error processing {doc.get('filename', 'unknown')}: {e}", exc_info=True)
-            return None
-    
-    # Run processing
-    doc_tasks = [process_single_document(doc, i) for i, doc in enumerate(documents)]
-    results = await asyncio.gather(*doc_tasks, return_exceptions=True)
-    
-    for res in results:
-        if isinstance(res, dict):
-            processed_docs.append(res)
-        elif isinstance(res, Exception):
-            logger.error(f"Document processing error: {res}")
-            
-    # Batch Embed
-    if processed_docs:
-        from langchain_core.documents import Document
-        lc_docs = [
-            Document(page_content=d["content"], metadata=d["metadata"]) 
-            for d in processed_docs
-        ]
-        
-        await store_student_documents(
-            student_id=student_id,
-            session_id=current_session_id,
-            documents=lc_docs
-        )
+    clean_docs = [_registered_doc_entry(doc) for doc in documents]
+    for doc, entry in zip(documents, clean_docs):
+        doc["id"] = entry["id"]
 
-    if "uploaded_docs" not in session:
-        session["uploaded_docs"] = []
-    
-    clean_docs = []
-    for doc in processed_docs:
-        clean_docs.append({
-            "id": doc["id"],
-            "filename": doc["filename"],
-            "file_url": doc["file_url"],
-            "file_type": doc["file_type"],
-            "size": doc["size"]
-        })
-        
-    session["uploaded_docs"].extend(clean_docs)
+    session.setdefault("uploaded_docs", []).extend(clean_docs)
     session.setdefault("newly_uploaded_docs", []).extend(clean_docs)
-    
     await StudentSessionManager.update_session(current_session_id, session)
+
+    async def ingest(doc: Dict[str, Any], progress: IngestionProgress) -> bool:
+        ok = await _ingest_document_by_url(
+            doc,
+            progress,
+            store_stream=store_student_document_stream,
+            owner_kwargs={"student_id": student_id},
+            session_id=current_session_id,
+            log_tag="[STUDENT DOC EMBEDDING]",
+        )
+        if ok:
+            for entry in clean_docs:
+                if entry["id"] == doc["id"]:
+                    entry["size"] = doc["size"]
+        return ok
+
+    async def on_failed(doc: Dict[str, Any], error: Optional[str]) -> None:
+        current = student_sessions.get(current_session_id)
+        if current is not None:
+            _unregister_session_doc(current, doc["id"])
+
+    job = ingestion_jobs.submit(
+        owner_id=student_id,
+        session_id=current_session_id,
+        documents=documents,
+        worker=ingest,
+        on_document_failed=on_failed,
+    )
     
     return {
-        "message": f"Added {len(processed_docs)} documents",
+        "message": f"Queued {len(clean_docs)} documents for ingestion",
+        "job_id": job["job_id"],
+        "status": job["status"],
         "documents": clean_docs,
         "session_id": current_session_id
     }
 
 
+@app.get("/api/student/{student_id}/session/{session_id}/add-documents/{job_id}")
+async def get_student_document_ingestion_job(
+    student_id: str,
+    session_id: str,
+    job_id: str,
+) -> Dict[str, Any]:
+    """Return the current progress snapshot of a student ingestion job."""
+    _ingestion_job_or_404(job_id, student_id, session_id)
+    return ingestion_jobs.snapshot(job_id)
+
+
+@app.get("/api/student/{student_id}/session/{session_id}/add-documents/{job_id}/events")
+async def stream_student_document_ingestion_job(
+    student_id: str,
+    session_id: str,
+    job_id: str,
+):
+    """Stream student ingestion progress as SSE."""
+    _ingestion_job_or_404(job_id, student_id, session_id)
+    return _ingestion_event_response(job_id)
+
+
 @app.get("/api/student/{student_id}/session/{session_id}/documents")
 async def get_student_documents(
     student_id: str,
@@ -1443,6 +1444,7 @@ async def ai_tutor_stream_chat(
     teacher_id: str,
     session_id: str,
     payload: AITutorRequest,
+    request: Request,
     stream: bool = True,
 ) -> StreamingResponse:
     """
@@ -1450,6 +1452,7 @@ async def ai_tutor_stream_chat(
     Accepts teacher data, student data, topic, and user message.
     Streams the AI Tutor response using Server-Sent Events.
     """
+    set_request_priority("interactive")
     # Try to get existing session, create if it doesn't exist (defensive fallback)
     # This handles cases where server restarted or session wasn't properly created
     try:
@@ -1465,31 +1468,21 @@ async def ai_tutor_stream_chat(
     print("teacher_payload:-----------------------", session["teacher_payload"])
     print(f"hiii", payload)
     print(f"[CHAT ENDPOINT] 🚀 Starting AI Tutor chat for teacher_id: {teacher_id}, session_id: {current_session_id}")
-    queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-    full_response = ""
     print(f"newly_uploaded_docs before chat: {session.get('newly_uploaded_docs', [])}")
-    async def chunk_callback(chunk: str):
-        nonlocal full_response
-        full_response += chunk
-        await queue.put(
-            {
-                "type": "content",
-                "data": {
-                    "chunk": chunk,
-                    "full_response": full_response,
-                    "is_complete": False,
-                },
-            }
-        )
+    event_stream = stream_registry.create({"teacher_id": teacher_id, "session_id": current_session_id, "endpoint": "chat"})
+    encoder = StreamEncoder(event_stream, negotiate_stream_protocol(request))
+    event_stream.headers.update(encoder.headers)
+    chunk_callback = ChunkCoalescer.for_endpoint("chat", encoder.on_flush)
+    watcher = DisconnectWatcher(request, "chat", event_stream, produced_text=lambda: chunk_callback.text)
     
     session_messages = session.get("messages", [])
     
     print(f"[CHAT ENDPOINT] 📜 Loading conversation history: {len(session_messages)} previous messages")
     session_messages.append({"role": "user", "content": payload.message})
-    recent_messages = session_messages[-3:]
+    recent_messages = session_messages[-CHAT_HISTORY_MAX_MESSAGES:]
     langchain_messages = []
     
-    print(f"[CHAT ENDPOINT] ✂️ Limiting context to last {len(recent_messages)} messages")
+    print(f"[CHAT ENDPOINT] ✂️ Passing the last {len(recent_messages)} messages; the node budget trims further")
     
     for msg in recent_messages:
         if msg.get("role") == "user":
@@ -1540,54 +1533,29 @@ async def ai_tutor_stream_chat(
     
     print(f"[CHAT ENDPOINT] ✅ Graph state created. doc_url in state: {state.get('doc_url')}")
     
-    async def generate_stream():
+    async def run_chat():
+        final_state = None
+        stream_error_message = None
+
+        async def run_graph():
+            nonlocal final_state, stream_error_message
+            try:
+                # logger.info("Starting AI Tutor graph execution")
+                async for node_result in ai_tutor_graph.astream(state):
+                    logger.debug(f"Node result: {list(node_result.keys())}")
+                    final_state = node_result
+                    for node_name, node_state in node_result.items():
+                        if isinstance(node_state, dict):
+                            state.update(node_state)
+            except Exception as e:
+                logger.error(f"Error in graph execution: {e}", exc_info=True)
+                stream_error_message = str(e) or "Unexpected error"
+            finally:
+                chunk_callback.close()
+
         try:
-            final_state = None
-            stream_error_message = None
-            
-            async def run_graph():
-                nonlocal final_state, stream_error_message
-                try:
-                    # logger.info("Starting AI Tutor graph execution")
-                    async for node_result in ai_tutor_graph.astream(state):
-                        logger.debug(f"Node result: {list(node_result.keys())}")
-                        final_state = node_result
-                        for node_name, node_state in node_result.items():
-                            if isinstance(node_state, dict):
-                                state.update(node_state)
-                except Exception as e:
-                    logger.error(f"Error in graph execution: {e}", exc_info=True)
-                    if isinstance(e, asyncio.CancelledError):
-                        stream_error_message = "Response stream was interrupted."
-                    else:
-                        stream_error_message = str(e) or "Unexpected error"
-                    await queue.put({
-                        "type": "error",
-                        "data": {"error": stream_error_message}
-                    })
-                finally:
-                    await queue.put(None)
-            
-            async def consume_and_yield():
-                nonlocal stream_error_message
-                while True:
-                    item = await queue.get()
-                    if item is None:
-                        break
-                    if item.get("type") == "error":
-                        stream_error_message = item["data"].get("error")
-                        continue
-                    if stream_error_message:
-                        continue
-                    yield item
-            
-            graph_task = asyncio.create_task(run_graph())
-            async for chunk in consume_and_yield():
-                chunk_data = json.dumps(chunk)
-                yield f"data: {chunk_data}\n\n"
-            
-            await graph_task
-            
+            await run_graph()
+
             response = ""
             if final_state:
                 for node_name, node_state in final_state.items():
@@ -1605,29 +1573,29 @@ async def ai_tutor_stream_chat(
                         break
             
             if not response:
-                response = full_response
+                response = chunk_callback.text
             
             token_usage = state.get("token_usage", {})
+            watcher.record_completion(
+                (token_usage or {}).get("output_tokens") or estimate_tokens(chunk_callback.text)
+            )
             
-            final_chunk = {
-                "type": "content",
-                "data": {
-                    "content": "",
-                    "is_complete": True,
-                    "full_response": response or full_response,
-                    "image_result": state.get("image_result"),
-                    "img_urls": state.get("img_urls", []),
-                    "token_usage": token_usage,
-                    "route_taken": state.get("tasks", []),
-                    "error_message": stream_error_message
-                }
-            }
-            yield f"data: {json.dumps(final_chunk)}\n\n"
+            final_chunk = encoder.complete(
+                response or chunk_callback.text,
+                chunk_callback.text,
+                content="",
+                image_result=state.get("image_result"),
+                img_urls=state.get("img_urls", []),
+                token_usage=token_usage,
+                route_taken=state.get("tasks", []),
+                error_message=stream_error_message,
+            )
+            await event_stream.put(final_chunk)
             
-            if response or full_response:
+            if response or chunk_callback.text:
                 if "messages" not in session:
                     session["messages"] = []
-                session["messages"].append({"role": "assistant", "content": response or full_response})
+                session["messages"].append({"role": "assistant", "content": response or chunk_callback.text})
             if state.get("context", {}).get("session", {}).get("summary"):
                 session["summary"] = state["context"]["session"]["summary"]
             if state.get("context", {}).get("session", {}).get("last_route"):
@@ -1645,20 +1613,29 @@ async def ai_tutor_stream_chat(
             
             await SessionManager.update_session(current_session_id, session)
             
-            yield f"data: {json.dumps({'type': 'done', 'data': {'session_id': current_session_id}})}\n\n"
+            await event_stream.put({"type": "done", "data": {"session_id": current_session_id}})
             
         except Exception as e:
             logger.error(f"Error in stream generation: {e}", exc_info=True)
-            error_chunk = json.dumps({
-                "type": "error",
-                "data": {"error": str(e)}
-            })
-            yield f"data: {error_chunk}\n\n"
+            await event_stream.put({"type": "error", "data": {"error": str(e)}})
+        finally:
+            chunk_callback.close()
+            event_stream.close()
+
+    # The graph runs independently of the HTTP response so a dropped client
+    # can reattach via /api/streams/{stream_id} with Last-Event-ID.
+    watcher.watch(asyncio.create_task(run_chat()))
+
+    async def generate_stream():
+        try:
+            async for frame in sse_frames(event_stream):
+                yield frame
+        finally:
+            watcher.close()
     
     headers = {
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "X-Accel-Buffering": "no",
+        **SSE_HEADERS,
+        **event_stream.headers,
         "X-Session-Id": current_session_id,
         "X-Teacher-Id": teacher_id,
         "X-Content-Type": "ai_tutor",
@@ -1676,31 +1653,22 @@ async def student_ai_tutor_stream_chat(
     student_id: str,
     session_id: str,
     payload: StudentAITutorRequest,
+    request: Request,
     stream: bool = True,
 ) -> StreamingResponse:
     """
     Student AI Tutor streaming chat endpoint.
     """
+    set_request_priority("interactive")
     current_session_id = session_id
     session = await StudentSessionManager.get_session(current_session_id)
     print(f"payload: {payload}")
 
-    queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue()
-    full_response = ""
-
-    async def chunk_callback(chunk: str):
-        nonlocal full_response
-        full_response += chunk
-        await queue.put(
-            {
-                "type": "content",
-                "data": {
-                    "chunk": chunk,
-                    "full_response": full_response,
-                    "is_complete": False,
-                },
-            }
-        )
+    event_stream = stream_registry.create({"student_id": student_id, "session_id": current_session_id, "endpoint": "chat"})
+    encoder = StreamEncoder(event_stream, negotiate_stream_protocol(request))
+    event_stream.headers.update(encoder.headers)
+    chunk_callback = ChunkCoalescer.for_endpoint("chat", encoder.on_flush)
+    watcher = DisconnectWatcher(request, "chat", event_stream, produced_text=lambda: chunk_callback.text)
 
     session_messages = session.setdefault("messages", [])
     print(f"[STUDENT CHAT ENDPOINT] 📜 Session messages BEFORE adding new user message: {len(session_messages)} messages")
@@ -1708,9 +1676,9 @@ async def student_ai_tutor_stream_chat(
         print(f"  [{i}] {msg.get('role', 'unknown')}: {msg.get('content', '')[:100]}...")
     
     session_messages.append({"role": "user", "content": payload.message})
-    recent_messages = session_messages[-4:]
+    recent_messages = session_messages[-CHAT_HISTORY_MAX_MESSAGES:]
     
-    print(f"[STUDENT CHAT ENDPOINT] 📜 Recent messages (last 4): {len(recent_messages)} messages")
+    print(f"[STUDENT CHAT ENDPOINT] 📜 Recent messages (last {CHAT_HISTORY_MAX_MESSAGES}): {len(recent_messages)} messages")
     for i, msg in enumerate(recent_messages):
         print(f"  [{i}] {msg.get('role', 'unknown')}: {msg.get('content', '')[:100]}...")
 
@@ -1764,63 +1732,27 @@ async def student_ai_tutor_stream_chat(
         "img_urls": session.get("img_urls", []),
     }
 
-    async def generate_stream():
-        try:
-            # Send initial status message immediately
-            initial_status = {
-                "type": "status",
-                "data": {
-                    "status": "processing",
-                    "message": "Study Buddy is thinking..."
-                }
-            }
-            yield f"data: {json.dumps(initial_status)}\n\n"
-            
-            final_state = None
-            stream_error_message = None
+    async def run_chat():
+        final_state = None
+        stream_error_message = None
 
-            async def run_graph():
-                nonlocal final_state, stream_error_message
-                try:
-                    # logger.info("Starting Student AI Tutor graph execution")
-                    async for node_result in student_ai_tutor_graph.astream(state):
-                        final_state = node_result
-                        for node_name, node_state in node_result.items():
-                            if isinstance(node_state, dict):
-                                state.update(node_state)
-                except Exception as exc:
-                    logger.error(f"Student graph execution error: {exc}", exc_info=True)
-                    stream_error_message = str(exc) or "Unexpected error"
-                    await queue.put({"type": "error", "data": {"error": stream_error_message}})
-                finally:
-                    await queue.put(None)
-
-            async def consume_and_yield():
-                nonlocal stream_error_message
-                while True:
-                    try:
-                        # Add timeout to prevent indefinite blocking
-                        item = await asyncio.wait_for(queue.get(), timeout=300.0)
-                        if item is None:
-                            break
-                        if item.get("type") == "error":
-                            stream_error_message = item["data"].get("error")
-                            continue
-                        if stream_error_message:
-                            continue
-                        yield item
-                    except asyncio.TimeoutError:
-                        logger.error("Timeout waiting for queue item")
-                        yield {
-                            "type": "error",
-                            "data": {"error": "Request timeout - no response from AI tutor"}
-                        }
-                        break
+        async def run_graph():
+            nonlocal final_state, stream_error_message
+            try:
+                # logger.info("Starting Student AI Tutor graph execution")
+                async for node_result in student_ai_tutor_graph.astream(state):
+                    final_state = node_result
+                    for node_name, node_state in node_result.items():
+                        if isinstance(node_state, dict):
+                            state.update(node_state)
+            except Exception as exc:
+                logger.error(f"Student graph execution error: {exc}", exc_info=True)
+                stream_error_message = str(exc) or "Unexpected error"
+            finally:
+                chunk_callback.close()
 
-            graph_task = asyncio.create_task(run_graph())
-            async for chunk in consume_and_yield():
-                yield f"data: {json.dumps(chunk)}\n\n"
-            await graph_task
+        try:
+            await run_graph()
 
             response = ""
             if final_state:
@@ -1838,26 +1770,26 @@ async def student_ai_tutor_stream_chat(
                             break
 
             if not response:
-                response = full_response
+                response = chunk_callback.text
 
             token_usage = state.get("token_usage", {})
-            final_chunk = {
-                "type": "content",
-                "data": {
-                    "content": "",
-                    "is_complete": True,
-                    "full_response": response or full_response,
-                    "image_result": state.get("image_result"),
-                    "img_urls": state.get("img_urls", []),
-                    "token_usage": token_usage,
-                    "route_taken": state.get("tasks", []),
-                    "error_message": stream_error_message,
-                },
-            }
-            yield f"data: {json.dumps(final_chunk)}\n\n"
+            watcher.record_completion(
+                (token_usage or {}).get("output_tokens") or estimate_tokens(chunk_callback.text)
+            )
+            final_chunk = encoder.complete(
+                response or chunk_callback.text,
+                chunk_callback.text,
+                content="",
+                image_result=state.get("image_result"),
+                img_urls=state.get("img_urls", []),
+                token_usage=token_usage,
+                route_taken=state.get("tasks", []),
+                error_message=stream_error_message,
+            )
+            await event_stream.put(final_chunk)
 
-            if response or full_response:
-                session_messages.append({"role": "assistant", "content": response or full_response})
+            if response or chunk_callback.text:
+                session_messages.append({"role": "assistant", "content": response or chunk_callback.text})
             if state.get("context", {}).get("session", {}).get("summary"):
                 session["summary"] = state["context"]["session"]["summary"]
             
@@ -1877,16 +1809,41 @@ async def student_ai_tutor_stream_chat(
 
             await StudentSessionManager.update_session(current_session_id, session)
 
-            yield f"data: {json.dumps({'type': 'done', 'data': {'session_id': current_session_id}})}\n\n"
+            await event_stream.put({"type": "done", "data": {"session_id": current_session_id}})
         except Exception as exc:
             logger.error(f"Error in student stream generation: {exc}", exc_info=True)
-            error_chunk = json.dumps({"type": "error", "data": {"error": str(exc)}})
-            yield f"data: {error_chunk}\n\n"
+            await event_stream.put({"type": "error", "data": {"error": str(exc)}})
+        finally:
+            chunk_callback.close()
+            event_stream.close()
+
+    # Send initial status message immediately
+    event_stream.put_nowait({
+        "type": "status",
+        "data": {
+            "status": "processing",
+            "message": "Study Buddy is thinking..."
+        }
+    })
+    watcher.watch(asyncio.create_task(run_chat()))
+
+    async def generate_stream():
+        try:
+            # Add timeout to prevent indefinite blocking
+            async for frame in sse_frames(event_stream, idle_timeout=300.0):
+                yield frame
+        except asyncio.TimeoutError:
+            logger.error("Timeout waiting for stream event")
+            yield sse_event({
+                "type": "error",
+                "data": {"error": "Request timeout - no response from AI tutor"}
+            })
+        finally:
+            watcher.close()
 
     headers = {
-        "Cache-Control": "no-cache",
-        "Connection": "keep-alive",
-        "X-Accel-Buffering": "no",
+        **SSE_HEADERS,
+        **event_stream.headers,
         "X-Session-Id": current_session_id,
         "X-Student-Id": student_id,
         "X-Content-Type": "student_ai_tutor",
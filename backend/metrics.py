@@ -0,0 +1,131 @@
+"""
+In-process metrics for the streaming and LLM paths.
+
+Counters, gauges and summaries are keyed by name plus optional labels and
+exposed as JSON on /api/metrics. Summaries keep count/sum/min/max and a
+bounded window of recent samples for percentiles.
+"""
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+METRICS_SAMPLE_WINDOW = 512
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(name: str, key: LabelKey) -> str:
+    if not key:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in key) + "}"
+
+
+class _Summary:
+    __slots__ = ("count", "total", "min", "max", "samples")
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.samples: deque = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "avg": round(self.total / self.count, 4) if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and summaries."""
+
+    def __init__(self, window: int = METRICS_SAMPLE_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._summaries: Dict[str, Dict[LabelKey, _Summary]] = {}
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = _Summary(self._window)
+            summary.observe(value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def summary(self, name: str, **labels: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            summary = self._summaries.get(name, {}).get(_label_key(labels))
+            return summary.as_dict() if summary else None
+
+    def percentile(self, name: str, q: float, **labels: Any) -> Optional[float]:
+        with self._lock:
+            summary = self._summaries.get(name, {}).get(_label_key(labels))
+            return summary.percentile(q) if summary else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "counters": {
+                    _format_key(name, key): value
+                    for name, series in self._counters.items()
+                    for key, value in series.items()
+                },
+                "gauges": {
+                    _format_key(name, key): value
+                    for name, series in self._gauges.items()
+                    for key, value in series.items()
+                },
+                "summaries": {
+                    _format_key(name, key): summary.as_dict()
+                    for name, series in self._summaries.items()
+                    for key, summary in series.items()
+                },
+            }
+
+
+metrics = MetricsRegistry()
@@ -5,7 +5,6 @@ import asyncio
 
 import os
 import logging
-import tempfile
 from datetime import datetime
 from starlette.concurrency import run_in_threadpool
 from teacher.media_toolkit.video_generation import PPTXToHeyGenVideo 
@@ -265,7 +264,7 @@ def parse_enhanced_story_panels(story_text: str) -> List[Dict[str, str]]:
 
 async def generate_video_background(
     task_id: str, 
-    pptx_bytes: bytes, 
+    pptx_path: str, 
     original_filename: str, 
     voice_id: str, 
     avatar_id: str, 
@@ -277,19 +276,16 @@ async def generate_video_background(
     """
     Background task to handle the synchronous video generation process.
     Requires dependency injection of state dictionaries and storage managers.
+    Takes ownership of `pptx_path`, a temp copy of the upload, and removes it
+    when done.
     """
-    temp_file_path = None
+    temp_file_path = pptx_path
     try:
         logger.info(f"Starting background video generation for task: {task_id}")
         video_generation_tasks[task_id]["status"] = "uploading"
 
-        # 1. Write bytes to a temporary local file 
+        # 1-2. Upload the temp file to Cloudinary
         # (CloudinaryStorage.upload_file expects a file path)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as temp_file:
-            temp_file.write(pptx_bytes)
-            temp_file_path = temp_file.name
-
-        # 2. Upload to Cloudinary
         # We use a unique public_id to prevent collisions
         public_id = f"video_presentations/{task_id}_{original_filename}"
         
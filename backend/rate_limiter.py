@@ -0,0 +1,532 @@
+"""
+Per-provider adaptive concurrency limiting for outbound AI/API calls.
+
+Every LLM, embedding, image and search call takes a slot from the limiter of
+its (provider, model) before it goes out:
+
+* Concurrency follows AIMD: each call that finishes under the provider's
+  latency target raises the limit by 1/limit (about +1 per round-trip
+  "window"). A 429/503, or a time-to-first-byte above the target, cuts it
+  multiplicatively, at most once per RATE_LIMIT_DECREASE_COOLDOWN_SECONDS.
+* A token bucket caps the request rate for providers with a published
+  requests-per-second quota.
+* After a 429 the limiter pauses new calls for Retry-After (or an
+  exponential backoff) instead of every call site sleeping on its own.
+* Callers that can't start immediately wait in a bounded queue with a
+  deadline. A full queue or an expired deadline raises ProviderOverloaded, so
+  overload surfaces as fast backpressure instead of piling up sockets.
+
+Calls carry a priority class (interactive, standard, batch) taken from a
+context variable that endpoints set with `set_request_priority`; tasks they
+spawn inherit it. Each class has its own FIFO. Free slots go to the class
+head with the highest weight x (1 + wait / RATE_LIMIT_AGING_SECONDS), so a
+student's chat turn overtakes queued exam generation, while aging keeps
+batch work moving. Batch calls may also hold at most
+RATE_LIMIT_BATCH_MAX_SHARE of the limit, leaving headroom for
+interactive turns to start without queueing.
+
+httpx-based clients (OpenRouter/Groq chat models, OpenAI embeddings) are
+limited transparently by RateLimitedTransport. Other SDKs wrap their calls in
+`limiters.slot(provider, model)`. Limits, in-flight counts and queue depths
+are published as gauges on /api/metrics and in full on /api/limits.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+try:
+    from backend.metrics import metrics
+except ImportError:
+    from metrics import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_QUEUE = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "256"))
+RATE_LIMIT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RATE_LIMIT_QUEUE_TIMEOUT_SECONDS", "60"))
+RATE_LIMIT_DECREASE_COOLDOWN_SECONDS = float(os.getenv("RATE_LIMIT_DECREASE_COOLDOWN_SECONDS", "1.0"))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_MAX_BACKOFF_SECONDS", "30"))
+RATE_LIMIT_AGING_SECONDS = float(os.getenv("RATE_LIMIT_AGING_SECONDS", "10"))
+RATE_LIMIT_BATCH_MAX_SHARE = float(os.getenv("RATE_LIMIT_BATCH_MAX_SHARE", "0.5"))
+
+PRIORITY_CLASSES = ("interactive", "standard", "batch")
+PRIORITY_WEIGHTS = {
+    "interactive": float(os.getenv("RATE_LIMIT_WEIGHT_INTERACTIVE", "8")),
+    "standard": float(os.getenv("RATE_LIMIT_WEIGHT_STANDARD", "3")),
+    "batch": float(os.getenv("RATE_LIMIT_WEIGHT_BATCH", "1")),
+}
+
+# Per-provider defaults; each field can be overridden with
+# RATE_LIMIT_<PROVIDER>_<FIELD>, e.g. RATE_LIMIT_OPENROUTER_MAX_CONCURRENCY=128.
+# rate_per_second=0 disables the token bucket; latency_target=0 disables the
+# latency signal (only 429s shrink the limit).
+PROVIDER_DEFAULTS: Dict[str, Dict[str, float]] = {
+    "openrouter": {"max_concurrency": 64, "initial_concurrency": 16, "rate_per_second": 0, "burst": 0, "latency_target": 10.0},
+    "groq": {"max_concurrency": 16, "initial_concurrency": 4, "rate_per_second": 0, "burst": 0, "latency_target": 3.0},
+    "openai": {"max_concurrency": 32, "initial_concurrency": 8, "rate_per_second": 0, "burst": 0, "latency_target": 5.0},
+    "replicate": {"max_concurrency": 8, "initial_concurrency": 2, "rate_per_second": 1, "burst": 2, "latency_target": 0},
+    "tavily": {"max_concurrency": 8, "initial_concurrency": 4, "rate_per_second": 2, "burst": 4, "latency_target": 15.0},
+}
+_FALLBACK_DEFAULTS = {"max_concurrency": 16, "initial_concurrency": 4, "rate_per_second": 0, "burst": 0, "latency_target": 0}
+
+_PROVIDER_HOSTS = {
+    "openrouter.ai": "openrouter",
+    "api.groq.com": "groq",
+    "api.openai.com": "openai",
+    "api.replicate.com": "replicate",
+    "api.tavily.com": "tavily",
+}
+
+_RATE_LIMIT_STATUSES = {429, 503}
+_RATE_LIMIT_MESSAGE_RE = re.compile(r"\b429\b|rate.?limit|throttl|too many requests", re.I)
+_MODEL_FIELD_RE = re.compile(rb'"model"\s*:\s*"([^"]{1,200})"')
+
+
+_request_priority: ContextVar[str] = ContextVar("request_priority", default="standard")
+
+
+def current_priority() -> str:
+    return _request_priority.get()
+
+
+def set_request_priority(priority: str) -> None:
+    """Set the priority class for LLM/API calls made from the current request."""
+    if priority not in PRIORITY_WEIGHTS:
+        raise ValueError(f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITY_CLASSES)}")
+    _request_priority.set(priority)
+
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[None]:
+    """Run a block (and tasks created inside it) under a priority class."""
+    if priority not in PRIORITY_WEIGHTS:
+        raise ValueError(f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITY_CLASSES)}")
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+class ProviderOverloaded(Exception):
+    """Raised when a call can't get a provider slot (queue full or deadline passed)."""
+
+    def __init__(self, limiter: str, reason: str):
+        super().__init__(f"{limiter} is overloaded: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+
+
+def provider_config(provider: str) -> Dict[str, float]:
+    config = dict(PROVIDER_DEFAULTS.get(provider, _FALLBACK_DEFAULTS))
+    prefix = f"RATE_LIMIT_{re.sub(r'[^A-Z0-9]', '_', provider.upper())}_"
+    for field in config:
+        value = os.getenv(prefix + field.upper())
+        if value is not None:
+            config[field] = float(value)
+    return config
+
+
+def provider_for_host(host: str) -> str:
+    for suffix, provider in _PROVIDER_HOSTS.items():
+        if host == suffix or host.endswith("." + suffix):
+            return provider
+    return host
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Whether an SDK exception is a provider throttle (429/503/'rate limit')."""
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status in _RATE_LIMIT_STATUSES:
+        return True
+    return bool(_RATE_LIMIT_MESSAGE_RE.search(str(exc)))
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit + token bucket + bounded deadline queue for one
+    provider/model, with one FIFO queue per priority class.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: float,
+        initial_concurrency: float,
+        rate_per_second: float = 0,
+        burst: float = 0,
+        latency_target: float = 0,
+        min_concurrency: float = 1,
+        max_queue: int = RATE_LIMIT_MAX_QUEUE,
+        queue_timeout: float = RATE_LIMIT_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.name = name
+        self.max_concurrency = max(1.0, float(max_concurrency))
+        self.min_concurrency = max(1.0, min(float(min_concurrency), self.max_concurrency))
+        self.limit = min(self.max_concurrency, max(self.min_concurrency, float(initial_concurrency)))
+        self.rate_per_second = float(rate_per_second)
+        self.burst = max(1.0, float(burst or rate_per_second or 1))
+        self.latency_target = float(latency_target)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.in_flight_by_priority: Dict[str, int] = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._throttle_streak = 0
+        self._last_decrease = 0.0
+        # priority -> FIFO of (future, enqueued_at, deadline)
+        self._waiters: Dict[str, Deque[Tuple[asyncio.Future, float, float]]] = {
+            priority: deque() for priority in PRIORITY_CLASSES
+        }
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = math.inf
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_second > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+
+    def _wait_needed(self, now: float) -> float:
+        """Seconds until a call could start ignoring concurrency, 0 if it can start now."""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.rate_per_second > 0:
+            self._refill(now)
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate_per_second
+        return 0.0
+
+    def _has_room(self, priority: str) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        if priority == "batch":
+            # Keep part of the limit free for interactive/standard work
+            return self.in_flight_by_priority["batch"] < max(1, int(self.limit * RATE_LIMIT_BATCH_MAX_SHARE))
+        return True
+
+    def _start(self, priority: str) -> None:
+        if self.rate_per_second > 0:
+            self._tokens -= 1
+        self.in_flight += 1
+        self.in_flight_by_priority[priority] += 1
+
+    def _schedule(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        at = loop.time() + delay
+        if self._timer is not None and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = at
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._timer_at = math.inf
+        self._dispatch()
+
+    def _next_priority(self, now: float) -> Optional[str]:
+        """
+        Weighted pick among the queue heads that have room: the class weight,
+        boosted by how long its head has waited (aging), so batch work is
+        overtaken by interactive turns but never starves.
+        """
+        best, best_score = None, -1.0
+        for priority, queue in self._waiters.items():
+            if not queue or not self._has_room(priority):
+                continue
+            waited = now - queue[0][1]
+            score = PRIORITY_WEIGHTS[priority] * (1 + waited / RATE_LIMIT_AGING_SECONDS)
+            if score > best_score:
+                best, best_score = priority, score
+        return best
+
+    def _dispatch(self) -> None:
+        """Hand free slots to queued callers, highest effective priority first."""
+        now = time.monotonic()
+        for priority, queue in self._waiters.items():
+            while queue and (queue[0][0].done() or queue[0][2] <= now):
+                future, _, _ = queue.popleft()
+                if not future.done():
+                    future.set_exception(ProviderOverloaded(self.name, "queue deadline exceeded"))
+        while True:
+            priority = self._next_priority(now)
+            if priority is None:
+                break
+            wait = self._wait_needed(now)
+            if wait > 0:
+                self._schedule(wait)
+                break
+            future, enqueued_at, _ = self._waiters[priority].popleft()
+            if future.done():
+                continue
+            self._start(priority)
+            future.set_result(None)
+        self._publish()
+
+    async def acquire(self, timeout: Optional[float] = None, priority: Optional[str] = None) -> float:
+        """Wait for a slot; returns the seconds spent queued."""
+        priority = priority if priority in PRIORITY_WEIGHTS else current_priority()
+        now = time.monotonic()
+        if not self.queue_depth and self._has_room(priority) and self._wait_needed(now) == 0:
+            self._start(priority)
+            self._publish()
+            return 0.0
+
+        if self.queue_depth >= self.max_queue:
+            metrics.inc("rate_limit_rejected_total", limiter=self.name, reason="queue_full", priority=priority)
+            raise ProviderOverloaded(self.name, f"{self.queue_depth} calls already queued")
+
+        timeout = self.queue_timeout if timeout is None else timeout
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, now, now + timeout)
+        self._waiters[priority].append(entry)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._forget(priority, entry)
+            metrics.inc("rate_limit_rejected_total", limiter=self.name, reason="deadline", priority=priority)
+            raise ProviderOverloaded(self.name, f"no slot within {timeout:.1f}s") from None
+        except ProviderOverloaded:
+            metrics.inc("rate_limit_rejected_total", limiter=self.name, reason="deadline", priority=priority)
+            raise
+        except asyncio.CancelledError:
+            self._forget(priority, entry)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # The slot was granted just as the caller was cancelled
+                self.release(priority=priority)
+            raise
+        waited = time.monotonic() - now
+        metrics.observe("rate_limit_wait_seconds", waited, limiter=self.name, priority=priority)
+        return waited
+
+    def _forget(self, priority: str, entry: Tuple[asyncio.Future, float, float]) -> None:
+        try:
+            self._waiters[priority].remove(entry)
+        except ValueError:
+            pass
+        self._publish()
+
+    def release(
+        self,
+        latency: Optional[float] = None,
+        throttled: bool = False,
+        retry_after: Optional[float] = None,
+        priority: str = "standard",
+    ) -> None:
+        """Return a slot, feeding the outcome of the call into the AIMD limit."""
+        self.in_flight = max(0, self.in_flight - 1)
+        self.in_flight_by_priority[priority] = max(0, self.in_flight_by_priority.get(priority, 0) - 1)
+        if throttled:
+            self._on_throttle(retry_after)
+        elif latency is not None:
+            self._on_success(latency)
+        self._dispatch()
+
+    def _decrease(self, factor: float) -> bool:
+        now = time.monotonic()
+        if now - self._last_decrease < RATE_LIMIT_DECREASE_COOLDOWN_SECONDS:
+            return False
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        return True
+
+    def _on_success(self, latency: float) -> None:
+        self._throttle_streak = 0
+        if self.latency_target and latency > self.latency_target:
+            if self._decrease(0.9):
+                metrics.inc("rate_limit_slow_decreases_total", limiter=self.name)
+            return
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _on_throttle(self, retry_after: Optional[float]) -> None:
+        self._throttle_streak += 1
+        metrics.inc("rate_limit_throttled_total", limiter=self.name)
+        self._decrease(0.5)
+        backoff = retry_after if retry_after is not None else 0.5 * 2 ** (self._throttle_streak - 1)
+        self._blocked_until = max(self._blocked_until, time.monotonic() + min(backoff, RATE_LIMIT_MAX_BACKOFF_SECONDS))
+        self._tokens = min(self._tokens, 0)
+        print(f"[RateLimit] 🚦 {self.name} throttled; limit -> {self.limit:.1f}, pausing {min(backoff, RATE_LIMIT_MAX_BACKOFF_SECONDS):.1f}s")
+
+    def _publish(self) -> None:
+        for priority, queue in self._waiters.items():
+            metrics.set_gauge("rate_limit_queue_depth", len(queue), limiter=self.name, priority=priority)
+            metrics.set_gauge("rate_limit_in_flight", self.in_flight_by_priority[priority], limiter=self.name, priority=priority)
+        metrics.set_gauge("rate_limit_concurrency", round(self.limit, 2), limiter=self.name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": dict(self.in_flight_by_priority),
+            "queue_depth": {priority: len(queue) for priority, queue in self._waiters.items()},
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+            "rate_per_second": self.rate_per_second or None,
+        }
+
+
+class LimiterSlot:
+    """Outcome reporting for a call made under `limiters.slot()`."""
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+        self.throttled = False
+        self.retry_after: Optional[float] = None
+
+    def first_byte(self) -> None:
+        """Mark time-to-first-byte, the latency fed to AIMD (defaults to the full call)."""
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def mark_throttled(self, retry_after: Optional[float] = None) -> None:
+        self.throttled = True
+        self.retry_after = retry_after
+
+
+class LimiterRegistry:
+    """One AdaptiveLimiter per (provider, model), created on first use."""
+
+    def __init__(self):
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, provider: str, model: Optional[str] = None) -> AdaptiveLimiter:
+        name = f"{provider}:{model}" if model else provider
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = self._limiters[name] = AdaptiveLimiter(name, **provider_config(provider))
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: Optional[str] = None, timeout: Optional[float] = None) -> AsyncIterator[LimiterSlot]:
+        """
+        Hold a provider slot for the duration of the block. Exceptions that look
+        like a 429 are reported as throttles; other outcomes as the call latency.
+        """
+        if not RATE_LIMIT_ENABLED:
+            yield LimiterSlot(self.get(provider, model))
+            return
+        limiter = self.get(provider, model)
+        priority = current_priority()
+        await limiter.acquire(timeout, priority)
+        slot = LimiterSlot(limiter)
+        try:
+            yield slot
+        except BaseException as exc:
+            if not slot.throttled and isinstance(exc, Exception) and is_rate_limit_error(exc):
+                slot.mark_throttled()
+            limiter.release(None, slot.throttled, slot.retry_after, priority)
+            raise
+        slot.first_byte()
+        limiter.release(slot.latency, slot.throttled, slot.retry_after, priority)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: limiter.snapshot() for name, limiter in sorted(self._limiters.items())}
+
+
+limiters = LimiterRegistry()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body wrapper that returns the slot when the body is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that runs every request under the limiter for its provider
+    (from the host, or fixed) and model (from the JSON body). The slot is held
+    until the response body is closed, so streamed completions count against
+    concurrency for their whole duration. AIMD sees time-to-first-byte.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, provider: Optional[str] = None):
+        self._transport = transport
+        self.provider = provider
+
+    @staticmethod
+    def _model(request: httpx.Request) -> Optional[str]:
+        try:
+            match = _MODEL_FIELD_RE.search(request.content[:4096])
+        except httpx.RequestNotRead:
+            return None
+        return match.group(1).decode("utf-8", "replace") if match else None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not RATE_LIMIT_ENABLED:
+            return await self._transport.handle_async_request(request)
+
+        limiter = limiters.get(self.provider or provider_for_host(request.url.host), self._model(request))
+        priority = current_priority()
+        await limiter.acquire(priority=priority)
+        started = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            limiter.release(priority=priority)
+            raise
+        latency = time.monotonic() - started
+
+        if response.status_code in _RATE_LIMIT_STATUSES:
+            retry_after = _retry_after_seconds(response.headers.get("retry-after"))
+            limiter.release(latency, throttled=True, retry_after=retry_after, priority=priority)
+            return response
+
+        if isinstance(response.stream, httpx.ByteStream):
+            # Body already in memory; nothing left to hold the slot for
+            limiter.release(latency, priority=priority)
+            return response
+        response.stream = _ReleasingStream(response.stream, lambda: limiter.release(latency, priority=priority))
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def limited_async_client(provider: Optional[str] = None, **client_kwargs: Any) -> httpx.AsyncClient:
+    """httpx.AsyncClient whose requests pass through the provider limiters."""
+    transport_kwargs = {
+        key: client_kwargs.pop(key) for key in ("http2", "limits", "verify", "retries") if key in client_kwargs
+    }
+    transport = RateLimitedTransport(httpx.AsyncHTTPTransport(**transport_kwargs), provider)
+    return httpx.AsyncClient(transport=transport, **client_kwargs)
+
@@ -4,9 +4,13 @@ Provides a reusable function for generating images using Replicate's Flux model.
 """
 import os
 import replicate
-import asyncio
 from dotenv import load_dotenv
 
+try:
+    from backend.rate_limiter import is_rate_limit_error, limiters
+except ImportError:
+    from rate_limiter import is_rate_limit_error, limiters
+
 load_dotenv()
 
 DEFAULT_MODEL = "black-forest-labs/flux-schnell"
@@ -29,22 +33,26 @@ async def generate_image_with_replicate(
     print(f"   Using Model: {model}")
     print(f"   Prompt: {prompt[:200]}...")
     output = None
-    current_delay = retry_delay
     
     for attempt in range(max_retries):
         try:
-            output = await replicate.async_run(
-                model,
-                input={"prompt": prompt}
-            )
+            # The Replicate limiter paces retries: a 429 pauses the provider
+            # (shared with every other Replicate call) before the next slot.
+            async with limiters.slot("replicate", model) as slot:
+                try:
+                    output = await replicate.async_run(
+                        model,
+                        input={"prompt": prompt}
+                    )
+                except Exception as e:
+                    if is_rate_limit_error(e):
+                        slot.mark_throttled(retry_delay * 2 ** attempt)
+                    raise
             break
         except Exception as e:
-            error_str = str(e).lower()
-            if "429" in error_str or "throttled" in error_str or "rate limit" in error_str:
+            if is_rate_limit_error(e):
                 if attempt < max_retries - 1:
-                    print(f"⚠️ Rate limit hit. Retrying in {current_delay}s... (Attempt {attempt+1}/{max_retries})")
-                    await asyncio.sleep(current_delay)
-                    current_delay *= 2  
+                    print(f"⚠️ Rate limit hit. Retrying after provider backoff... (Attempt {attempt+1}/{max_retries})")
                 else:
                     print("❌ Rate limit retries exhausted.")
                     raise e
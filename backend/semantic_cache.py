@@ -0,0 +1,175 @@
+"""
+Semantic answer cache for the student AI tutor.
+
+Answers to generic curriculum questions are stored with the embedding of the
+question, scoped by (KB collection, language, grade). A later question in the
+same scope whose embedding has cosine similarity >= SEMANTIC_CACHE_THRESHOLD
+with a stored one is answered from the cache, skipping KB retrieval and the
+LLM call. Only self-contained questions qualify: anything that refers to the
+student's own assignments, scores or uploaded documents, or leans on the
+previous turn ("explain it again"), always goes to the model.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from backend.metrics import metrics
+except ImportError:
+    from metrics import metrics
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "21600"))
+SEMANTIC_CACHE_MAX_PER_SCOPE = int(os.getenv("SEMANTIC_CACHE_MAX_PER_SCOPE", "512"))
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "256"))
+
+Scope = Tuple[str, str, str]
+
+# Personal data, uploaded material, or a dependency on earlier turns
+_NON_GENERIC_RE = re.compile(
+    r"\b(?:my|mine|i|i'm|i've|our|we|assignments?|homework|due|deadline|score[sd]?|marks?|"
+    r"test results?|uploaded|upload|documents?|docs?|pdf|files?|attached|attachment|"
+    r"it|this|that|these|those|they|them|above|previous|again|more|continue|same)\b",
+    re.I,
+)
+_MIN_QUERY_WORDS = 2
+
+
+def is_generic_query(query: str) -> bool:
+    """True for self-contained questions that don't depend on who is asking."""
+    if not query:
+        return False
+    words = query.split()
+    if len(words) < _MIN_QUERY_WORDS or len(query) > 300:
+        return False
+    return _NON_GENERIC_RE.search(query) is None
+
+
+class _ScopeEntries:
+    __slots__ = ("vectors", "queries", "answers", "expires_at")
+
+    def __init__(self):
+        self.vectors: Optional[np.ndarray] = None
+        self.queries: List[str] = []
+        self.answers: List[str] = []
+        self.expires_at: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.answers)
+
+    def drop(self, keep: np.ndarray) -> None:
+        self.vectors = self.vectors[keep] if self.vectors is not None and keep.any() else None
+        indexes = np.flatnonzero(keep).tolist()
+        self.queries = [self.queries[i] for i in indexes]
+        self.answers = [self.answers[i] for i in indexes]
+        self.expires_at = [self.expires_at[i] for i in indexes]
+
+
+class SemanticAnswerCache:
+    """Per-scope matrices of unit-normalized query embeddings with their answers."""
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+        max_per_scope: int = SEMANTIC_CACHE_MAX_PER_SCOPE,
+        max_scopes: int = SEMANTIC_CACHE_MAX_SCOPES,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_per_scope = max_per_scope
+        self.max_scopes = max_scopes
+        self._scopes: "OrderedDict[Scope, _ScopeEntries]" = OrderedDict()
+
+    @staticmethod
+    def scope(collection_name: str, language: str, grade: Any) -> Scope:
+        return (collection_name, str(language).lower(), str(grade).lower())
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm else None
+
+    def _expire(self, entries: _ScopeEntries) -> None:
+        now = time.time()
+        if entries.expires_at and min(entries.expires_at) < now:
+            entries.drop(np.asarray(entries.expires_at) >= now)
+
+    def lookup(self, scope: Scope, vector: Sequence[float]) -> Optional[Tuple[str, float, str]]:
+        """(answer, similarity, cached query) of the closest entry above the threshold."""
+        metrics.inc("semantic_cache_lookups_total")
+        entries = self._scopes.get(scope)
+        query = self._normalize(vector)
+        if entries is not None and query is not None:
+            self._scopes.move_to_end(scope)
+            self._expire(entries)
+            if entries.vectors is not None and entries.vectors.shape[1] == query.shape[0]:
+                similarities = entries.vectors @ query
+                best = int(np.argmax(similarities))
+                score = float(similarities[best])
+                if score >= self.threshold:
+                    metrics.inc("semantic_cache_hits_total")
+                    metrics.observe("semantic_cache_hit_similarity", score)
+                    return entries.answers[best], score, entries.queries[best]
+        metrics.inc("semantic_cache_misses_total")
+        return None
+
+    def store(self, scope: Scope, vector: Sequence[float], query: str, answer: str) -> None:
+        normalized = self._normalize(vector)
+        if normalized is None or not answer:
+            return
+        entries = self._scopes.get(scope)
+        if entries is None:
+            entries = self._scopes[scope] = _ScopeEntries()
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+        self._scopes.move_to_end(scope)
+        self._expire(entries)
+
+        if entries.vectors is not None and entries.vectors.shape[1] != normalized.shape[0]:
+            # Embedding model changed; start the scope over
+            entries = self._scopes[scope] = _ScopeEntries()
+        if len(entries) >= self.max_per_scope:
+            # Oldest entries first; expiry times are increasing within a scope
+            keep = np.ones(len(entries), dtype=bool)
+            keep[: len(entries) - self.max_per_scope + 1] = False
+            entries.drop(keep)
+
+        row = normalized[np.newaxis, :]
+        entries.vectors = row if entries.vectors is None else np.vstack([entries.vectors, row])
+        entries.queries.append(query)
+        entries.answers.append(answer)
+        entries.expires_at.append(time.time() + self.ttl_seconds)
+        metrics.inc("semantic_cache_stores_total")
+        metrics.set_gauge("semantic_cache_entries", self.size())
+
+    def size(self) -> int:
+        return sum(len(entries) for entries in self._scopes.values())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = metrics.counter("semantic_cache_lookups_total")
+        hits = metrics.counter("semantic_cache_hits_total")
+        return {
+            "entries": self.size(),
+            "scopes": len(self._scopes),
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "threshold": self.threshold,
+        }
+
+    def purge(self, collection_name: Optional[str] = None) -> int:
+        """Drop every entry, or only those scoped to `collection_name`."""
+        scopes = [s for s in self._scopes if collection_name is None or s[0] == collection_name]
+        purged = sum(len(self._scopes.pop(s)) for s in scopes)
+        metrics.set_gauge("semantic_cache_entries", self.size())
+        return purged
+
+
+semantic_answer_cache = SemanticAnswerCache()
@@ -0,0 +1,237 @@
+"""
+Speculative node execution while the LLM router decides.
+
+When a turn needs the analyze_query LLM call, the orchestrator starts the
+most likely node right away (`start_speculation`) with a chunk callback that
+holds its stream back. Once the router returns, `resolve_speculation` either
+confirms it, releasing the held chunks to the client and letting the graph
+pick up the node's result instead of running the node again, or cancels it.
+Time to first token on a hit drops to roughly the node's own latency.
+
+Nodes take part by being wrapped with `speculative_node` in the graph
+definition. Speculation is off by default (SPECULATIVE_ROUTING_ENABLED) and
+limited to SPECULATIVE_ROUTES; websearch and image are left out by default
+because a miss there costs a paid search or generation, not just tokens.
+
+Per audience, speculation_hit_rate is the fraction of speculations the
+router confirmed, and speculation_wasted_token_ratio is the share of
+speculatively generated output tokens that were thrown away.
+"""
+import asyncio
+import os
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+try:
+    from backend.intent_router import intent_guess
+    from backend.metrics import metrics
+    from backend.token_budget import count_tokens
+except ImportError:
+    from intent_router import intent_guess
+    from metrics import metrics
+    from token_budget import count_tokens
+
+SPECULATIVE_ROUTING_ENABLED = os.getenv("SPECULATIVE_ROUTING_ENABLED", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_ROUTES = {
+    route.strip() for route in os.getenv("SPECULATIVE_ROUTES", "simple_llm,rag").split(",") if route.strip()
+}
+
+# Keys the orchestrator owns; a confirmed result keeps the orchestrator's values
+_ROUTING_KEYS = (
+    "tasks", "task_index", "current_task", "route", "next_node", "resolved_query",
+    "context", "img_urls", "chunk_callback", "speculation",
+)
+
+_NODES: Dict[tuple, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {}
+
+
+class HeldStream:
+    """
+    chunk_callback stand-in for a speculative node: chunks are kept until
+    `release`, then replayed in order to the real callback and passed through.
+    """
+
+    __slots__ = ("_target", "_parts", "_released", "_replaying")
+
+    def __init__(self, target: Optional[Callable[[str], Awaitable[None]]]):
+        self._target = target
+        self._parts: List[str] = []
+        self._released = False
+        self._replaying = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    async def __call__(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        # While replaying, the replay loop picks the chunk up to keep order
+        if self._released and not self._replaying and self._target:
+            await self._target(chunk)
+
+    async def release(self) -> None:
+        self._released = True
+        if not self._target:
+            return
+        self._replaying = True
+        try:
+            sent = 0
+            while sent < len(self._parts):
+                await self._target(self._parts[sent])
+                sent += 1
+        finally:
+            self._replaying = False
+
+
+class Speculation:
+    """A node started ahead of the routing decision."""
+
+    __slots__ = ("audience", "route", "task", "stream", "started", "confirmed")
+
+    def __init__(self, audience: str, route: str, task: asyncio.Task, stream: HeldStream):
+        self.audience = audience
+        self.route = route
+        self.task = task
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.confirmed = False
+
+    def cancel(self) -> None:
+        if not self.task.done():
+            self.task.cancel()
+
+
+def speculative_node(audience: str, name: str, node: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]):
+    """Register `node` for speculation and return it wrapped to use a confirmed speculative result."""
+    _NODES[(audience, name)] = node
+
+    @wraps(node)
+    async def run(state: Dict[str, Any]) -> Dict[str, Any]:
+        speculation = state.get("speculation")
+        if speculation is None or not speculation.confirmed or speculation.route != name:
+            return await node(state)
+        state["speculation"] = None
+        result = await speculation.task
+        merged = dict(result)
+        for key in _ROUTING_KEYS:
+            merged[key] = state.get(key)
+        usage = state.get("token_usage") or {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        for key, value in (result.get("token_usage") or {}).items():
+            usage[key] = usage.get(key, 0) + value
+        merged["token_usage"] = usage
+        _record(speculation.audience, "speculation_tokens_total", count_tokens(speculation.stream.text))
+        return merged
+
+    return run
+
+
+def _record(audience: str, counter: str, tokens: int) -> None:
+    metrics.inc(counter, tokens, audience=audience)
+    generated = metrics.counter("speculation_tokens_total", audience=audience) + metrics.counter(
+        "speculation_wasted_tokens_total", audience=audience
+    )
+    if generated:
+        wasted = metrics.counter("speculation_wasted_tokens_total", audience=audience)
+        metrics.set_gauge("speculation_wasted_token_ratio", wasted / generated, audience=audience)
+
+
+def start_speculation(audience: str, state: Dict[str, Any], candidates: Sequence[Optional[str]]) -> Optional[Speculation]:
+    """
+    Start the first of `candidates` (graph node names, most likely first) that
+    may be speculated, on a copy of `state` routed as a single-step plan.
+    """
+    if not SPECULATIVE_ROUTING_ENABLED:
+        return None
+    route = next((c for c in candidates if c in SPECULATIVE_ROUTES and (audience, c) in _NODES), None)
+    if route is None:
+        return None
+
+    stream = HeldStream(state.get("chunk_callback"))
+    spec_state = dict(state)
+    spec_state.update(
+        chunk_callback=stream,
+        token_usage={"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
+        tasks=[route],
+        task_index=0,
+        current_task=route,
+        route=route,
+        next_node=route,
+        resolved_query=state.get("user_query"),
+        img_urls=[],
+        speculation=None,
+    )
+    task = asyncio.create_task(_NODES[(audience, route)](spec_state))
+    metrics.inc("speculation_started_total", audience=audience, route=route)
+    print(f"[Speculation] 🔮 {audience}: started {route} while the router decides")
+    return Speculation(audience, route, task, stream)
+
+
+async def speculate(
+    audience: str,
+    state: Dict[str, Any],
+    last_route: Optional[str],
+    normalize: Callable[[str], str],
+    has_documents: bool = False,
+) -> Optional[Speculation]:
+    """
+    Predict the route for the current turn and start it. A fresh document
+    upload predicts RAG (the orchestrators force it), then the intent router's
+    best guess, then the previous route, then simple_llm. Turns involving
+    images are never speculated.
+    """
+    if not SPECULATIVE_ROUTING_ENABLED or state.get("is_image") or state.get("edit_img_urls"):
+        return None
+    guess = await intent_guess(state.get("user_query") or "", has_documents=has_documents)
+    return start_speculation(
+        audience,
+        state,
+        [
+            "rag" if state.get("uploaded_doc") else None,
+            normalize(guess) if guess else None,
+            normalize(last_route) if last_route else None,
+            "simple_llm",
+        ],
+    )
+
+
+def cancel_speculation(speculation: Optional[Speculation]) -> None:
+    if speculation is not None:
+        speculation.cancel()
+
+
+async def resolve_speculation(speculation: Optional[Speculation], route: str) -> Optional[Speculation]:
+    """
+    Confirm `speculation` if the router chose its route (returned, to be put
+    in state["speculation"]), otherwise cancel it and return None.
+    """
+    if speculation is None:
+        return None
+    audience = speculation.audience
+    head_start = time.perf_counter() - speculation.started
+    task = speculation.task
+    failed = task.done() and (task.cancelled() or task.exception() is not None)
+    hit = route == speculation.route and not failed
+    metrics.inc("speculation_resolved_total", audience=audience)
+    if hit:
+        speculation.confirmed = True
+        metrics.inc("speculation_hits_total", audience=audience, route=speculation.route)
+        metrics.observe("speculation_head_start_seconds", head_start, audience=audience)
+        await speculation.stream.release()
+    else:
+        speculation.cancel()
+        metrics.inc("speculation_misses_total", audience=audience, route=speculation.route)
+        _record(audience, "speculation_wasted_tokens_total", count_tokens(speculation.stream.text))
+
+    resolved = metrics.counter("speculation_resolved_total", audience=audience)
+    hits = sum(
+        metrics.counter("speculation_hits_total", audience=audience, route=r) for r in SPECULATIVE_ROUTES
+    )
+    metrics.set_gauge("speculation_hit_rate", hits / resolved, audience=audience)
+    print(
+        f"[Speculation] {'✅ hit' if hit else '❌ miss'} {audience}: speculated {speculation.route}, "
+        f"router chose {route} after {head_start:.2f}s (hit rate {hits / resolved:.0%} over {int(resolved)})"
+    )
+    return speculation if hit else None
@@ -0,0 +1,589 @@
+"""
+SSE streaming helpers shared by the streaming endpoints.
+
+LLM chunk callbacks fire once per token. `ChunkCoalescer` sits between
+`stream_with_token_tracking` and the SSE writer and batches those tokens into
+one content frame every `interval_ms` milliseconds or `max_chars` characters,
+whichever comes first, so a fast model produces tens of frames per answer
+instead of thousands (one queue put, one json.dumps and one socket write each).
+
+Two wire protocols are supported, negotiated per request:
+
+* v1 (default): every content frame carries the new `chunk` plus the whole
+  `full_response` so far, which is O(n^2) bytes over a response.
+* v2: `delta` frames carry only the new text with a sequence number. Every
+  STREAM_CHECKPOINT_EVERY deltas a `checkpoint` frame reports the total length
+  and the CRC32 of the UTF-8 text so far so the client can verify what it
+  assembled. The final `content` frame (is_complete) repeats the checkpoint
+  and only includes `full_response` when it differs from the streamed text.
+
+Every stream is a `ReplayStream` registered in `stream_registry`: emitted
+events get increasing SSE ids and are kept in a bounded replay buffer, so a
+client that drops the connection can reattach with `Last-Event-ID` to the
+still-running generation, or replay a finished one, without re-running it.
+
+Identical concurrent generation requests share one stream (singleflight):
+the first request registers its stream under a canonical hash of (endpoint,
+payload) and later requests with the same key subscribe to it from event 0,
+so they receive the buffered prefix followed by the live tail.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zlib
+from collections import deque
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+try:
+    from backend.metrics import metrics
+except ImportError:
+    from metrics import metrics
+
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", "50"))
+STREAM_FLUSH_MAX_CHARS = int(os.getenv("STREAM_FLUSH_MAX_CHARS", "256"))
+STREAM_CHECKPOINT_EVERY = int(os.getenv("STREAM_CHECKPOINT_EVERY", "32"))
+STREAM_DISCONNECT_POLL_SECONDS = float(os.getenv("STREAM_DISCONNECT_POLL_SECONDS", "0.5"))
+STREAM_REPLAY_MAX_EVENTS = int(os.getenv("STREAM_REPLAY_MAX_EVENTS", "4096"))
+STREAM_REPLAY_TTL_SECONDS = int(os.getenv("STREAM_REPLAY_TTL_SECONDS", "300"))
+# How long a running stream without any attached client is kept alive for a reconnect
+STREAM_RESUME_GRACE_SECONDS = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "20"))
+STREAM_SINGLEFLIGHT = os.getenv("STREAM_SINGLEFLIGHT", "true").lower() in ("1", "true", "yes")
+
+STREAM_PROTOCOL_LEGACY = 1
+STREAM_PROTOCOL_DELTA = 2
+STREAM_PROTOCOL_HEADER = "X-Stream-Protocol"
+
+# Per-endpoint defaults (interval_ms, max_chars). Chat keeps frames small so
+# typing stays smooth; long-form generation can batch more aggressively.
+# Override with STREAM_FLUSH_INTERVAL_MS_<ENDPOINT> / STREAM_FLUSH_MAX_CHARS_<ENDPOINT>.
+STREAM_ENDPOINT_DEFAULTS: Dict[str, Tuple[int, int]] = {
+    "chat": (40, 160),
+    "content": (80, 512),
+    "web_search": (80, 512),
+    "assessment": (80, 512),
+}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(payload: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """Encode one SSE `data:` frame, with an `id:` line when `event_id` is given."""
+    if event_id is None:
+        return f"data: {json.dumps(payload)}\n\n"
+    return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+
+def parse_last_event_id(request) -> int:
+    """Last event id seen by a reconnecting client (header or query param)."""
+    value = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+    try:
+        return max(0, int(value)) if value else 0
+    except ValueError:
+        return 0
+
+
+def coalesce_settings(endpoint: str) -> Tuple[int, int]:
+    """Flush interval (ms) and size threshold (chars) for an endpoint."""
+    interval_ms, max_chars = STREAM_ENDPOINT_DEFAULTS.get(
+        endpoint, (STREAM_FLUSH_INTERVAL_MS, STREAM_FLUSH_MAX_CHARS)
+    )
+    key = endpoint.upper()
+    return (
+        int(os.getenv(f"STREAM_FLUSH_INTERVAL_MS_{key}", interval_ms)),
+        int(os.getenv(f"STREAM_FLUSH_MAX_CHARS_{key}", max_chars)),
+    )
+
+
+class ChunkCoalescer:
+    """
+    Chunk callback that batches streamed text before handing it to `on_flush`.
+
+    Use the instance itself as `chunk_callback`. Pending text is flushed when it
+    reaches `max_chars`, or by a timer `interval_ms` after the first pending
+    chunk, so a stalled model never holds text back. The first chunk of a
+    response is flushed immediately to keep time-to-first-token unchanged.
+    Call `close()` once the producer is done to flush the remainder.
+
+    Args:
+        on_flush: Called with (chunk, full_response) for every batch.
+        interval_ms: Maximum time text may sit in the buffer.
+        max_chars: Flush as soon as this many characters are pending.
+    """
+
+    def __init__(
+        self,
+        on_flush: Callable[[str, str], None],
+        interval_ms: int = STREAM_FLUSH_INTERVAL_MS,
+        max_chars: int = STREAM_FLUSH_MAX_CHARS,
+        flush_first: bool = True,
+    ):
+        self.on_flush = on_flush
+        self.interval = max(interval_ms, 0) / 1000.0
+        self.max_chars = max(max_chars, 1)
+        self._flush_first = flush_first
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._text_cache: Optional[str] = ""
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.chunks_received = 0
+        self.frames_sent = 0
+
+    @classmethod
+    def for_endpoint(cls, endpoint: str, on_flush: Callable[[str, str], None], **kwargs) -> "ChunkCoalescer":
+        interval_ms, max_chars = coalesce_settings(endpoint)
+        return cls(on_flush, interval_ms=interval_ms, max_chars=max_chars, **kwargs)
+
+    @property
+    def text(self) -> str:
+        """Everything received so far, including text not yet flushed."""
+        if self._text_cache is None:
+            self._text_cache = "".join(self._parts)
+        return self._text_cache
+
+    async def __call__(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self.chunks_received += 1
+        self._parts.append(chunk)
+        self._text_cache = None
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+
+        if self._flush_first or self._pending_chars >= self.max_chars or self.interval == 0:
+            self._flush_first = False
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        chunk = "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        self.frames_sent += 1
+        self.on_flush(chunk, self.text)
+
+    def close(self) -> None:
+        """Flush whatever is still buffered and stop the timer."""
+        self.flush()
+
+
+def negotiate_stream_protocol(request) -> int:
+    """
+    Stream protocol requested by the client, via the `stream_protocol` query
+    parameter or the X-Stream-Protocol header ("2" or "v2"). Defaults to v1.
+    """
+    requested = request.query_params.get("stream_protocol") or request.headers.get(STREAM_PROTOCOL_HEADER)
+    if requested and requested.strip().lower().lstrip("v") == str(STREAM_PROTOCOL_DELTA):
+        return STREAM_PROTOCOL_DELTA
+    return STREAM_PROTOCOL_LEGACY
+
+
+class StreamEncoder:
+    """
+    Builds content frames for one response in the negotiated protocol and
+    pushes them onto the response stream (any object with `put_nowait`).
+    """
+
+    def __init__(
+        self,
+        queue: Any,
+        protocol: int = STREAM_PROTOCOL_LEGACY,
+        checkpoint_every: int = STREAM_CHECKPOINT_EVERY,
+    ):
+        self.queue = queue
+        self.protocol = protocol
+        self.checkpoint_every = max(checkpoint_every, 1)
+        self.seq = 0
+        self.length = 0
+        self.crc32 = 0
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {STREAM_PROTOCOL_HEADER: str(self.protocol)}
+
+    def on_flush(self, chunk: str, full_response: str) -> None:
+        """`ChunkCoalescer` flush target."""
+        if self.protocol == STREAM_PROTOCOL_LEGACY:
+            if isinstance(self.queue, ReplayStream):
+                # Rebuilds `full_response` per frame as it is sent
+                self.queue.put_content_chunk(chunk)
+                return
+            self.queue.put_nowait(
+                {
+                    "type": "content",
+                    "data": {
+                        "chunk": chunk,
+                        "full_response": full_response,
+                        "is_complete": False,
+                    },
+                }
+            )
+            return
+
+        self.seq += 1
+        self.length += len(chunk)
+        self.crc32 = zlib.crc32(chunk.encode("utf-8"), self.crc32)
+        self.queue.put_nowait({"type": "delta", "data": {"seq": self.seq, "delta": chunk}})
+        if self.seq % self.checkpoint_every == 0:
+            self.queue.put_nowait({"type": "checkpoint", "data": self._checkpoint()})
+
+    def complete(self, full_response: str, streamed_text: str = "", **extra: Any) -> Dict[str, Any]:
+        """
+        Final content frame. v1 always carries `full_response`; v2 only when
+        it differs from what was streamed (e.g. a node rewrote the answer).
+        """
+        if self.protocol == STREAM_PROTOCOL_LEGACY:
+            data = {"is_complete": True, "full_response": full_response}
+        else:
+            data = {"is_complete": True, **self._checkpoint()}
+            if full_response != streamed_text:
+                data["full_response"] = full_response
+        data.update(extra)
+        return {"type": "content", "data": data}
+
+    def _checkpoint(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "length": self.length, "crc32": self.crc32}
+
+
+class _ContentChunk:
+    """A buffered v1 content frame: its chunk and the response length after it."""
+
+    __slots__ = ("chunk", "length")
+
+    def __init__(self, chunk: str, length: int):
+        self.chunk = chunk
+        self.length = length
+
+
+class ReplayStream:
+    """
+    Event log for one streamed response with live fan-out to subscribers.
+
+    Producers use the asyncio.Queue-style `put`/`put_nowait`, where `None`
+    closes the stream. Each event gets the next integer id; the newest
+    `max_events` are kept so subscribers can start after any recent id.
+    `on_idle` is called whenever the last subscriber leaves an open stream.
+
+    v1 content frames are added with `put_content_chunk`: the stream keeps
+    the response text once and each buffered frame only its chunk and an
+    offset, and the frame's cumulative `full_response` is rebuilt when it is
+    sent, so memory grows linearly with the answer rather than quadratically.
+
+    `owners` are the (teacher_id or student_id, session_id) pairs allowed to
+    resume the stream; singleflight joiners are added with `add_owner`.
+    """
+
+    def __init__(self, stream_id: str, owner: Optional[Dict[str, Any]] = None, max_events: int = STREAM_REPLAY_MAX_EVENTS):
+        self.stream_id = stream_id
+        self.owner = owner or {}
+        self.owners: Set[Tuple[Any, Any]] = set()
+        self.add_owner(self.owner)
+        self._text_parts: List[str] = []
+        self._text_length = 0
+        self._text_cache: Optional[str] = ""
+        self.headers: Dict[str, str] = {"X-Stream-Id": stream_id}
+        self.events: deque = deque(maxlen=max_events)
+        self.last_event_id = 0
+        self.closed = False
+        self.closed_at: Optional[float] = None
+        self.subscribers = 0
+        self.on_idle: Optional[Callable[[], None]] = None
+        self._waiters: Set[asyncio.Event] = set()
+
+    def put_nowait(self, item: Optional[Dict[str, Any]]) -> None:
+        if item is None:
+            self.close()
+            return
+        if self.closed:
+            return
+        self.last_event_id += 1
+        self.events.append((self.last_event_id, item))
+        self._wake()
+
+    async def put(self, item: Optional[Dict[str, Any]]) -> None:
+        self.put_nowait(item)
+
+    def put_content_chunk(self, chunk: str) -> None:
+        """Add a v1 content frame (`chunk` plus the cumulative `full_response`)."""
+        if self.closed:
+            return
+        self._text_parts.append(chunk)
+        self._text_length += len(chunk)
+        self._text_cache = None
+        self.last_event_id += 1
+        self.events.append((self.last_event_id, _ContentChunk(chunk, self._text_length)))
+        self._wake()
+
+    def _materialize(self, item: Any) -> Dict[str, Any]:
+        if not isinstance(item, _ContentChunk):
+            return item
+        if self._text_cache is None:
+            self._text_cache = "".join(self._text_parts)
+        return {
+            "type": "content",
+            "data": {"chunk": item.chunk, "full_response": self._text_cache[: item.length], "is_complete": False},
+        }
+
+    def add_owner(self, owner: Dict[str, Any]) -> None:
+        owner_id = owner.get("teacher_id") or owner.get("student_id")
+        if owner_id:
+            self.owners.add((owner_id, owner.get("session_id")))
+
+    def is_owned_by(self, owner_id: str, session_id: str) -> bool:
+        return (owner_id, session_id) in self.owners
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.closed_at = time.time()
+        self._wake()
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            waiter.set()
+
+    def _events_after(self, cursor: int) -> List[Tuple[int, Dict[str, Any]]]:
+        if not self.events:
+            return []
+        first_id = self.events[0][0]
+        return list(islice(self.events, max(0, cursor - first_id + 1), None))
+
+    async def subscribe(
+        self, last_event_id: int = 0, idle_timeout: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Yield (event_id, event) for every event after `last_event_id`, then
+        live events until the stream closes. Raises asyncio.TimeoutError if
+        nothing arrives for `idle_timeout` seconds.
+        """
+        self.subscribers += 1
+        waiter = asyncio.Event()
+        self._waiters.add(waiter)
+        cursor = last_event_id
+        try:
+            while True:
+                if self.events and cursor + 1 < self.events[0][0]:
+                    # The client is further behind than the replay buffer reaches
+                    missed_to = self.events[0][0] - 1
+                    yield missed_to, {"type": "replay_gap", "data": {"from": cursor + 1, "to": missed_to}}
+                    cursor = missed_to
+                for event_id, item in self._events_after(cursor):
+                    cursor = event_id
+                    yield event_id, self._materialize(item)
+                if cursor < self.last_event_id:
+                    continue
+                if self.closed:
+                    return
+                waiter.clear()
+                if idle_timeout:
+                    await asyncio.wait_for(waiter.wait(), idle_timeout)
+                else:
+                    await waiter.wait()
+        finally:
+            self._waiters.discard(waiter)
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.closed and self.on_idle is not None:
+                self.on_idle()
+
+
+def singleflight_key(endpoint: str, payload: Any) -> str:
+    """Canonical hash of (endpoint, payload); key order and whitespace don't matter."""
+    canonical = json.dumps([endpoint, payload], sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class StreamRegistry:
+    """
+    Open and recently finished streams, addressable by stream id, plus the
+    in-flight streams addressable by singleflight key.
+    """
+
+    def __init__(self, ttl_seconds: int = STREAM_REPLAY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.streams: Dict[str, ReplayStream] = {}
+        self.flights: Dict[str, ReplayStream] = {}
+
+    def create(self, owner: Optional[Dict[str, Any]] = None, flight_key: Optional[str] = None) -> ReplayStream:
+        self._prune()
+        stream = ReplayStream(str(uuid4()), owner)
+        self.streams[stream.stream_id] = stream
+        if flight_key is not None:
+            self.flights[flight_key] = stream
+        return stream
+
+    def join(self, flight_key: str) -> Optional[ReplayStream]:
+        """The still-running stream registered under `flight_key`, if any."""
+        stream = self.flights.get(flight_key)
+        if stream is None:
+            return None
+        if stream.closed:
+            self.flights.pop(flight_key, None)
+            return None
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ReplayStream]:
+        self._prune()
+        return self.streams.get(stream_id)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            stream_id for stream_id, stream in self.streams.items()
+            if stream.closed and (stream.closed_at or 0) < cutoff
+        ]
+        for stream_id in expired:
+            self.streams.pop(stream_id, None)
+        for flight_key in [key for key, stream in self.flights.items() if stream.closed]:
+            self.flights.pop(flight_key, None)
+
+
+stream_registry = StreamRegistry()
+
+
+async def sse_frames(
+    stream: ReplayStream, last_event_id: int = 0, idle_timeout: Optional[float] = None
+) -> AsyncIterator[str]:
+    """SSE frames (with ids) for a stream, starting after `last_event_id`."""
+    async for event_id, item in stream.subscribe(last_event_id, idle_timeout):
+        yield sse_event(item, event_id)
+
+
+async def shared_sse_frames(stream: ReplayStream, metadata: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    SSE frames for a subscriber joining a stream started by another request.
+
+    Starts from the first event, and rewrites the `metadata` event so it
+    carries this subscriber's own ids (session_id, teacher_id, ...).
+    """
+    async for event_id, item in stream.subscribe(0):
+        if item.get("type") == "metadata":
+            item = {**item, "data": {**item.get("data", {}), **metadata}}
+        yield sse_event(item, event_id)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for metrics."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class DisconnectWatcher:
+    """
+    Cancels the background work behind a stream once its client goes away.
+
+    Polls `request.is_disconnected()` while any watched task is running, and
+    `close()` (call it from the SSE generator's `finally`, which Starlette runs
+    when it aborts a response) releases the stream. A released stream keeps
+    running for `grace_period` seconds so the client can reattach with
+    Last-Event-ID; if nobody is subscribed by then, whatever is still running
+    is cancelled. Cancelling the graph/generator task propagates
+    CancelledError into the in-flight `llm.astream` and retrieval awaits,
+    closing the upstream HTTP streams.
+
+    Every cancellation is recorded in metrics together with the tokens already
+    produced and an estimate of the tokens saved, based on the average output
+    of completed streams on the same endpoint.
+    """
+
+    def __init__(
+        self,
+        request,
+        endpoint: str,
+        stream: Optional[ReplayStream] = None,
+        produced_text: Optional[Callable[[], str]] = None,
+        poll_interval: float = STREAM_DISCONNECT_POLL_SECONDS,
+        grace_period: float = STREAM_RESUME_GRACE_SECONDS,
+    ):
+        self.request = request
+        self.endpoint = endpoint
+        self.stream = stream
+        self.produced_text = produced_text
+        self.poll_interval = poll_interval
+        self.grace_period = grace_period if stream is not None else 0
+        self.tasks: List[asyncio.Task] = []
+        self.cancelled = False
+        self._poller: Optional[asyncio.Task] = None
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+        if stream is not None:
+            stream.on_idle = self.release
+
+    def watch(self, task: asyncio.Task) -> asyncio.Task:
+        self.tasks.append(task)
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+        return task
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self.tasks)
+
+    async def _poll(self) -> None:
+        try:
+            while self.running:
+                if await self.request.is_disconnected():
+                    self.release()
+                    return
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            pass
+
+    def release(self) -> None:
+        """The client went away: cancel now, or after the resume grace period."""
+        if self.cancelled or not self.running:
+            return
+        if self.grace_period <= 0:
+            self.cancel("client disconnected")
+            return
+        if self._grace_timer is None:
+            self._grace_timer = asyncio.get_running_loop().call_later(self.grace_period, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self) -> None:
+        self._grace_timer = None
+        if self.stream is not None and self.stream.subscribers > 0:
+            # A client reattached; the stream calls release() again when it leaves
+            return
+        self.cancel("client disconnected")
+
+    def cancel(self, reason: str) -> None:
+        if self.cancelled or not self.running:
+            return
+        self.cancelled = True
+        for task in self.tasks:
+            if not task.done():
+                task.cancel()
+        if self.stream is not None:
+            self.stream.close()
+
+        produced = estimate_tokens(self.produced_text()) if self.produced_text else 0
+        average = (metrics.summary("stream_output_tokens", endpoint=self.endpoint) or {}).get("avg") or 0
+        saved = max(0, int(average) - produced)
+        metrics.inc("stream_cancellations_total", endpoint=self.endpoint)
+        metrics.inc("stream_tokens_before_cancel", produced, endpoint=self.endpoint)
+        metrics.inc("stream_tokens_saved_estimate", saved, endpoint=self.endpoint)
+        print(f"[Stream] ✂️ Cancelled {self.endpoint} stream ({reason}); ~{produced} tokens produced, ~{saved} saved")
+
+    def record_completion(self, output_tokens: int) -> None:
+        """Feed the per-endpoint average used to estimate saved tokens."""
+        if output_tokens > 0:
+            metrics.observe("stream_output_tokens", output_tokens, endpoint=self.endpoint)
+        metrics.inc("stream_completed_total", endpoint=self.endpoint)
+
+    def close(self) -> None:
+        """The original response ended; release the stream and stop polling."""
+        if self._poller is not None and not self._poller.done():
+            self._poller.cancel()
+        self.release()
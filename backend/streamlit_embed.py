@@ -14,6 +14,8 @@ try:
     from backend.doument_processor import process_knowledge_base_files
     from backend.embedding import embed_chunks_parallel
     from backend.models import DocumentInfo
+    from backend.utils.text_chunker import TextChunker
+    from backend.utils.dsa_utils import NearDuplicateFilter
     from backend.qdrant_service import (
         get_qdrant_client,
         get_qdrant_status,
@@ -25,6 +27,8 @@ except ImportError:
     from doument_processor import process_knowledge_base_files
     from embedding import embed_chunks_parallel
     from models import DocumentInfo
+    from utils.text_chunker import TextChunker
+    from utils.dsa_utils import NearDuplicateFilter
     from qdrant_service import (
         get_qdrant_client,
         get_qdrant_status,
@@ -33,7 +37,6 @@ except ImportError:
         QDRANT_UPSERT_BATCH_SIZE,
     )
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from qdrant_client import models
 import uuid
 from dotenv import load_dotenv
@@ -169,17 +172,22 @@ async def store_documents_in_collection(
             return False, message
         
         # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
+        text_splitter = TextChunker(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len,
         )
         
+        near_duplicates = NearDuplicateFilter()
+        dropped_chunks = 0
+        
         all_chunks = []
         all_metadatas = []
         
         for doc_info in documents:
             chunks = text_splitter.split_text(doc_info.content)
+            kept = near_duplicates.filter(chunks)
+            dropped_chunks += len(chunks) - len(kept)
+            chunks = [chunks[i] for i in kept]
             base_meta = {
                 "doc_id": doc_info.id,
                 "filename": doc_info.filename,
@@ -195,7 +203,7 @@ async def store_documents_in_collection(
                 all_chunks.append(chunk)
                 all_metadatas.append(chunk_meta)
         
-        st.info(f"📄 Split {len(documents)} documents into {len(all_chunks)} chunks")
+        st.info(f"📄 Split {len(documents)} documents into {len(all_chunks)} chunks ({dropped_chunks} near-duplicates skipped)")
         
         # Check for OpenAI API key before generating embeddings
         if not OPENAI_API_KEY:
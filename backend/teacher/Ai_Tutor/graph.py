@@ -18,6 +18,7 @@ try:
     from backend.teacher.Ai_Tutor.rag import rag_node
     from backend.teacher.Ai_Tutor.websearch import websearch_node
     from backend.teacher.Ai_Tutor.image import image_node
+    from backend.speculation import speculative_node
 except ImportError:
     from teacher.Ai_Tutor.graph_type import GraphState
     from teacher.Ai_Tutor.orchestrator import orchestrator_node, route_decision
@@ -25,6 +26,7 @@ except ImportError:
     from teacher.Ai_Tutor.rag import rag_node
     from teacher.Ai_Tutor.websearch import websearch_node
     from teacher.Ai_Tutor.image import image_node
+    from speculation import speculative_node
 
 
 def create_ai_tutor_graph():
@@ -35,9 +37,9 @@ def create_ai_tutor_graph():
     
     # Add nodes with tracing
     g.add_node("orchestrator", trace_node(orchestrator_node, "orchestrator"))
-    g.add_node("simple_llm", trace_node(simple_llm_node, "simple_llm"))
-    g.add_node("rag", trace_node(rag_node, "rag"))
-    g.add_node("websearch", trace_node(websearch_node, "websearch"))
+    g.add_node("simple_llm", trace_node(speculative_node("teacher", "simple_llm", simple_llm_node), "simple_llm"))
+    g.add_node("rag", trace_node(speculative_node("teacher", "rag", rag_node), "rag"))
+    g.add_node("websearch", trace_node(speculative_node("teacher", "websearch", websearch_node), "websearch"))
     g.add_node("image", trace_node(image_node, "image"))
     
     # Set entry point
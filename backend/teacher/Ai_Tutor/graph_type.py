@@ -38,4 +38,5 @@ class GraphState(TypedDict):
     edit_img_urls: Optional[List[str]] 
     img_urls: Optional[List[str]]
     next_node: Optional[str]  
+    speculation: Optional[Any]
 
@@ -8,21 +8,25 @@ backend_path = Path(__file__).resolve().parents[3]
 if str(backend_path) not in sys.path:
     sys.path.append(str(backend_path))
 
-import os
 import json
 import re
 import asyncio
 from typing import Dict, Any, List, Optional
 from pathlib import Path
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_groq import ChatGroq
 from langchain_google_genai import ChatGoogleGenerativeAI
 try:
-    from backend.llm import get_llm
+    from backend.llm import get_llm, get_groq_llm, record_llm_usage
     from backend.teacher.Ai_Tutor.graph_type import GraphState
+    from backend.fast_router import fast_route, record_fast_route, should_shadow, shadow_compare
+    from backend.intent_router import intent_route, log_routing
+    from backend.speculation import cancel_speculation, resolve_speculation, speculate
 except ImportError:
-    from llm import get_llm
+    from llm import get_llm, get_groq_llm, record_llm_usage
     from teacher.Ai_Tutor.graph_type import GraphState
+    from fast_router import fast_route, record_fast_route, should_shadow, shadow_compare
+    from intent_router import intent_route, log_routing
+    from speculation import cancel_speculation, resolve_speculation, speculate
 
 
 def load_orchestrator_prompt() -> str:
@@ -56,7 +60,16 @@ Return JSON: {"execution_order": ["node1", "node2"], "reasoning": "explanation"}
 </system>"""
 
 
-STATIC_SYS = load_orchestrator_prompt()
+# Sent after the XML prompt rather than after the per-turn context, so the
+# system message is byte-identical on every call.
+ROUTING_TASK = """<task>
+Analyze the query and full conversation history, then return JSON with execution_order (list of node names) and reasoning.
+Available nodes: SimpleLLM, RAG, WebSearch, Image
+Route to Image node when user explicitly requests image generation/editing with action verbs (generate, create, make, edit, modify, etc.).
+Consider the conversation context and uploaded documents when making routing decisions.
+</task>"""
+
+STATIC_SYS = load_orchestrator_prompt() + "\n\n" + ROUTING_TASK
 
 
 def normalize_route(name: str) -> str:
@@ -168,11 +181,7 @@ async def summarizer(state: GraphState, keep_last=2):
     user_prompt = f"Summarize this conversation:\n\n{full_old_text}"
 
     try:
-        llm = ChatGroq(
-            model="openai/gpt-oss-20b",
-            temperature=0.4,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        llm = get_groq_llm("openai/gpt-oss-20b", 0.4)
         result = await llm.ainvoke([
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_prompt)
@@ -249,26 +258,16 @@ async def analyze_query(
 <document_available>{bool(doc_url)}</document_available>
 <websearch_enabled>{is_websearch}</websearch_enabled>{uploaded_images_text}{doc_context_text}
 </system_state>
-</context>
-
-<task>
-Analyze the query and full conversation history, then return JSON with execution_order (list of node names) and reasoning.
-Available nodes: SimpleLLM, RAG, WebSearch, Image
-Route to Image node when user explicitly requests image generation/editing with action verbs (generate, create, make, edit, modify, etc.).
-Consider the conversation context and uploaded documents when making routing decisions.
-</task>"""
+</context>"""
         
         messages = [
             SystemMessage(content=STATIC_SYS),
             HumanMessage(content=dynamic_context)
         ]
 
-        chat = ChatGroq(
-            model="openai/gpt-oss-120b",
-            temperature=0.4,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        chat = get_groq_llm("openai/gpt-oss-120b", 0.4)
         response = await chat.ainvoke(messages)
+        record_llm_usage("teacher.orchestrator", response)
         content = (response.content or "").strip()
         
         print(f"[Orchestrator] 🤖 Analyzer Raw Output: {content}")
@@ -349,68 +348,91 @@ async def orchestrator_node(state: GraphState) -> GraphState:
         session_summary = sess.get("summary", "")
         
         print(f"[ORCHESTRATOR] 📜 Conversation history: {len(messages)} messages")
-        print(f"[ORCHESTRATOR] 🤖 Analyzing query to determine routing...")
         
-        # Parallel execution of analyze and tentative rewrite
-        analyze_task = analyze_query(
-            user_message=user_query,
-            recent_messages_text=conversation_history,
-            session_summary=session_summary,
-            last_route=last_route,
-            is_image=is_image,
-            uploaded_images=edit_img_urls,
+        def llm_route():
+            return analyze_query(
+                user_message=user_query,
+                recent_messages_text=conversation_history,
+                session_summary=session_summary,
+                last_route=last_route,
+                is_image=is_image,
+                uploaded_images=edit_img_urls,
+                new_uploaded_docs=new_uploaded_docs,
+                doc_url=doc_url,
+                is_websearch=True,
+            )
+        
+        decision = fast_route(
+            user_query,
             new_uploaded_docs=new_uploaded_docs,
-            doc_url=doc_url,
-            is_websearch=True,
+            last_route=last_route,
+            has_history=len(messages) > 1,
         )
+        has_documents = bool(doc_url or new_uploaded_docs)
+        if decision is None and not is_image and not edit_img_urls:
+            decision = await intent_route(user_query, has_documents=has_documents)
+        record_fast_route("teacher", decision)
+        speculation = None
+        try:
+            if decision:
+                result = decision.as_routing()
+                if should_shadow():
+                    shadow_compare("teacher", decision, llm_route, normalize_route)
+            else:
+                print(f"[ORCHESTRATOR] 🤖 Analyzing query to determine routing...")
+                speculation = await speculate("teacher", state, last_route, normalize_route, has_documents)
+                result = await llm_route()
+                log_routing("teacher", user_query, result, has_documents)
+            resolved_query = user_query  # Use original query directly since rewrite was removed
         
-        result = await analyze_task
-        resolved_query = user_query  # Use original query directly since rewrite was removed
-        
-        plan = result.get("execution_order", ["SimpleLLM"]) if result else ["SimpleLLM"]
-        if not plan:
-            plan = ["SimpleLLM"]
+            plan = result.get("execution_order", ["SimpleLLM"]) if result else ["SimpleLLM"]
+            if not plan:
+                plan = ["SimpleLLM"]
         
-        # Check for image node in plan
-        has_image_in_plan = any(task.lower() in ["image", "img"] for task in plan)
-        if not has_image_in_plan:
-            print(f"[Orchestrator] No image node in plan, clearing img_urls")
-            state["img_urls"] = []
+            # Check for image node in plan
+            has_image_in_plan = any(task.lower() in ["image", "img"] for task in plan)
+            if not has_image_in_plan:
+                print(f"[Orchestrator] No image node in plan, clearing img_urls")
+                state["img_urls"] = []
         
-        # Handle image editing scenario
-        if len(edit_img_urls) == len(new_uploaded_docs) and plan[0].lower() == "image":
-            state["img_urls"] = edit_img_urls
-            print(f"[Orchestrator] Image editing scenario detected")
-        elif uploaded_doc:
-            state["img_urls"] = []
-            print(f"[Orchestrator] Document uploaded scenario")
+            # Handle image editing scenario
+            if len(edit_img_urls) == len(new_uploaded_docs) and plan[0].lower() == "image":
+                state["img_urls"] = edit_img_urls
+                print(f"[Orchestrator] Image editing scenario detected")
+            elif uploaded_doc:
+                state["img_urls"] = []
+                print(f"[Orchestrator] Document uploaded scenario")
             
-            # Force RAG routing for new document uploads
-            if len(plan) == 1 and plan[0].lower() == "rag":
-                pass  # Already routing to RAG
-            elif len(plan) == 1 and plan[0].lower() != "rag":
-                plan = ["rag"]
-            elif len(plan) == 0:
-                plan = ["rag"]
+                # Force RAG routing for new document uploads
+                if len(plan) == 1 and plan[0].lower() == "rag":
+                    pass  # Already routing to RAG
+                elif len(plan) == 1 and plan[0].lower() != "rag":
+                    plan = ["rag"]
+                elif len(plan) == 0:
+                    plan = ["rag"]
             
-            print(f"[Orchestrator] New doc uploaded → updated plan = {plan}")
+                print(f"[Orchestrator] New doc uploaded → updated plan = {plan}")
         
-        plan = [normalize_route(task) for task in plan]
+            plan = [normalize_route(task) for task in plan]
         
-        print(f"[ORCHESTRATOR] 🗺️ Routing decision: {plan}")
-        print(f"[ORCHESTRATOR] 📋 Execution plan: {plan}")
+            print(f"[ORCHESTRATOR] 🗺️ Routing decision: {plan}")
+            print(f"[ORCHESTRATOR] 📋 Execution plan: {plan}")
         
-        state["tasks"] = plan
-        state["task_index"] = 0
-        state["current_task"] = plan[0]
+            state["tasks"] = plan
+            state["task_index"] = 0
+            state["current_task"] = plan[0]
         
-        # Use original query for all cases (rewrite removed)
-        state["resolved_query"] = user_query
-        print(f"[ORCHESTRATOR] ✅ Using original query: {user_query[:100]}...")
+            # Use original query for all cases (rewrite removed)
+            state["resolved_query"] = user_query
+            print(f"[ORCHESTRATOR] ✅ Using original query: {user_query[:100]}...")
         
-        route = normalize_route(plan[0])
-        state["route"] = route
-        state["next_node"] = route
+            route = normalize_route(plan[0])
+            state["route"] = route
+            state["next_node"] = route
+            state["speculation"] = await resolve_speculation(speculation, route)
+        except BaseException:
+            cancel_speculation(speculation)
+            raise
         
         print(f"[ORCHESTRATOR] ➡️ Next node: {route}")
         
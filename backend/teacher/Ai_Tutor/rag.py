@@ -17,8 +17,10 @@ from typing import List, Dict, Any, Optional
 
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.token_budget import fit_prompt
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from token_budget import fit_prompt
 try:
     from backend.teacher.Ai_Tutor.graph_type import GraphState
 except ImportError:
@@ -313,6 +315,80 @@ def _escape_xml(text: str) -> str:
         return ""
     return html.escape(str(text))
 
+
+# Static instructions come first and the per-request XML (profile, retrieved
+# chunks, history, query) goes in the user message, so the provider can serve
+# this prefix from its prompt cache on every turn.
+RAG_SYSTEM_PROMPT = """You are an expert AI Tutor. Your goal is to answer the user's question accurately using ONLY the XML context provided in the user message.
+
+<instructions>
+1. **Analyze the Context**: Look at the <retrieved_context>. The user has uploaded documents. The relevant chunks are provided inside <search_result> tags.
+2. **Prioritize Uploaded Data**: If the <search_result> contains information relevant to the user's question, you MUST base your answer on it. 
+3. **Multi-Document Synthesis**: If chunks come from different filenames (check <metadata>), synthesize the information. E.g., "Document A says X, while Document B says Y."
+4. **Citations**: When you use information from a document, mention the source naturally. Example: "According to the lecture notes..." or "As seen in [filename]...".
+5. **No Hallucination**: If the <retrieved_context> is empty or does not contain the answer, explicitly state that the uploaded documents do not contain that specific information, then offer general knowledge if appropriate.
+6. **Tone**: Be helpful, educational, and clear.
+
+7. **CRITICAL - Markdown Formatting**: Format ALL responses using proper Markdown syntax:
+
+   ### Headers:
+   - Use # for main topics (H1)
+   - Use ## for subtopics (H2) 
+   - Use ### for sections/activities (H3)
+   - Use #### for details/subsections (H4)
+
+   ### Lists:
+   - Use * or - for unordered lists (bullet points)
+   - Use 1. 2. 3. for ordered lists (numbered)
+   - Ensure proper spacing between list items
+
+   ### Emphasis:
+   - Use **bold text** for important concepts, key terms, or emphasis
+   - Use *italic text* for definitions or subtle emphasis
+   - Use `inline code` for technical terms, formulas, or specific instructions
+
+   ### Code Blocks:
+   - Use triple backticks with language specification for code examples:
+   ```python
+   def example():
+       return "formatted code"
+   ```
+
+   ### Tables:
+   - Use proper Markdown table syntax with | separators
+   - Include header row with alignment indicators
+
+   ### Blockquotes:
+   - Use > for important notes, tips, or quotes
+   > **Important**: This is a key concept from the document.
+
+   ### Document Analysis Structure:
+   When analyzing documents, structure responses as:
+
+   ## Document Analysis: [Topic]
+
+   Based on the uploaded documents, here's what I found:
+
+   ### Key Findings
+   * **Finding 1** - From [document name]
+   * **Finding 2** - From [document name]
+   * **Finding 3** - Cross-referenced from multiple sources
+
+   ### Detailed Analysis
+   [Provide a comprehensive, in-depth analysis of the query based on the retrieved chunks. DO NOT be brief. Elaborate on every key point found in the documents. If multiple documents mention a topic, synthesize them into a cohesive detailed explanation. Aim for at least 3-4 paragraphs of detailed content here. Ensure you cover nuances, exceptions, and specific details mentioned in the text.]
+
+   ### Supporting Evidence
+   [Quote or paraphrase specific relevant sections from the documents to support your analysis]
+
+   ### Summary
+   [Concise summary with actionable insights]
+
+   > **Source**: Information compiled from [list document names]
+
+   ALWAYS use this Markdown formatting to ensure content renders beautifully in the frontend interface. Provide DETAILED responses.
+</instructions>"""
+
+
 async def rag_node(state: GraphState) -> GraphState:
     """
     RAG node with Intelligent Document Selection and XML-Structured Prompting.
@@ -388,48 +464,57 @@ async def rag_node(state: GraphState) -> GraphState:
                 )
         except Exception as e:
             print(f"[RAG] ❌ Retrieval failed: {e}")
-    xml_documents = ""
-    if user_docs:
-        doc_entries = []
-        for i, doc in enumerate(user_docs):
-            meta = doc.metadata or {}
-            filename = _escape_xml(meta.get("filename", "Unknown File"))
-            file_type = _escape_xml(meta.get("file_type", "unknown"))
-            page_num = meta.get("page_number") or meta.get("page") or "N/A"
-            content = _escape_xml(doc.page_content)
-            entry = (
-                f'    <search_result index="{i+1}">\n'
-                f'        <metadata>\n'
-                f'            <filename>{filename}</filename>\n'
-                f'            <file_type>{file_type}</file_type>\n'
-                f'            <page_number>{page_num}</page_number>\n'
-                f'        </metadata>\n'
-                f'        <excerpt>\n{content}\n</excerpt>\n'
-                f'    </search_result>'
-            )
-            doc_entries.append(entry)
-        
-        xml_documents = "<retrieved_context>\n" + "\n".join(doc_entries) + "\n</retrieved_context>"
+    doc_entries = []
+    for i, doc in enumerate(user_docs):
+        meta = doc.metadata or {}
+        filename = _escape_xml(meta.get("filename", "Unknown File"))
+        file_type = _escape_xml(meta.get("file_type", "unknown"))
+        page_num = meta.get("page_number") or meta.get("page") or "N/A"
+        content = _escape_xml(doc.page_content)
+        entry = (
+            f'    <search_result index="{i+1}">\n'
+            f'        <metadata>\n'
+            f'            <filename>{filename}</filename>\n'
+            f'            <file_type>{file_type}</file_type>\n'
+            f'            <page_number>{page_num}</page_number>\n'
+            f'        </metadata>\n'
+            f'        <excerpt>\n{content}\n</excerpt>\n'
+            f'    </search_result>'
+        )
+        doc_entries.append(entry)
+
+    hist_entries = []
+    for m in messages[-5:]:
+        role = "user" if isinstance(m, HumanMessage) or (getattr(m, 'type', '') == 'human') else "assistant"
+        content = _escape_xml(m.content if hasattr(m, 'content') else str(m))
+        hist_entries.append(f'    <turn speaker="{role}">\n        {content}\n    </turn>')
+
+    teacher_data = state.get("teacher_data", {})
+    t_info = _escape_xml(format_teacher_data(teacher_data)) if teacher_data else ""
+
+    model_name = state.get("model")
+    fitted = fit_prompt(
+        model_name,
+        fixed=[RAG_SYSTEM_PROMPT, query],
+        history=hist_entries,
+        profile=t_info,
+        chunks=doc_entries,
+        chunk_scores=[(doc.metadata or {}).get("score", 0) for doc in user_docs],
+        route="teacher.rag",
+    )
+
+    if fitted.chunks:
+        xml_documents = "<retrieved_context>\n" + "\n".join(fitted.chunks) + "\n</retrieved_context>"
     else:
         xml_documents = "<retrieved_context>\n    <status>No relevant document segments found for this specific query.</status>\n</retrieved_context>"
-
     xml_history = ""
-    if messages:
-        hist_entries = []
-        for m in messages[-5:]:
-            role = "user" if isinstance(m, HumanMessage) or (getattr(m, 'type', '') == 'human') else "assistant"
-            content = _escape_xml(m.content if hasattr(m, 'content') else str(m))
-            hist_entries.append(f'    <turn speaker="{role}">\n        {content}\n    </turn>')
-        xml_history = "<conversation_history>\n" + "\n".join(hist_entries) + "\n</conversation_history>"
-    teacher_data = state.get("teacher_data", {})
+    if fitted.history:
+        xml_history = "<conversation_history>\n" + "\n".join(fitted.history) + "\n</conversation_history>"
     xml_teacher = ""
-    if teacher_data:
-        t_info = _escape_xml(format_teacher_data(teacher_data))
-        xml_teacher = f"<teacher_profile>\n{t_info}\n</teacher_profile>"
-
-    system_prompt = f"""You are an expert AI Tutor. Your goal is to answer the user's question accurately using ONLY the provided XML context.
+    if fitted.profile:
+        xml_teacher = f"<teacher_profile>\n{fitted.profile}\n</teacher_profile>"
 
-<input_data>
+    rag_input = f"""<input_data>
 {xml_teacher}
 
 {xml_documents}
@@ -437,86 +522,17 @@ async def rag_node(state: GraphState) -> GraphState:
 {xml_history}
 </input_data>
 
-<instructions>
-1. **Analyze the Context**: Look at the <retrieved_context>. The user has uploaded documents. The relevant chunks are provided inside <search_result> tags.
-2. **Prioritize Uploaded Data**: If the <search_result> contains information relevant to the user's question, you MUST base your answer on it. 
-3. **Multi-Document Synthesis**: If chunks come from different filenames (check <metadata>), synthesize the information. E.g., "Document A says X, while Document B says Y."
-4. **Citations**: When you use information from a document, mention the source naturally. Example: "According to the lecture notes..." or "As seen in [filename]...".
-5. **No Hallucination**: If the <retrieved_context> is empty or does not contain the answer, explicitly state that the uploaded documents do not contain that specific information, then offer general knowledge if appropriate.
-6. **Tone**: Be helpful, educational, and clear.
-
-7. **CRITICAL - Markdown Formatting**: Format ALL responses using proper Markdown syntax:
-
-   ### Headers:
-   - Use # for main topics (H1)
-   - Use ## for subtopics (H2) 
-   - Use ### for sections/activities (H3)
-   - Use #### for details/subsections (H4)
-
-   ### Lists:
-   - Use * or - for unordered lists (bullet points)
-   - Use 1. 2. 3. for ordered lists (numbered)
-   - Ensure proper spacing between list items
-
-   ### Emphasis:
-   - Use **bold text** for important concepts, key terms, or emphasis
-   - Use *italic text* for definitions or subtle emphasis
-   - Use `inline code` for technical terms, formulas, or specific instructions
-
-   ### Code Blocks:
-   - Use triple backticks with language specification for code examples:
-   ```python
-   def example():
-       return "formatted code"
-   ```
-
-   ### Tables:
-   - Use proper Markdown table syntax with | separators
-   - Include header row with alignment indicators
-
-   ### Blockquotes:
-   - Use > for important notes, tips, or quotes
-   > **Important**: This is a key concept from the document.
-
-   ### Document Analysis Structure:
-   When analyzing documents, structure responses as:
-
-   ## Document Analysis: [Topic]
-
-   Based on the uploaded documents, here's what I found:
-
-   ### Key Findings
-   * **Finding 1** - From [document name]
-   * **Finding 2** - From [document name]
-   * **Finding 3** - Cross-referenced from multiple sources
-
-   ### Detailed Analysis
-   [Provide a comprehensive, in-depth analysis of the query based on the retrieved chunks. DO NOT be brief. Elaborate on every key point found in the documents. If multiple documents mention a topic, synthesize them into a cohesive detailed explanation. Aim for at least 3-4 paragraphs of detailed content here. Ensure you cover nuances, exceptions, and specific details mentioned in the text.]
-
-   ### Supporting Evidence
-   [Quote or paraphrase specific relevant sections from the documents to support your analysis]
-
-   ### Summary
-   [Concise summary with actionable insights]
-
-   > **Source**: Information compiled from [list document names]
-
-   ALWAYS use this Markdown formatting to ensure content renders beautifully in the frontend interface. Provide DETAILED responses.
-</instructions>
-
 <current_user_query>
 {query}
 </current_user_query>
 
 Answer the user's query now based on the XML data above."""
-    model_name = state.get("model") 
     llm = get_llm(model_name, temperature=0.5) 
     
-    llm_messages = [SystemMessage(content=system_prompt)]
-    llm_messages.append(HumanMessage(content=query))
+    llm_messages = [SystemMessage(content=RAG_SYSTEM_PROMPT), HumanMessage(content=rag_input)]
     
     full_response, _ = await stream_with_token_tracking(
-        llm, llm_messages, chunk_callback=chunk_callback, state=state
+        llm, llm_messages, chunk_callback=chunk_callback, state=state, route="teacher.rag"
     )
     
     state["response"] = full_response
@@ -13,11 +13,13 @@ from typing import Dict, Any
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.token_budget import fit_prompt, message_text
     from backend.teacher.Ai_Tutor.graph_type import GraphState
     from backend.teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     from backend.utils.dsa_utils import ContentDeduplicator
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from token_budget import fit_prompt, message_text
     from teacher.Ai_Tutor.graph_type import GraphState
     from teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     try:
@@ -33,6 +35,9 @@ except ImportError:
                 return False
 
 
+SYSTEM_PROMPT = "You are an expert AI tutor. Process the following XML request and provide helpful, educational responses."
+
+
 def _format_last_turns(messages, k=3):
     """Format last k messages for context."""
     if not messages:
@@ -243,99 +248,27 @@ def get_student_names_list(teacher_data: Any) -> str:
     return ", ".join(student_names) if student_names else ""
 
 
-async def simple_llm_node(state: GraphState) -> GraphState:
-    """
-    Simple LLM + KBRAG node.
-    Uses a simple LLM with knowledge base context, student data, generated content, and teacher data.
-    """
-    messages = state.get("messages", [])
-    topic = state.get("topic", "")
-    subject = state.get("subject", "")
-    student_data = state.get("student_data", {})
-    teacher_data = state.get("teacher_data", {})
-    content_type = state.get("content_type")
-    language = state.get("language", "English")
-    
-    # If subject is Hindi and language is English (default), switch to Hindi
-    if subject and subject.strip().lower() == "hindi" and language == "English":
-        language = "Hindi"
-        
-    model = state.get("model")  
-    chunk_callback = state.get("chunk_callback")
-    student_context = format_student_data(student_data)
-    teacher_context = format_teacher_data(teacher_data)
-    content_context = format_content_type(content_type)
-    student_names_list = get_student_names_list(teacher_data)
-    
-    # Extract grade from teacher_data
-    grade = ""
-    if isinstance(teacher_data, dict):
-        grades = teacher_data.get("grades", [])
-        if grades and isinstance(grades, list) and len(grades) > 0:
-            grade = str(grades[0])
-    
-    kb_retrieved_contexts = []
-    print(f"[SIMPLE_LLM] 📊 Extracted grade: '{grade}', subject: '{subject}', language: '{language}'")
-    if grade and subject and language:
-        subject_normalized = subject.lower().replace(" ", "_")
-        lang_code = LANGUAGES.get(language, language).lower()
-        collection_name = f"kb_grad_{grade}_sub_{subject_normalized}_lang_{lang_code}"
-        user_query = ""
-        if messages:
-            for msg in reversed(messages):
-                if hasattr(msg, 'content') and msg.content:
-                    msg_type = getattr(msg, 'type', None) or getattr(msg, 'role', None)
-                    if msg_type and msg_type.lower() in ('human', 'user'):
-                        user_query = msg.content
-                        break
-        if not user_query:
-            user_query = state.get("resolved_query") or state.get("user_query", "")
-        if user_query:
-            try:
-                print(f"[SimpleLLM KB] 🔍 Searching collection '{collection_name}' for query: {user_query[:120]}...")
-                kb_retrieved_contexts = await retrieve_kb_context(collection_name, user_query, top_k=5)
-                
-                # Optimization: Content Deduplication
-                if kb_retrieved_contexts:
-                    deduplicator = ContentDeduplicator()
-                    unique_contexts = []
-                    for text in kb_retrieved_contexts:
-                        if text and not deduplicator.is_duplicate(text):
-                            unique_contexts.append(text)
-                    kb_retrieved_contexts = unique_contexts
-
-                if kb_retrieved_contexts:
-                    print(f"[SimpleLLM KB] ✅ Retrieved {len(kb_retrieved_contexts)} unique context chunk(s) from knowledge base")
-                else:
-                    print(f"[SimpleLLM KB] ⚠️ No knowledge base context found for collection '{collection_name}'")
-            except asyncio.CancelledError:
-                print(f"[SimpleLLM KB] ⚠️ KB search was cancelled")
-                kb_retrieved_contexts = []
-                raise
-            except Exception as e:
-                print(f"[SimpleLLM KB] ❌ Error retrieving KB context: {e}")
-                import traceback
-                traceback.print_exc()
-                kb_retrieved_contexts = []
-    else:
-        missing = []
-        if not grade:
-            missing.append("grade")
-        if not subject:
-            missing.append("subject")
-        if not language:
-            missing.append("language")
-        print(f"[SimpleLLM KB] ⚠️ Skipping KB search - missing: {', '.join(missing)}")
-    formatted_kb_context = ""
-    if kb_retrieved_contexts:
-        formatted_kb_context = "\n\n".join(kb_retrieved_contexts[:5])
-    xml_prompt = f"""
+def _build_xml_prompt(
+    recent_conversation,
+    topic,
+    subject,
+    grade,
+    language,
+    formatted_kb_context,
+    teacher_context,
+    student_names_list,
+    student_context,
+    content_context,
+    has_kb,
+):
+    """The simple_llm_node request; `has_kb` selects the knowledge-base wording."""
+    return f"""
 <ai_tutor_request>
     <context>
         <role>Expert AI Tutor for Teachers</role>
         <task>Help teachers with educational content, students, and curriculum-related questions</task>
         <recent_conversation>
-{_format_last_turns(messages, k=3)}
+{recent_conversation}
         </recent_conversation>
     </context>
     
@@ -347,12 +280,12 @@ async def simple_llm_node(state: GraphState) -> GraphState:
     </parameters>
     
     <knowledge_base>
-{f"        <collection>kb_grad_{grade}_sub_{subject.lower().replace(' ', '_')}_lang_{LANGUAGES.get(language, language).lower()}</collection>" if kb_retrieved_contexts else "        <collection>None</collection>"}
+{f"        <collection>kb_grad_{grade}_sub_{subject.lower().replace(' ', '_')}_lang_{LANGUAGES.get(language, language).lower()}</collection>" if has_kb else "        <collection>None</collection>"}
         <reference_text>
 {formatted_kb_context if formatted_kb_context else "            No knowledge base content available."}
         </reference_text>
         <guidance>
-            {f"Use ONLY the reference material when answering curriculum-related questions. This is authoritative curriculum content for Grade {grade}, Subject: {subject}, Language: {language}." if kb_retrieved_contexts else "No knowledge base content available for this grade/subject/language combination."}
+            {f"Use ONLY the reference material when answering curriculum-related questions. This is authoritative curriculum content for Grade {grade}, Subject: {subject}, Language: {language}." if has_kb else "No knowledge base content available for this grade/subject/language combination."}
         </guidance>
     </knowledge_base>
     
@@ -381,7 +314,7 @@ async def simple_llm_node(state: GraphState) -> GraphState:
             <item>Complete teacher information including their students (with performance, achievements, feedback, issues)</item>
             <item>Teacher statistics (total content generated, assessments, number of students)</item>
             <item>All content generated by the teacher (lesson plans, worksheets, quizzes, presentations, etc.) with their types, subjects, grades, and content</item>
-{f"            <item>Curriculum knowledge base content for Grade {grade}, Subject: {subject}, Language: {language} - Use this authoritative curriculum material to answer curriculum-related questions</item>" if kb_retrieved_contexts else ""}
+{f"            <item>Curriculum knowledge base content for Grade {grade}, Subject: {subject}, Language: {language} - Use this authoritative curriculum material to answer curriculum-related questions</item>" if has_kb else ""}
         </access>
     </capabilities>
     
@@ -393,7 +326,7 @@ async def simple_llm_node(state: GraphState) -> GraphState:
         <responsibility>Answer questions related to the subject, topic, and grade level using curriculum knowledge base when available</responsibility>
         <responsibility>Provide educational guidance based on all available context</responsibility>
         <responsibility>Help teachers address student issues and celebrate achievements</responsibility>
-{f"        <responsibility>When answering curriculum-related questions, prioritize information from the knowledge base section as it contains authoritative curriculum content</responsibility>" if kb_retrieved_contexts else ""}
+{f"        <responsibility>When answering curriculum-related questions, prioritize information from the knowledge base section as it contains authoritative curriculum content</responsibility>" if has_kb else ""}
     </role_responsibilities>
     
     <student_handling>
@@ -421,7 +354,7 @@ async def simple_llm_node(state: GraphState) -> GraphState:
     <instructions>
         Provide clear, educational, and contextually relevant responses based on all available information. 
         When discussing students, always use their names to avoid confusion.
-        {f"When answering curriculum-related questions, use the knowledge base reference material as the primary source of information." if kb_retrieved_contexts else ""}
+        {f"When answering curriculum-related questions, use the knowledge base reference material as the primary source of information." if has_kb else ""}
         
         CRITICAL: Format ALL responses using proper Markdown syntax following these guidelines:
         
@@ -488,11 +421,131 @@ async def simple_llm_node(state: GraphState) -> GraphState:
     </instructions>
 </ai_tutor_request>
 """
+
+
+async def simple_llm_node(state: GraphState) -> GraphState:
+    """
+    Simple LLM + KBRAG node.
+    Uses a simple LLM with knowledge base context, student data, generated content, and teacher data.
+    """
+    messages = state.get("messages", [])
+    topic = state.get("topic", "")
+    subject = state.get("subject", "")
+    student_data = state.get("student_data", {})
+    teacher_data = state.get("teacher_data", {})
+    content_type = state.get("content_type")
+    language = state.get("language", "English")
+    
+    # If subject is Hindi and language is English (default), switch to Hindi
+    if subject and subject.strip().lower() == "hindi" and language == "English":
+        language = "Hindi"
+        
+    model = state.get("model")  
+    chunk_callback = state.get("chunk_callback")
+    student_context = format_student_data(student_data)
+    teacher_context = format_teacher_data(teacher_data)
+    content_context = format_content_type(content_type)
+    student_names_list = get_student_names_list(teacher_data)
+    
+    # Extract grade from teacher_data
+    grade = ""
+    if isinstance(teacher_data, dict):
+        grades = teacher_data.get("grades", [])
+        if grades and isinstance(grades, list) and len(grades) > 0:
+            grade = str(grades[0])
+    
+    kb_retrieved_contexts = []
+    print(f"[SIMPLE_LLM] 📊 Extracted grade: '{grade}', subject: '{subject}', language: '{language}'")
+    if grade and subject and language:
+        subject_normalized = subject.lower().replace(" ", "_")
+        lang_code = LANGUAGES.get(language, language).lower()
+        collection_name = f"kb_grad_{grade}_sub_{subject_normalized}_lang_{lang_code}"
+        user_query = ""
+        if messages:
+            for msg in reversed(messages):
+                if hasattr(msg, 'content') and msg.content:
+                    msg_type = getattr(msg, 'type', None) or getattr(msg, 'role', None)
+                    if msg_type and msg_type.lower() in ('human', 'user'):
+                        user_query = msg.content
+                        break
+        if not user_query:
+            user_query = state.get("resolved_query") or state.get("user_query", "")
+        if user_query:
+            try:
+                print(f"[SimpleLLM KB] 🔍 Searching collection '{collection_name}' for query: {user_query[:120]}...")
+                kb_retrieved_contexts = await retrieve_kb_context(collection_name, user_query, top_k=5)
+                
+                # Optimization: Content Deduplication
+                if kb_retrieved_contexts:
+                    deduplicator = ContentDeduplicator()
+                    unique_contexts = []
+                    for text in kb_retrieved_contexts:
+                        if text and not deduplicator.is_duplicate(text):
+                            unique_contexts.append(text)
+                    kb_retrieved_contexts = unique_contexts
+
+                if kb_retrieved_contexts:
+                    print(f"[SimpleLLM KB] ✅ Retrieved {len(kb_retrieved_contexts)} unique context chunk(s) from knowledge base")
+                else:
+                    print(f"[SimpleLLM KB] ⚠️ No knowledge base context found for collection '{collection_name}'")
+            except asyncio.CancelledError:
+                print(f"[SimpleLLM KB] ⚠️ KB search was cancelled")
+                kb_retrieved_contexts = []
+                raise
+            except Exception as e:
+                print(f"[SimpleLLM KB] ❌ Error retrieving KB context: {e}")
+                import traceback
+                traceback.print_exc()
+                kb_retrieved_contexts = []
+    else:
+        missing = []
+        if not grade:
+            missing.append("grade")
+        if not subject:
+            missing.append("subject")
+        if not language:
+            missing.append("language")
+        print(f"[SimpleLLM KB] ⚠️ Skipping KB search - missing: {', '.join(missing)}")
     model_name = model if model else "x-ai/grok-4.1-fast"
+    prompt_args = dict(
+        topic=topic,
+        subject=subject,
+        grade=grade,
+        language=language,
+        student_names_list=student_names_list,
+        student_context=student_context,
+        content_context=content_context,
+        has_kb=bool(kb_retrieved_contexts),
+    )
+    # The template is counted as rendered, with the profile and chunks left
+    # out; the recap uses the untrimmed history, an upper bound for the one sent
+    template = _build_xml_prompt(
+        recent_conversation=_format_last_turns(messages, k=3),
+        formatted_kb_context="",
+        teacher_context="",
+        **prompt_args,
+    )
+    fitted = fit_prompt(
+        model_name,
+        fixed=[SYSTEM_PROMPT, template],
+        history=[message_text(m) for m in messages],
+        profile=teacher_context,
+        chunks=kb_retrieved_contexts[:5],
+        route="teacher.simple_llm",
+    )
+    messages = messages[len(messages) - len(fitted.history):]
+    teacher_context = fitted.profile
+    formatted_kb_context = "\n\n".join(fitted.chunks)
+    xml_prompt = _build_xml_prompt(
+        recent_conversation=_format_last_turns(messages, k=3),
+        formatted_kb_context=formatted_kb_context,
+        teacher_context=teacher_context,
+        **prompt_args,
+    )
     llm = get_llm(model_name, temperature=0.6)
     
     llm_messages = [
-        SystemMessage(content="You are an expert AI tutor. Process the following XML request and provide helpful, educational responses."),
+        SystemMessage(content=SYSTEM_PROMPT),
         HumanMessage(content=xml_prompt)
     ]
     
@@ -518,7 +571,8 @@ async def simple_llm_node(state: GraphState) -> GraphState:
             llm,
             llm_messages,
             chunk_callback=chunk_callback,
-            state=state
+            state=state,
+            route="teacher.simple_llm"
         )
         
         state["simple_llm_response"] = full_response
@@ -15,11 +15,13 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_tavily import TavilySearch
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.rate_limiter import limiters
     from backend.teacher.Ai_Tutor.graph_type import GraphState
     from backend.teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     from backend.utils.dsa_utils import ContentDeduplicator
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from rate_limiter import limiters
     from teacher.Ai_Tutor.graph_type import GraphState
     from teacher.Content_generation.lesson_plan import retrieve_kb_context, LANGUAGES
     try:
@@ -52,7 +54,8 @@ async def _web_search(topic: str, subject: str, grade: str, language: str) -> st
         )
         
         query = f"{topic} {subject} grade {grade} {language}"
-        results = await tavily_tool.ainvoke(query)
+        async with limiters.slot("tavily"):
+            results = await tavily_tool.ainvoke(query)
         if isinstance(results, list):
             formatted_results = []
             for result in results[:5]:
@@ -367,7 +370,8 @@ def example():
         llm,
         llm_messages,
         chunk_callback=chunk_callback,
-        state=state
+        state=state,
+        route="teacher.websearch"
     )
     
     # Update state - store both raw results and the LLM response
@@ -84,6 +84,56 @@ async def retrieve_kb_context(collection_name: str, query_text: str, top_k: int
         import traceback
         traceback.print_exc()
         return []
+
+
+# Instructions are identical for every request and go in the system message;
+# the request-specific XML follows in the user message so providers can cache
+# the instruction prefix.
+LESSON_PLAN_INSTRUCTIONS = """You are an expert curriculum designer. Output strictly valid XML.
+
+<instructions>
+        Generate the lesson plan in rich Markdown using ONLY the following section order and headings. Each narrative subsection should contain at least 3 sentences or bullet points to ensure depth. Do not add extra commentary, summaries, or sections.
+        1. Title line formatted exactly as: "Lesson Plan: <topic>" (use the subject when no topic is given).
+        2. "## Estimated Total Duration" followed by a single line with total time (e.g., "45 minutes").
+        3. "## Learning Objectives" with:
+           - A "### Primary Objective" paragraph.
+           - A "### Measurable Success Criteria" numbered list (3 items).
+           - A "### Prerequisite Knowledge" bullet list (3 items).
+           - A "### Relevant Standards/Frameworks" bullet list naming NGSS/CCSS/state items when available.
+        4. "## Materials" as a bullet list (use items provided in the input when available, otherwise infer).
+        5. "## Step-by-Step Procedure" with one subsection per session using "### Session X (YY minutes)" and the nested structure:
+           - "#### Introduction", "#### Direct Instruction", "#### Guided Practice", "#### Independent Practice", "#### Assessment/Check for Understanding".
+           - Under each subheading, include 2-4 detailed steps (sentences or numbered items) that reference timing, teacher moves, and student actions.
+        6. "## Differentiation Strategies" with two subheadings:
+           - "### Support" (bullet list for emerging learners).
+           - "### Extension" (bullet list for advanced learners).
+        7. Only when <include_assessment> is True: "## Assessment Strategy" section containing: (a) Diagnostic Tools, (b) Formative Checks, (c) Summative Tasks, and (d) "Assessment Questions & Solutions" listing 3-5 problems aligned to the session topics with step-by-step solutions.
+        8. Only when <multimedia_suggestions> is True: "## Multimedia Suggestions" bullet list including URLs or descriptions if available; include accessibility or contingency notes. Use ONLY the verified YouTube links listed in <multimedia_links>.
+        9. "## References" bullet list for any cited frameworks/resources (may repeat standards if no other references).
+        
+        Additional constraints:
+        - You MUST use only the content provided inside <reference_text>. Do not add outside facts.
+        - If information is missing from <reference_text>, state explicitly: "The knowledge base does not cover ___." Do not invent details.
+        - Use only the sections above; do not prepend or append explanations.
+        - Keep tone professional and classroom-ready.
+        - Integrate provided context (big ideas, SEL, cultural notes) inside the relevant sections instead of creating new headings.
+        - Output ONLY valid Markdown.
+        
+        MARKDOWN FORMATTING REQUIREMENTS:
+        - Output your responses in proper Markdown format, adhering to Shadcn UI typography guidelines for headings, lists, code blocks, and tables.
+        - Ensure proper spacing between list items and paragraphs.
+        - Use triple backticks for code blocks with language specification (e.g., ```python\nprint('Hello')\n```).
+        - Use Markdown table syntax for tabular data.
+        - Use `*` or `-` for unordered lists and `1.` for ordered lists.
+        - Use `**bold**` and `*italic*` for emphasis.
+        - Use `>` for blockquotes.
+        - Ensure headings are hierarchical (e.g., `# H1`, `## H2`, `### H3`, `#### H4`).
+        - Avoid excessive blank lines.
+        - Do not include any introductory or concluding remarks outside the Markdown content itself.
+        - When generating content, prioritize clarity and readability for educational purposes.
+</instructions>"""
+
+
 async def generate_lesson_plan(
     data: Dict[str, Any],
     chunk_callback: Optional[Callable[[str], Awaitable[None]]] = None
@@ -154,10 +204,11 @@ async def generate_lesson_plan(
     if multimedia_suggestion:
         if multimedia_links:
             multimedia_prompt_block = "\n".join(
-                f"            - {url}" for url in multimedia_links
+                f"        - {url}" for url in multimedia_links
             )
         else:
-            multimedia_prompt_block = "            - (No live links available)"
+            multimedia_prompt_block = "        - (No live links available)"
+        multimedia_prompt_block = f"    <multimedia_links>\n{multimedia_prompt_block}\n    </multimedia_links>"
     else:
         multimedia_prompt_block = ""
 
@@ -192,59 +243,20 @@ async def generate_lesson_plan(
             <multimedia_suggestions>{multimedia_suggestion}</multimedia_suggestions>
         </features>
     </parameters>
-    <instructions>
-        Generate the lesson plan in rich Markdown using ONLY the following section order and headings. Each narrative subsection should contain at least 3 sentences or bullet points to ensure depth. Do not add extra commentary, summaries, or sections.
-        1. Title line formatted exactly as: "Lesson Plan: {topic or subject}".
-        2. "## Estimated Total Duration" followed by a single line with total time (e.g., "45 minutes").
-        3. "## Learning Objectives" with:
-           - A "### Primary Objective" paragraph.
-           - A "### Measurable Success Criteria" numbered list (3 items).
-           - A "### Prerequisite Knowledge" bullet list (3 items).
-           - A "### Relevant Standards/Frameworks" bullet list naming NGSS/CCSS/state items when available.
-        4. "## Materials" as a bullet list (use items provided in the input when available, otherwise infer).
-        5. "## Step-by-Step Procedure" with one subsection per session using "### Session X (YY minutes)" and the nested structure:
-           - "#### Introduction", "#### Direct Instruction", "#### Guided Practice", "#### Independent Practice", "#### Assessment/Check for Understanding".
-           - Under each subheading, include 2-4 detailed steps (sentences or numbered items) that reference timing, teacher moves, and student actions.
-        6. "## Differentiation Strategies" with two subheadings:
-           - "### Support" (bullet list for emerging learners).
-           - "### Extension" (bullet list for advanced learners).
-        {'7. "## Assessment Strategy" section containing: (a) Diagnostic Tools, (b) Formative Checks, (c) Summative Tasks, and (d) "Assessment Questions & Solutions" listing 3-5 problems aligned to the session topics with step-by-step solutions.' if include_assessment else ''}
-{f'        8. "## Multimedia Suggestions" bullet list including URLs or descriptions if available; include accessibility or contingency notes. Use ONLY these verified YouTube links:\\n{multimedia_prompt_block}' if multimedia_suggestion else ''}
-        9. "## References" bullet list for any cited frameworks/resources (may repeat standards if no other references).
-        
-        Additional constraints:
-        - You MUST use only the content provided inside <reference_text>. Do not add outside facts.
-        - If information is missing from <reference_text>, state explicitly: "The knowledge base does not cover ___." Do not invent details.
-        - Use only the sections above; do not prepend or append explanations.
-        - Keep tone professional and classroom-ready.
-        - Integrate provided context (big ideas, SEL, cultural notes) inside the relevant sections instead of creating new headings.
-        - Output ONLY valid Markdown.
-        
-        MARKDOWN FORMATTING REQUIREMENTS:
-        - Output your responses in proper Markdown format, adhering to Shadcn UI typography guidelines for headings, lists, code blocks, and tables.
-        - Ensure proper spacing between list items and paragraphs.
-        - Use triple backticks for code blocks with language specification (e.g., ```python\nprint('Hello')\n```).
-        - Use Markdown table syntax for tabular data.
-        - Use `*` or `-` for unordered lists and `1.` for ordered lists.
-        - Use `**bold**` and `*italic*` for emphasis.
-        - Use `>` for blockquotes.
-        - Ensure headings are hierarchical (e.g., `# H1`, `## H2`, `### H3`, `#### H4`).
-        - Avoid excessive blank lines.
-        - Do not include any introductory or concluding remarks outside the Markdown content itself.
-        - When generating content, prioritize clarity and readability for educational purposes.
-    </instructions>
+{multimedia_prompt_block}
 </lesson_plan_request>
 """
     llm = get_llm("google/gemini-2.5-flash-lite", 0.6)
     
     messages = [
-        SystemMessage(content="You are an expert curriculum designer. Output strictly valid XML."),
+        SystemMessage(content=LESSON_PLAN_INSTRUCTIONS),
         HumanMessage(content=xml_prompt)
     ]
     
     full_response, _token_usage = await stream_with_token_tracking(
         llm,
         messages,
-        chunk_callback=chunk_callback
+        chunk_callback=chunk_callback,
+        route="content.lesson_plan",
     )
     return full_response
@@ -13,8 +13,10 @@ if str(backend_path) not in sys.path:
 # Import functions from llm.py
 try:
     from backend.llm import get_llm, stream_with_token_tracking
+    from backend.rate_limiter import limiters
 except ImportError:
     from llm import get_llm, stream_with_token_tracking
+    from rate_limiter import limiters
 
 load_dotenv()
 
@@ -80,7 +82,8 @@ async def run_search_agent(
     if ai_msg.tool_calls:
         logger.info(f"Model decided to use tools: {ai_msg.tool_calls}")
         for tool_call in ai_msg.tool_calls:
-            search_results = await tavily_tool.ainvoke(tool_call["args"])
+            async with limiters.slot("tavily"):
+                search_results = await tavily_tool.ainvoke(tool_call["args"])
             messages.append(
                 ToolMessage(content=json.dumps(search_results), tool_call_id=tool_call["id"])
             )
@@ -0,0 +1,220 @@
+"""
+Token budgets for prompt assembly.
+
+Nodes describe the variable parts of their prompt (conversation history, the
+teacher/student profile, retrieved chunks) and `fit_prompt` trims them to the
+model's prompt budget in a fixed order: oldest history turns first, then the
+profile (cut from the end, so names and headline stats survive), then the
+lowest-scored chunks. The fixed parts (instructions, the query) are counted
+but never trimmed.
+
+Tokens are counted locally with tiktoken (TOKEN_BUDGET_ENCODING). The
+encoding is loaded once at startup in a worker thread (`warm_token_encoding`),
+because tiktoken fetches the BPE file over the network on a cold cache; set
+TIKTOKEN_CACHE_DIR to a directory holding the file to avoid the download.
+Until the encoding is loaded, or if it can't be, counting falls back to ~4
+characters per token, so request-path counting never touches the network.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    from backend.metrics import metrics
+except ImportError:
+    from metrics import metrics
+
+TOKEN_BUDGET_ENABLED = os.getenv("TOKEN_BUDGET_ENABLED", "true").lower() in ("1", "true", "yes")
+TOKEN_BUDGET_ENCODING = os.getenv("TOKEN_BUDGET_ENCODING", "o200k_base")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "16000"))
+TOKEN_BUDGET_OUTPUT_RESERVE = int(os.getenv("TOKEN_BUDGET_OUTPUT_RESERVE", "4096"))
+TOKEN_BUDGET_MIN_PROFILE = int(os.getenv("TOKEN_BUDGET_MIN_PROFILE", "300"))
+# Session messages handed to the graph per turn; the node budget picks from these
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+
+# Context windows of the small-context models we route to; everything else is
+# assumed large enough that PROMPT_TOKEN_BUDGET is the binding limit.
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "llama-3.1-8b-instant": 8192,
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "gemma2-9b-it": 8192,
+    "mistral-saba-24b": 32768,
+}
+# Per-model prompt budgets, e.g. {"x-ai/grok-4.1-fast": 24000}
+MODEL_PROMPT_BUDGETS: Dict[str, int] = json.loads(os.getenv("PROMPT_TOKEN_BUDGETS", "{}"))
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """The loaded encoding, or None; never loads it (see `warm_token_encoding`)."""
+    return _encoding
+
+
+def load_token_encoding() -> None:
+    """Load TOKEN_BUDGET_ENCODING, blocking (may download the BPE file)."""
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return
+    try:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(TOKEN_BUDGET_ENCODING)
+        print(f"[TokenBudget] ✅ Loaded tiktoken encoding '{TOKEN_BUDGET_ENCODING}'")
+    except Exception as e:
+        _encoding_failed = True
+        print(f"[TokenBudget] ⚠️ tiktoken encoding '{TOKEN_BUDGET_ENCODING}' unavailable, estimating: {e}")
+
+
+async def warm_token_encoding() -> None:
+    """Load the encoding in a worker thread so the event loop never blocks on it."""
+    if TOKEN_BUDGET_ENABLED:
+        await asyncio.to_thread(load_token_encoding)
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` within `max_tokens`."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def prompt_budget(model_name: Optional[str]) -> int:
+    """Input tokens a prompt for `model_name` may use."""
+    if model_name in MODEL_PROMPT_BUDGETS:
+        return int(MODEL_PROMPT_BUDGETS[model_name])
+    budget = PROMPT_TOKEN_BUDGET
+    window = MODEL_CONTEXT_WINDOWS.get((model_name or "").split("/")[-1])
+    if window:
+        budget = min(budget, window - TOKEN_BUDGET_OUTPUT_RESERVE)
+    return budget
+
+
+class FittedPrompt:
+    """The sections that fit, in their original order."""
+
+    __slots__ = ("history", "profile", "chunks", "chunk_indexes", "tokens", "budget", "trimmed")
+
+    def __init__(self, history, profile, chunks, chunk_indexes, tokens, budget, trimmed):
+        self.history: List[str] = history
+        self.profile: str = profile
+        self.chunks: List[str] = chunks
+        self.chunk_indexes: List[int] = chunk_indexes
+        self.tokens: int = tokens
+        self.budget: int = budget
+        self.trimmed: Dict[str, int] = trimmed
+
+
+def fit_prompt(
+    model_name: Optional[str],
+    fixed: Sequence[str] = (),
+    history: Sequence[str] = (),
+    profile: str = "",
+    chunks: Sequence[str] = (),
+    chunk_scores: Optional[Sequence[float]] = None,
+    reserve: int = 0,
+    route: str = "",
+) -> FittedPrompt:
+    """
+    Trim history, profile and chunks so that they plus `fixed` fit the budget.
+
+    History is oldest-first and loses turns from the front; the most recent
+    turn is only dropped once the profile and chunks can give up no more.
+    Chunks without scores are assumed to be ranked best-first. At least one
+    chunk is kept. `reserve` sets aside tokens for template text that isn't
+    passed in `fixed`.
+
+    Returns a FittedPrompt; `chunk_indexes` maps kept chunks back to the
+    caller's documents, and the kept history is always a suffix of `history`.
+    """
+    history = list(history)
+    chunks = list(chunks)
+    budget = prompt_budget(model_name)
+    if not TOKEN_BUDGET_ENABLED:
+        return FittedPrompt(history, profile, chunks, list(range(len(chunks))), 0, budget, {})
+
+    fixed_tokens = reserve + sum(count_tokens(text) for text in fixed)
+    history_tokens = [count_tokens(text) for text in history]
+    profile_tokens = count_tokens(profile)
+    chunk_tokens = [count_tokens(text) for text in chunks]
+    total = fixed_tokens + sum(history_tokens) + profile_tokens + sum(chunk_tokens)
+    trimmed = {"history_turns": 0, "profile_tokens": 0, "chunks": 0}
+
+    # 1. Oldest history turns, keeping the latest one for now
+    while total > budget and len(history) > 1:
+        total -= history_tokens.pop(0)
+        history.pop(0)
+        trimmed["history_turns"] += 1
+
+    # 2. Profile, down to TOKEN_BUDGET_MIN_PROFILE
+    if total > budget and profile_tokens > TOKEN_BUDGET_MIN_PROFILE:
+        keep = max(TOKEN_BUDGET_MIN_PROFILE, profile_tokens - (total - budget))
+        profile = truncate_tokens(profile, keep)
+        new_tokens = count_tokens(profile)
+        trimmed["profile_tokens"] = profile_tokens - new_tokens
+        total -= profile_tokens - new_tokens
+        profile_tokens = new_tokens
+
+    # 3. Lowest-scored chunks
+    indexes = list(range(len(chunks)))
+    if total > budget and len(chunks) > 1:
+        scores = list(chunk_scores) if chunk_scores is not None else [-i for i in indexes]
+        for index in sorted(indexes, key=lambda i: scores[i]):
+            if total <= budget or len(indexes) == 1:
+                break
+            indexes.remove(index)
+            total -= chunk_tokens[index]
+            trimmed["chunks"] += 1
+
+    # 4. Whatever history is left
+    while total > budget and history:
+        total -= history_tokens.pop(0)
+        history.pop(0)
+        trimmed["history_turns"] += 1
+
+    label = route or model_name or "unknown"
+    metrics.observe("prompt_tokens_budgeted", total, route=label)
+    if any(trimmed.values()):
+        metrics.inc("prompt_budget_trims_total", route=label)
+        print(f"[TokenBudget] ✂️ {label}: trimmed {trimmed} to {total}/{budget} tokens")
+    if total > budget:
+        metrics.inc("prompt_budget_overflows_total", route=label)
+        print(f"[TokenBudget] ⚠️ {label}: {total} tokens still over the {budget} budget")
+
+    return FittedPrompt(
+        history,
+        profile,
+        [chunks[i] for i in indexes],
+        indexes,
+        total,
+        budget,
+        trimmed,
+    )
+
+
+def message_text(message: Any) -> str:
+    """Text of a LangChain message, dict message or plain string, for counting."""
+    if isinstance(message, str):
+        return message
+    if isinstance(message, dict):
+        return str(message.get("content", ""))
+    content = getattr(message, "content", "")
+    return content if isinstance(content, str) else str(content)
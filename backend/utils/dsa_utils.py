@@ -1,6 +1,12 @@
 import hashlib
 import heapq
-from typing import List, Any, Callable, Dict, Set
+import math
+import re
+import zlib
+from collections import Counter
+from typing import List, Any, Callable, Dict, Iterable, Optional, Set
+
+import numpy as np
 
 class ContentDeduplicator:
     """
@@ -73,9 +79,11 @@ class LRUCache:
     (which is a Doubly Linked List + Hash Map in Python).
     """
 
-    def __init__(self, capacity: int = 100):
+    def __init__(self, capacity: int = 100, on_evict: Optional[Callable[[str, Any], None]] = None):
         self.capacity = capacity
         self.cache = OrderedDict()
+        # Called with (key, value) for entries pushed out by capacity
+        self.on_evict = on_evict
 
     def get(self, key: str) -> Any:
         if key not in self.cache:
@@ -89,4 +97,157 @@ class LRUCache:
             self.cache.move_to_end(key)
         self.cache[key] = value
         if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+            evicted_key, evicted_value = self.cache.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted_value)
+
+
+_DIGITS_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+")
+
+
+class BoilerplateDetector:
+    """
+    Finds header/footer lines that recur across a large share of pages.
+
+    Only the first/last `edge_lines` non-empty lines of each page (fewer on
+    short pages) are candidates, so repeated lines in the body of the text are
+    never touched.
+    Lines are normalised (whitespace collapsed, lower-cased, digit runs replaced
+    by '#') before hashing with CRC32, so "Page 12 of 300" and "Page 13 of 300"
+    count as the same line.
+    """
+
+    def __init__(
+        self,
+        min_page_share: float = 0.5,
+        min_pages: int = 3,
+        edge_lines: int = 3,
+        max_line_length: int = 150,
+    ):
+        self.min_page_share = min_page_share
+        self.min_pages = min_pages
+        self.edge_lines = edge_lines
+        self.max_line_length = max_line_length
+        self.page_count = 0
+        self.line_page_counts: Counter = Counter()
+
+    @staticmethod
+    def line_key(line: str) -> int:
+        normalised = _DIGITS_RE.sub("#", " ".join(line.split()).lower())
+        return zlib.crc32(normalised.encode("utf-8"))
+
+    def _edge_indexes(self, lines: List[str]) -> List[int]:
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        # Short pages (slides, title pages) only expose their first/last line
+        edge = max(1, min(self.edge_lines, len(non_empty) // 4))
+        edges = non_empty[:edge] + non_empty[-edge:]
+        return sorted({i for i in edges if len(lines[i].strip()) <= self.max_line_length})
+
+    def observe(self, page_text: str) -> None:
+        """Record the candidate lines of one page."""
+        lines = page_text.split("\n")
+        keys = {self.line_key(lines[i]) for i in self._edge_indexes(lines)}
+        self.line_page_counts.update(keys)
+        self.page_count += 1
+
+    def fit(self, pages: Iterable[str]) -> "BoilerplateDetector":
+        for page_text in pages:
+            self.observe(page_text)
+        return self
+
+    def is_boilerplate(self, line: str) -> bool:
+        if self.page_count < self.min_pages:
+            return False
+        threshold = max(self.min_pages, math.ceil(self.min_page_share * self.page_count))
+        return self.line_page_counts.get(self.line_key(line), 0) >= threshold
+
+    def strip(self, page_text: str) -> str:
+        """Remove recurring header/footer lines from one page."""
+        if self.page_count < self.min_pages:
+            return page_text
+        lines = page_text.split("\n")
+        drop = {i for i in self._edge_indexes(lines) if self.is_boilerplate(lines[i])}
+        if not drop:
+            return page_text
+        return "\n".join(line for i, line in enumerate(lines) if i not in drop)
+
+
+_SIMHASH_BITS = np.arange(64, dtype=np.uint64)
+_MASK64 = (1 << 64) - 1
+
+
+def simhash(text: str, shingle_size: int = 3) -> Optional[int]:
+    """
+    64-bit SimHash over word shingles, weighted by shingle frequency.
+    Returns None for empty text.
+
+    Feature hashes use Python's built-in string hash, so fingerprints are only
+    comparable within one process.
+    """
+    tokens = _WORD_RE.findall(text.lower())
+    if not tokens:
+        return None
+    if len(tokens) < shingle_size:
+        features = Counter([" ".join(tokens)])
+    else:
+        features = Counter(
+            " ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)
+        )
+
+    hashes = np.fromiter((hash(f) & _MASK64 for f in features), dtype=np.uint64, count=len(features))
+    weights = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+    bits = ((hashes[:, None] >> _SIMHASH_BITS) & np.uint64(1)).astype(np.int64)
+    scores = (weights[:, None] * (2 * bits - 1)).sum(axis=0)
+    return int(((scores > 0).astype(np.uint64) << _SIMHASH_BITS).sum())
+
+
+class NearDuplicateFilter:
+    """
+    Drops near-duplicate texts (repeated exercises, reprinted tables) using
+    SimHash fingerprints.
+
+    Fingerprints are split into `max_distance + 1` bands; two fingerprints
+    within `max_distance` bits must agree on at least one band, so only texts
+    sharing a band bucket are compared.
+    """
+
+    def __init__(self, max_distance: int = 3, min_tokens: int = 8):
+        self.max_distance = max_distance
+        self.min_tokens = min_tokens
+        bands = max_distance + 1
+        width = 64 // bands
+        self._bands = [
+            (i * width, 64 - i * width if i == bands - 1 else width)
+            for i in range(bands)
+        ]
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> shift) & ((1 << width) - 1) for shift, width in self._bands]
+
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Return True if `text` is within `max_distance` bits of a text seen
+        before; otherwise remember it and return False. Very short texts are
+        never treated as duplicates.
+        """
+        if len(_WORD_RE.findall(text)) < self.min_tokens:
+            return False
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return False
+
+        band_values = self._band_values(fingerprint)
+        for bucket, value in zip(self._buckets, band_values):
+            for candidate in bucket.get(value, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return True
+
+        for bucket, value in zip(self._buckets, band_values):
+            bucket.setdefault(value, []).append(fingerprint)
+        return False
+
+    def filter(self, texts: Iterable[str]) -> List[int]:
+        """Return the indexes of `texts` that are not near-duplicates."""
+        return [i for i, text in enumerate(texts) if not self.is_duplicate(text)]
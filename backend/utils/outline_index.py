@@ -0,0 +1,248 @@
+"""
+Outline (table of contents) index for chapter/section-targeted retrieval.
+
+At ingestion the PDF outline is turned into entries with page ranges, and
+every chunk payload is tagged with the chapter/section entries covering its
+page. At query time explicit references such as "chapter 4", "section 4.2" or
+"the section on photosynthesis" are resolved with a payload-filter scroll,
+skipping query embedding and vector search entirely. Topics are only taken
+from an explicit "section/chapter on|about|titled ..." phrase.
+"""
+import asyncio
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import models
+
+OUTLINE_MAX_CHUNKS = int(os.getenv("OUTLINE_MAX_CHUNKS", "20"))
+OUTLINE_SCROLL_BATCH = int(os.getenv("OUTLINE_SCROLL_BATCH", "256"))
+
+# Payload fields written on every chunk of a document that has an outline
+OUTLINE_PAYLOAD_INDEXES = {
+    "chapter_number": models.PayloadSchemaType.INTEGER,
+    "section_numbers": models.PayloadSchemaType.KEYWORD,
+    "toc_ids": models.PayloadSchemaType.INTEGER,
+    "toc_path": models.PayloadSchemaType.TEXT,
+}
+
+_ROMAN_VALUES = {"i": 1, "v": 5, "x": 10, "l": 50, "c": 100, "d": 500, "m": 1000}
+# Arabic numbers, or well-formed roman numerals up to XXXIX; looser patterns
+# read words like "mix" or "did" as numerals
+_NUMBER = r"(\d{1,3}|(?=[ivx])x{0,3}(?:ix|iv|v?i{0,3}))(?!\w)"
+
+_TITLE_KEYWORD_NUMBER_RE = re.compile(rf"^\s*(?:(?:chapter|unit|part|lesson|ch)\s+|ch\.\s*){_NUMBER}", re.I)
+_TITLE_NUMBERING_RE = re.compile(r"^\s*(\d+(?:\.\d+)*)(?=[\s.:)\-–]|$)")
+
+_QUERY_CHAPTER_RE = re.compile(rf"\b(?:(?:chapter|unit)\s+|ch\.\s*){_NUMBER}", re.I)
+_QUERY_SECTION_NUMBER_RE = re.compile(r"\bsection\s+(\d+(?:\.\d+)*)\b", re.I)
+_QUERY_TOPIC_RE = re.compile(
+    r"\b(?:section|chapter|unit|lesson|topic)\s+(?:on|about|titled|called|named)\s+"
+    r"[\"'“‘]?(?:the\s+)?([^\"'”’?.!,;]{3,80})",
+    re.I,
+)
+
+
+def _roman_to_int(value: str) -> Optional[int]:
+    value = value.lower()
+    if not value or any(ch not in _ROMAN_VALUES for ch in value):
+        return None
+    total = 0
+    for current, following in zip(value, value[1:] + " "):
+        current_value = _ROMAN_VALUES[current]
+        if following != " " and _ROMAN_VALUES[following] > current_value:
+            total -= current_value
+        else:
+            total += current_value
+    return total
+
+
+def _to_int(value: str) -> Optional[int]:
+    if not value:
+        return None
+    return int(value) if value.isdigit() else _roman_to_int(value)
+
+
+def build_outline(toc: List[List[Any]], page_count: int) -> List[Dict[str, Any]]:
+    """
+    Turn a PyMuPDF `get_toc()` result ([level, title, page], ...) into entries
+    with inclusive page ranges and parsed chapter/section numbers.
+    """
+    raw = [
+        (int(level), str(title).strip(), int(page))
+        for level, title, page, *_ in toc
+        if page and int(page) > 0 and str(title).strip()
+    ]
+
+    entries: List[Dict[str, Any]] = []
+    ancestors: Dict[int, Dict[str, Any]] = {}
+    for toc_id, (level, title, start_page) in enumerate(raw):
+        end_page = page_count
+        for next_level, _, next_page in raw[toc_id + 1:]:
+            if next_level <= level:
+                end_page = max(start_page, next_page - 1)
+                break
+
+        section_number = None
+        chapter_number = None
+        keyword_match = _TITLE_KEYWORD_NUMBER_RE.match(title)
+        numbering_match = _TITLE_NUMBERING_RE.match(title)
+        if keyword_match:
+            chapter_number = _to_int(keyword_match.group(1))
+            section_number = str(chapter_number) if chapter_number is not None else None
+        elif numbering_match:
+            section_number = numbering_match.group(1)
+            chapter_number = int(section_number.split(".")[0])
+
+        ancestors = {lvl: entry for lvl, entry in ancestors.items() if lvl < level}
+        if chapter_number is None:
+            for lvl in sorted(ancestors):
+                if ancestors[lvl]["chapter_number"] is not None:
+                    chapter_number = ancestors[lvl]["chapter_number"]
+                    break
+
+        entry = {
+            "toc_id": toc_id,
+            "level": level,
+            "title": title,
+            "start_page": start_page,
+            "end_page": min(end_page, page_count) if page_count else end_page,
+            "chapter_number": chapter_number,
+            "section_number": section_number,
+        }
+        ancestors[level] = entry
+        entries.append(entry)
+    return entries
+
+
+def outline_payload_for_page(outline: List[Dict[str, Any]], page_number: Optional[int]) -> Dict[str, Any]:
+    """Payload fields describing the outline entries that cover `page_number`."""
+    if not outline or page_number is None:
+        return {}
+    covering = [e for e in outline if e["start_page"] <= page_number <= e["end_page"]]
+    if not covering:
+        return {}
+
+    covering.sort(key=lambda e: (e["level"], e["start_page"]))
+    chapter = covering[0]
+    section = covering[-1]
+    payload: Dict[str, Any] = {
+        "toc_ids": [e["toc_id"] for e in covering],
+        "toc_path": " > ".join(e["title"] for e in covering).lower(),
+        "chapter_title": chapter["title"],
+        "section_title": section["title"],
+        "section_numbers": [e["section_number"] for e in covering if e["section_number"]],
+    }
+    chapter_number = next((e["chapter_number"] for e in covering if e["chapter_number"] is not None), None)
+    if chapter_number is not None:
+        payload["chapter_number"] = chapter_number
+    return payload
+
+
+def parse_outline_reference(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Detect an explicit chapter/section reference in a user query.
+
+    Returns one of {"section_number": "4.2"}, {"chapter_number": 4} or
+    {"topic": "photosynthesis"}, or None if the query does not name a part of
+    the outline.
+    """
+    if not query:
+        return None
+
+    match = _QUERY_SECTION_NUMBER_RE.search(query)
+    if match:
+        return {"section_number": match.group(1)}
+
+    match = _QUERY_CHAPTER_RE.search(query)
+    if match:
+        chapter_number = _to_int(match.group(1))
+        if chapter_number is not None:
+            return {"chapter_number": chapter_number}
+
+    match = _QUERY_TOPIC_RE.search(query)
+    if match:
+        topic = " ".join(match.group(1).split()).lower()
+        if topic:
+            return {"topic": topic}
+    return None
+
+
+def outline_filter(reference: Dict[str, Any], base_filter: Optional[models.Filter] = None) -> models.Filter:
+    """Build the payload filter for a parsed outline reference."""
+    if "section_number" in reference:
+        condition = models.FieldCondition(
+            key="section_numbers", match=models.MatchValue(value=reference["section_number"])
+        )
+    elif "chapter_number" in reference:
+        condition = models.FieldCondition(
+            key="chapter_number", match=models.MatchValue(value=reference["chapter_number"])
+        )
+    else:
+        condition = models.FieldCondition(key="toc_path", match=models.MatchText(text=reference["topic"]))
+
+    must: List[Any] = [condition]
+    if base_filter is not None:
+        must.append(base_filter)
+    return models.Filter(must=must)
+
+
+async def retrieve_by_outline(
+    client,
+    collection_name: str,
+    query: str,
+    base_filter: Optional[models.Filter] = None,
+    limit: int = OUTLINE_MAX_CHUNKS,
+) -> Optional[List[Any]]:
+    """
+    Resolve an explicit chapter/section reference with a payload-filter scroll.
+
+    Returns the matching points in reading order (page, chunk index), or None
+    when the query has no outline reference or nothing matched, in which case
+    callers fall back to vector search.
+    """
+    reference = parse_outline_reference(query)
+    if reference is None:
+        return None
+
+    scroll_filter = outline_filter(reference, base_filter)
+    positions: List[Any] = []
+    offset = None
+    try:
+        # Scroll order is by (uuid) point id, so collect the position of every
+        # matching chunk, then fetch the first `limit` in reading order.
+        while True:
+            batch, offset = await asyncio.to_thread(
+                client.scroll,
+                collection_name=collection_name,
+                scroll_filter=scroll_filter,
+                limit=OUTLINE_SCROLL_BATCH,
+                offset=offset,
+                with_payload=["page_number", "chunk_index"],
+                with_vectors=False,
+            )
+            positions.extend(batch)
+            if offset is None:
+                break
+
+        if not positions:
+            print(f"[Outline] No outline match for {reference}, falling back to vector search")
+            return None
+
+        positions.sort(key=lambda p: ((p.payload or {}).get("page_number") or 0, (p.payload or {}).get("chunk_index") or 0))
+        ids = [point.id for point in positions[:limit]]
+        fetched = await asyncio.to_thread(
+            client.retrieve,
+            collection_name=collection_name,
+            ids=ids,
+            with_payload=True,
+            with_vectors=False,
+        )
+    except Exception as e:
+        print(f"[Outline] ⚠️ Outline lookup failed for {reference}: {e}")
+        return None
+
+    by_id = {point.id: point for point in fetched}
+    points = [by_id[point_id] for point_id in ids if point_id in by_id]
+    print(f"[Outline] 📑 Resolved {reference} to {len(points)} of {len(positions)} chunk(s) without vector search")
+    return points or None
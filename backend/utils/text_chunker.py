@@ -0,0 +1,164 @@
+"""
+Offset-based recursive text chunker.
+
+Drop-in replacement for LangChain's RecursiveCharacterTextSplitter on the
+ingestion hot paths. Instead of materialising every intermediate split as a new
+string (re.split, separator re-concatenation, list slicing while merging), the
+chunker works on (start, end) offsets into the source buffer and only slices
+once per emitted chunk.
+
+With the default settings (separators ["\\n\\n", "\\n", " ", ""], separators kept
+at the start of the following piece, whitespace stripped, `len` as length
+function) the output is character-for-character identical to
+`RecursiveCharacterTextSplitter(chunk_size, chunk_overlap, length_function=len)`.
+"""
+from collections import deque
+from typing import Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Paragraph -> line -> sentence -> word -> character. Not LangChain compatible,
+# but keeps sentences intact where the chunk size allows.
+SENTENCE_SEPARATORS = ["\n\n", "\n", ". ", "? ", "! ", "; ", ", ", " ", ""]
+
+Span = Tuple[int, int]
+
+
+class TextChunker:
+    """
+    Recursive paragraph/sentence-aware chunker operating on offsets.
+
+    Args:
+        chunk_size: Maximum chunk length as measured by `length_function`.
+        chunk_overlap: Target overlap between consecutive chunks.
+        separators: Ordered separators to try, coarsest first.
+        length_function: Length of a text slice; defaults to character count,
+            which is computed from offsets without slicing.
+        strip_whitespace: Strip leading/trailing whitespace of merged chunks.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: Optional[Sequence[str]] = None,
+        length_function: Optional[Callable[[str], int]] = None,
+        strip_whitespace: bool = True,
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+        self.length_function = length_function
+        self.strip_whitespace = strip_whitespace
+
+    @classmethod
+    def from_tiktoken(cls, encoding_name: str = "cl100k_base", **kwargs) -> "TextChunker":
+        """Build a chunker that sizes chunks in tokens instead of characters."""
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("Token-based chunking requires tiktoken. Install with: pip install tiktoken") from e
+
+        encoding = tiktoken.get_encoding(encoding_name)
+        return cls(
+            length_function=lambda text: len(encoding.encode(text, disallowed_special=())),
+            **kwargs,
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        """Split `text` into chunks."""
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_spans(self, text: str) -> List[Span]:
+        """Split `text` and return (start, end) offsets of every chunk."""
+        spans: List[Span] = []
+        if text:
+            self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def _length(self, text: str, start: int, end: int) -> int:
+        if self.length_function is None:
+            return end - start
+        return self.length_function(text[start:end])
+
+    def _split(self, text: str, start: int, end: int, separators: Sequence[str], out: List[Span]) -> None:
+        # Pick the first separator present in this range
+        separator = separators[-1]
+        next_separators: Sequence[str] = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                next_separators = separators[i + 1:]
+                break
+
+        good: List[Tuple[int, int, int]] = []
+        for piece_start, piece_end in self._pieces(text, start, end, separator):
+            length = self._length(text, piece_start, piece_end)
+            if length < self.chunk_size:
+                good.append((piece_start, piece_end, length))
+                continue
+
+            if good:
+                self._merge(text, good, out)
+                good = []
+            if not next_separators:
+                out.append((piece_start, piece_end))
+            else:
+                self._split(text, piece_start, piece_end, next_separators, out)
+
+        if good:
+            self._merge(text, good, out)
+
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> List[Span]:
+        """Contiguous pieces of [start, end), each beginning with `separator`."""
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+
+        pieces: List[Span] = []
+        step = len(separator)
+        prev = start
+        pos = text.find(separator, start, end)
+        while pos != -1:
+            if pos > prev:
+                pieces.append((prev, pos))
+            prev = pos
+            pos = text.find(separator, pos + step, end)
+        if end > prev:
+            pieces.append((prev, end))
+        return pieces
+
+    def _merge(self, text: str, pieces: List[Tuple[int, int, int]], out: List[Span]) -> None:
+        """
+        Greedily merge contiguous pieces into chunks of at most chunk_size,
+        carrying up to chunk_overlap of the previous chunk into the next one.
+        """
+        window: deque = deque()
+        total = 0
+        for piece in pieces:
+            length = piece[2]
+            if total + length > self.chunk_size and window:
+                self._emit(text, window[0][0], window[-1][1], out)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= window.popleft()[2]
+            window.append(piece)
+            total += length
+
+        if window:
+            self._emit(text, window[0][0], window[-1][1], out)
+
+    def _emit(self, text: str, start: int, end: int, out: List[Span]) -> None:
+        if self.strip_whitespace:
+            segment = text[start:end]
+            stripped = segment.lstrip()
+            start += len(segment) - len(stripped)
+            end = start + len(stripped.rstrip())
+        if end > start:
+            out.append((start, end))
@@ -4,6 +4,11 @@ from typing import List, Optional
 
 from tavily import TavilyClient
 
+try:
+    from backend.rate_limiter import limiters
+except ImportError:
+    from rate_limiter import limiters
+
 _tavily_client: Optional[TavilyClient] = None
 
 
@@ -35,13 +40,14 @@ async def get_youtube_links(topic: str, max_results: int = 3) -> List[str]:
     print(f"[Multimedia] Searching for YouTube links for topic: {topic}")   
     query = f"educational YouTube video about {topic}"
     try:
-        response = await asyncio.to_thread(
-            client.search,
-            query=query,
-            max_results=max_results * 2,
-            search_depth="advanced",
-            include_domains=["youtube.com", "youtu.be"],
-        )
+        async with limiters.slot("tavily"):
+            response = await asyncio.to_thread(
+                client.search,
+                query=query,
+                max_results=max_results * 2,
+                search_depth="advanced",
+                include_domains=["youtube.com", "youtu.be"],
+            )
     except Exception as exc:
         print(f"[Multimedia] Tavily search failed: {exc}")
         return []